@@ -15,8 +15,8 @@ import re
 sys.path.append(abspath('../../../'))
 from models.load_model import load
 from examples.csj.s5.exp.dataset.load_dataset_hierarchical import Dataset
-from utils.io.labels.character import Idx2char, Char2idx
-from utils.io.labels.word import Idx2word, Char2word
+from utils.io.labels.character import Idx2char
+from utils.io.labels.word import Idx2word
 from utils.config import load_config
 from utils.evaluation.edit_distance import compute_wer
 from utils.evaluation.resolving_unk import resolve_unk
@@ -105,8 +105,6 @@ def decode(model, dataset, eval_batch_size, beam_width, beam_width_sub,
     """
     idx2word = Idx2word(dataset.vocab_file_path)
     idx2char = Idx2char(dataset.vocab_file_path_sub)
-    char2idx = Char2idx(dataset.vocab_file_path_sub)
-    char2word = Char2word(dataset.vocab_file_path, dataset.vocab_file_path_sub)
 
     if save_path is not None:
         sys.stdout = open(join(model.model_dir, 'decode.txt'), 'w')
@@ -122,23 +120,13 @@ def decode(model, dataset, eval_batch_size, beam_width, beam_width_sub,
                 max_decode_len=MAX_DECODE_LEN_WORD,
                 max_decode_len_sub=MAX_DECODE_LEN_CHAR)
         else:
-            # best_hyps, aw, perm_idx = model.decode(
-            #     batch['xs'], batch['x_lens'],
-            #     beam_width=beam_width,
-            #     max_decode_len=MAX_DECODE_LEN_WORD)
-            best_hyps, aw, perm_idx = model.decode(
+            best_hyps, aw, best_hyps_sub, aw_sub, perm_idx = model.decode_multi_task(
                 batch['xs'], batch['x_lens'],
-                # beam_width=beam_width,
-                beam_width=2,
+                beam_width=beam_width,
                 max_decode_len=MAX_DECODE_LEN_WORD,
-                joint_decoding=True,
-                space_index=char2idx('_')[0],
-                char2word=char2word)
-            best_hyps_sub, aw_sub, _ = model.decode(
-                batch['xs'], batch['x_lens'],
-                beam_width=beam_width_sub,
-                max_decode_len=MAX_DECODE_LEN_CHAR,
-                task_index=1)
+                beam_width_sub=beam_width_sub,
+                max_decode_len_sub=MAX_DECODE_LEN_CHAR,
+                return_aw=True)
 
         ys = batch['ys'][perm_idx]
         y_lens = batch['y_lens'][perm_idx]
@@ -113,7 +113,8 @@ def plot(model, dataset, eval_batch_size, beam_width, length_penalty,
         best_hyps, aw, perm_idx = model.decode(
             batch['xs'], batch['x_lens'],
             beam_width=beam_width,
-            max_decode_len=max_decode_len)
+            max_decode_len=max_decode_len,
+            return_aw=True)
 
         ys = batch['ys'][perm_idx]
         y_lens = batch['y_lens'][perm_idx]
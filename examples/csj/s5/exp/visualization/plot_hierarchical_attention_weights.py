@@ -111,15 +111,13 @@ def plot(model, dataset, eval_batch_size, beam_width, beam_width_sub,
     for batch, is_new_epoch in dataset:
 
         # Decode
-        best_hyps, aw, perm_idx = model.decode(
+        best_hyps, aw, best_hyps_sub, aw_sub, perm_idx = model.decode_multi_task(
             batch['xs'], batch['x_lens'],
             beam_width=beam_width,
-            max_decode_len=MAX_DECODE_LEN_WORD)
-        best_hyps_sub, aw_sub, _ = model.decode(
-            batch['xs'], batch['x_lens'],
-            beam_width=beam_width_sub,
-            max_decode_len=MAX_DECODE_LEN_CHAR,
-            task_index=1)
+            max_decode_len=MAX_DECODE_LEN_WORD,
+            beam_width_sub=beam_width_sub,
+            max_decode_len_sub=MAX_DECODE_LEN_CHAR,
+            return_aw=True)
 
         for b in range(len(batch['xs'])):
 
@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Load transcripts for the language model (Librispeech corpus).
+   Only the transcript column of the dataset files is used, so acoustic
+   features are not loaded.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from os.path import join
+import pandas as pd
+import numpy as np
+
+from utils.dataset.base import Base
+
+
+class Dataset(Base):
+
+    def __init__(self, data_type, data_size, label_type,
+                 batch_size, vocab_file_path,
+                 data_save_path='/n/sd8/inaguma/corpus/librispeech/dataset',
+                 max_epoch=None, shuffle=False, sort_utt=False,
+                 reverse=False, sort_stop_epoch=None, save_format='numpy'):
+        """A class for loading transcripts.
+        Args:
+            data_type (string): train or dev_clean or dev_other or test_clean
+                or test_other
+            data_size (string): 100h or 460h or 960h
+            label_type (string): characater or characater_capital_divide or
+                word_freq1 or word_freq5 or word_freq10 or word_freq15
+            batch_size (int): the size of mini-batch
+            vocab_file_path (string): path to the vocabulary file
+            data_save_path (string, optional): path to the dataset files
+            max_epoch (int, optional): the max epoch. None means infinite loop.
+            shuffle (bool, optional): if True, shuffle utterances. This is
+                disabled when sort_utt is True.
+            sort_utt (bool, optional): if True, sort all utterances by the
+                number of labels in the ascending order
+            reverse (bool, optional): if True, sort utteraces in the
+                descending order
+            sort_stop_epoch (int, optional): After sort_stop_epoch, training
+                will revert back to a random order
+            save_format (string, optional): numpy or htk
+        """
+        # NOTE: transcripts of the test sets are not tokenized
+        if data_type in ['test_clean', 'test_other']:
+            raise ValueError('Transcripts of %s are not tokenized.' % data_type)
+        self.is_test = False
+
+        self.data_type = data_type
+        self.data_size = data_size
+        self.label_type = label_type
+        self.batch_size = batch_size
+        self.max_epoch = max_epoch
+        self.shuffle = shuffle
+        self.sort_utt = sort_utt
+        self.sort_stop_epoch = sort_stop_epoch
+        self.num_enque = None
+
+        super(Dataset, self).__init__(vocab_file_path=vocab_file_path)
+
+        # Load dataset file
+        dataset_path = join(data_save_path, save_format, data_size, data_type,
+                            label_type + '.csv')
+        df = pd.read_csv(dataset_path)
+        df = df.loc[:, ['transcript']]
+        df = df[df['transcript'].notnull()]
+        # NOTE: sort_utt uses the number of labels instead of frames
+        df['frame_num'] = df['transcript'].map(
+            lambda x: len(str(x).split(' ')))
+
+        # Sort transcripts
+        if sort_utt:
+            df = df.sort_values(by='frame_num', ascending=not reverse)
+
+        self.df = df
+        self.rest = set(list(df.index))
+
+    def select_batch_size(self, batch_size, min_frame_num_batch):
+        return batch_size
+
+    def make_batch(self, data_indices):
+        """Create mini-batch per step.
+        Args:
+            data_indices (np.ndarray):
+        Returns:
+            batch (dict):
+                ys (np.ndarray): target labels of size `[B, T_out]`
+                y_lens (np.ndarray): lengths of target labels of size `[B]`
+        """
+        str_indices_list = np.array(self.df['transcript'][data_indices])
+        max_label_num = max(self.df['frame_num'][data_indices])
+
+        ys = np.full((len(data_indices), max_label_num), self.pad_value,
+                     dtype=np.int32)
+        y_lens = np.zeros((len(data_indices),), dtype=np.int32)
+        for b in range(len(data_indices)):
+            indices = list(map(int, str(str_indices_list[b]).split(' ')))
+            ys[b, :len(indices)] = indices
+            y_lens[b] = len(indices)
+
+        return {'ys': ys, 'y_lens': y_lens}
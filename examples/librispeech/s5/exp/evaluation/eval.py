@@ -28,6 +28,20 @@ parser.add_argument('--beam_width', type=int, default=1,
                     ' 1 disables beam search, which mean greedy decoding.')
 parser.add_argument('--eval_batch_size', type=int, default=1,
                     help='the size of mini-batch in evaluation')
+parser.add_argument('--decode_workers', type=int, default=1,
+                    help='the number of processes for CTC beam search')
+parser.add_argument('--rnnlm_path', type=str, default=None,
+                    help='path to the RNN language model for shallow fusion')
+parser.add_argument('--rnnlm_weight', type=float, default=0.3,
+                    help='the weight of the RNN language model')
+parser.add_argument('--beam_score_threshold', type=float, default=0,
+                    help='prune hypotheses worse than the best one by this score (0 disables)')
+parser.add_argument('--beam_max_active', type=int, default=0,
+                    help='the maximum number of active hypotheses per step (0 means beam_width)')
+parser.add_argument('--end_detection', action='store_true',
+                    help='stop beam search once no active hypothesis can beat the best complete one')
+parser.add_argument('--ctc_weight', type=float, default=0,
+                    help='the weight of CTC prefix scores in joint CTC/attention decoding (0 disables)')
 parser.add_argument('--max_decode_len', type=int, default=600,  # or 100
                     help='the length of output sequences to stop prediction when EOS token have not been emitted')
 
@@ -72,9 +86,33 @@ def main():
     # Restore the saved parameters
     model.load_checkpoint(save_path=args.model_path, epoch=args.epoch)
 
+    # Load the RNNLM for shallow fusion
+    if args.rnnlm_path is not None:
+        rnnlm_params = load_config(join(args.rnnlm_path, 'config.yml'),
+                                   is_eval=True)
+        rnnlm_params['num_classes'] = params['num_classes']
+        rnnlm = load(model_type=rnnlm_params['model_type'],
+                     params=rnnlm_params,
+                     backend=rnnlm_params['backend'])
+        rnnlm.load_checkpoint(save_path=args.rnnlm_path, epoch=-1)
+        model.set_rnnlm(rnnlm, lm_weight=args.rnnlm_weight)
+
     # GPU setting
     model.set_cuda(deterministic=False, benchmark=True)
 
+    # Run CTC beam search in parallel
+    if args.decode_workers > 1:
+        model.set_parallel_decoding(args.decode_workers)
+
+    # Setting for pruning in attention beam search
+    if params['model_type'] == 'attention':
+        model.set_beam_pruning(score_threshold=args.beam_score_threshold,
+                               max_active=args.beam_max_active,
+                               end_detection=args.end_detection)
+
+    if args.ctc_weight > 0 and params['model_type'] not in ['attention', 'hierarchical_attention']:
+        raise ValueError('ctc_weight is for attention models only.')
+
     if 'word' in params['label_type']:
         wer_test_clean = do_eval_wer(
             model=model,
@@ -82,6 +120,7 @@ def main():
             beam_width=args.beam_width,
             max_decode_len=args.max_decode_len,
             eval_batch_size=args.eval_batch_size,
+            ctc_weight=args.ctc_weight,
             progressbar=True)
         print('  WER (clean): %f %%' % (wer_test_clean * 100))
         wer_test_other = do_eval_wer(
@@ -90,6 +129,7 @@ def main():
             beam_width=args.beam_width,
             max_decode_len=args.max_decode_len,
             eval_batch_size=args.eval_batch_size,
+            ctc_weight=args.ctc_weight,
             progressbar=True)
         print('  WER (other): %f %%' % (wer_test_other * 100))
         print('  WER (mean): %f %%' %
@@ -101,6 +141,7 @@ def main():
             beam_width=args.beam_width,
             max_decode_len=args.max_decode_len,
             eval_batch_size=args.eval_batch_size,
+            ctc_weight=args.ctc_weight,
             progressbar=True)
         print('  CER (clean): %f %%' % (cer_test_clean * 100))
         print('  WER (clean): %f %%' % (wer_test_clean * 100))
@@ -110,6 +151,7 @@ def main():
             beam_width=args.beam_width,
             max_decode_len=args.max_decode_len,
             eval_batch_size=args.eval_batch_size,
+            ctc_weight=args.ctc_weight,
             progressbar=True)
         print('  CER (other): %f %%' % (cer_test_other * 100))
         print('  WER (other): %f %%' % (wer_test_other * 100))
@@ -118,6 +160,17 @@ def main():
         print('  WER (mean): %f %%' %
               ((wer_test_clean + wer_test_other) * 100 / 2))
 
+    # Report the statistics of beam search
+    if params['model_type'] == 'attention' and len(model.beam_search_stats) > 0:
+        stats = model.beam_search_stats
+        print('  Beam search: %.2f steps / %.2f pruned hypotheses per utterance' %
+              (sum([s['steps'] for s in stats]) / len(stats),
+               sum([s['pruned'] for s in stats]) / len(stats)))
+
+    # Terminate the worker processes of parallel decoding
+    if args.decode_workers > 1:
+        model.set_parallel_decoding(1)
+
 
 if __name__ == '__main__':
     main()
@@ -13,9 +13,8 @@ import argparse
 
 sys.path.append(abspath('../../../'))
 from models.load_model import load
-from examples.librispeech.data.load_dataset_hierarchical import Dataset
-from examples.librispeech.metrics.cer import do_eval_cer
-from examples.librispeech.metrics.wer import do_eval_wer
+from examples.librispeech.s5.exp.dataset.load_dataset_hierarchical import Dataset
+from examples.librispeech.s5.exp.metrics.hierarchical import do_eval_hierarchical
 from utils.config import load_config
 
 parser = argparse.ArgumentParser()
@@ -26,8 +25,12 @@ parser.add_argument('--epoch', type=int, default=-1,
 parser.add_argument('--beam_width', type=int, default=1,
                     help='beam_width (int, optional): beam width for beam search.' +
                     ' 1 disables beam search, which mean greedy decoding.')
+parser.add_argument('--beam_width_sub', type=int, default=1,
+                    help='the size of beam in the sub task')
 parser.add_argument('--eval_batch_size', type=int, default=1,
                     help='the size of mini-batch in evaluation')
+parser.add_argument('--decode_workers', type=int, default=1,
+                    help='the number of processes for CTC beam search')
 parser.add_argument('--max_decode_len', type=int, default=100,
                     help='the length of output sequences to stop prediction when EOS token have not been emitted')
 parser.add_argument('--max_decode_len_sub', type=int, default=600,
@@ -84,44 +87,42 @@ def main():
     # GPU setting
     model.set_cuda(deterministic=False, benchmark=True)
 
-    wer_test_clean = do_eval_wer(
+    # Run CTC beam search in parallel
+    if args.decode_workers > 1:
+        model.set_parallel_decoding(args.decode_workers)
+
+    # NOTE: both tasks are decoded with a single pass of the encoder
+    wer_test_clean, cer_test_clean, _ = do_eval_hierarchical(
         model=model,
         dataset=test_clean_data,
         beam_width=args.beam_width,
         max_decode_len=args.max_decode_len,
+        beam_width_sub=args.beam_width_sub,
+        max_decode_len_sub=args.max_decode_len_sub,
         eval_batch_size=args.eval_batch_size,
         progressbar=True)
     print('  WER (clean, main): %f %%' % (wer_test_clean * 100))
-    wer_test_other = do_eval_wer(
+    print('  CER (clean, sub): %f %%' % (cer_test_clean * 100))
+    wer_test_other, cer_test_other, _ = do_eval_hierarchical(
         model=model,
         dataset=test_other_data,
         beam_width=args.beam_width,
         max_decode_len=args.max_decode_len,
+        beam_width_sub=args.beam_width_sub,
+        max_decode_len_sub=args.max_decode_len_sub,
         eval_batch_size=args.eval_batch_size,
         progressbar=True)
     print('  WER (other, main): %f %%' % (wer_test_other * 100))
+    print('  CER (other, sub): %f %%' % (cer_test_other * 100))
     print('  WER (mean, main): %f %%' %
           ((wer_test_clean + wer_test_other) * 100 / 2))
-
-    cer_test_clean, _ = do_eval_cer(
-        model=model,
-        dataset=test_clean_data,
-        beam_width=args.beam_width,
-        max_decode_len=args.max_decode_len_sub,
-        eval_batch_size=args.eval_batch_size,
-        progressbar=True)
-    print('  CER (clean, sub): %f %%' % (cer_test_clean * 100))
-    cer_test_other, _ = do_eval_cer(
-        model=model,
-        dataset=test_other_data,
-        beam_width=args.beam_width,
-        max_decode_len=args.max_decode_len_sub,
-        eval_batch_size=args.eval_batch_size,
-        progressbar=True)
-    print('  CER (other, sub): %f %%' % (cer_test_other * 100))
     print('  CER (mean, sub): %f %%' %
           ((cer_test_clean + cer_test_other) * 100 / 2))
 
+    # Terminate the worker processes of parallel decoding
+    if args.decode_workers > 1:
+        model.set_parallel_decoding(1)
+
 
 if __name__ == '__main__':
     main()
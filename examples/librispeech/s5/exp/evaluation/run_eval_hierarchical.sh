@@ -23,4 +23,5 @@ $PYTHON eval_hierarchical.py \
   --model_path $saved_model_path \
   --epoch -1 \
   --beam_width 1 \
+  --beam_width_sub 1 \
   --eval_batch_size 1
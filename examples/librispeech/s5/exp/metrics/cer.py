@@ -13,10 +13,12 @@ import pandas as pd
 
 from utils.io.labels.character import Idx2char
 from utils.evaluation.edit_distance import compute_wer
+from utils.training.distributed import all_reduce_sum
 
 
 def do_eval_cer(model, dataset, beam_width, max_decode_len,
-                eval_batch_size=None, progressbar=False):
+                eval_batch_size=None, progressbar=False, distributed=False,
+                ctc_weight=0):
     """Evaluate trained model by Character Error Rate.
     Args:
         model: the model to evaluate
@@ -27,6 +29,10 @@ def do_eval_cer(model, dataset, beam_width, max_decode_len,
             This is used for seq2seq models.
         eval_batch_size (int, optional): the batch size when evaluating the model
         progressbar (bool, optional): if True, visualize the progressbar
+        distributed (bool, optional): if True, errors and lengths are summed
+            over all processes, each of which evaluates its own shard
+        ctc_weight (float, optional): the weight of CTC prefix scores in
+            joint CTC/attention decoding (attention models only)
     Returns:
         wer (float): Word error rate
         cer (float): Character error rate
@@ -45,21 +51,27 @@ def do_eval_cer(model, dataset, beam_width, max_decode_len,
     num_words, num_chars = 0, 0
     if progressbar:
         pbar = tqdm(total=len(dataset))  # TODO: fix this
+    # NOTE: CTC models do not take ctc_weight
+    decode_kwargs = {}
+    if ctc_weight > 0:
+        decode_kwargs['ctc_weight'] = ctc_weight
     while True:
         batch, is_new_epoch = dataset.next(batch_size=eval_batch_size)
 
         # Decode
         if model.model_type in ['ctc', 'attention']:
-            best_hyps, perm_idx = model.decode(batch['xs'], batch['x_lens'],
-                                               beam_width=beam_width,
-                                               max_decode_len=max_decode_len)
+            best_hyps, _, perm_idx = model.decode(batch['xs'], batch['x_lens'],
+                                                  beam_width=beam_width,
+                                                  max_decode_len=max_decode_len,
+                                                  **decode_kwargs)
             ys = batch['ys'][perm_idx]
             y_lens = batch['y_lens'][perm_idx]
         else:
-            best_hyps, perm_idx = model.decode(batch['xs'], batch['x_lens'],
-                                               beam_width=beam_width,
-                                               max_decode_len=max_decode_len,
-                                               is_sub_task=True)
+            best_hyps, _, perm_idx = model.decode(batch['xs'], batch['x_lens'],
+                                                  beam_width=beam_width,
+                                                  max_decode_len=max_decode_len,
+                                                  is_sub_task=True,
+                                                  **decode_kwargs)
             ys = batch['ys_sub'][perm_idx]
             y_lens = batch['y_lens_sub'][perm_idx]
 
@@ -132,6 +144,12 @@ def do_eval_cer(model, dataset, beam_width, max_decode_len,
     # Reset data counters
     dataset.reset()
 
+    if distributed:
+        (cer, sub_char, ins_char, del_char, num_chars,
+         wer, sub_word, ins_word, del_word, num_words) = all_reduce_sum(
+            [cer, sub_char, ins_char, del_char, num_chars,
+             wer, sub_word, ins_word, del_word, num_words])
+
     wer /= num_words
     cer /= num_chars
     sub_char /= num_chars
@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Define evaluation method of hierarchical models by Word Error Rate in the
+   main task and Character Error Rate in the sub task (Librispeech corpus)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+from tqdm import tqdm
+import pandas as pd
+
+from utils.io.labels.character import Idx2char
+from utils.io.labels.word import Idx2word
+from utils.evaluation.edit_distance import compute_wer
+
+
+def do_eval_hierarchical(model, dataset, beam_width, max_decode_len,
+                         beam_width_sub=1, max_decode_len_sub=None,
+                         eval_batch_size=None, progressbar=False):
+    """Evaluate trained hierarchical model by Word Error Rate (main task) and
+       Character Error Rate (sub task). Each mini-batch is encoded only once.
+    Args:
+        model: the model to evaluate
+        dataset: An instance of a `Dataset' class
+        beam_width: (int): the size of beam in the main task
+        max_decode_len (int): the length of output sequences
+            to stop prediction when EOS token have not been emitted.
+            This is used for seq2seq models.
+        beam_width_sub: (int, optional): the size of beam in the sub task
+        max_decode_len_sub (int, optional): the length of output sequences
+            in the sub task
+        eval_batch_size (int, optional): the batch size when evaluating the model
+        progressbar (bool, optional): if True, visualize the progressbar
+    Returns:
+        wer (float): Word error rate of the main task
+        cer (float): Character error rate of the sub task
+        df_wer_cer (pd.DataFrame): dataframe of substitution, insertion, and deletion
+    """
+    # Reset data counter
+    dataset.reset()
+
+    idx2word = Idx2word(vocab_file_path=dataset.vocab_file_path)
+    idx2char = Idx2char(
+        vocab_file_path=dataset.vocab_file_path_sub,
+        capital_divide=(dataset.label_type_sub == 'character_capital_divide'))
+
+    wer, cer = 0, 0
+    sub_word, ins_word, del_word = 0, 0, 0
+    sub_char, ins_char, del_char = 0, 0, 0
+    num_words, num_chars = 0, 0
+    if progressbar:
+        pbar = tqdm(total=len(dataset))  # TODO: fix this
+    while True:
+        batch, is_new_epoch = dataset.next(batch_size=eval_batch_size)
+
+        # Decode both tasks with a single pass of the encoder
+        best_hyps, _, best_hyps_sub, _, perm_idx = model.decode_multi_task(
+            batch['xs'], batch['x_lens'],
+            beam_width=beam_width,
+            max_decode_len=max_decode_len,
+            beam_width_sub=beam_width_sub,
+            max_decode_len_sub=max_decode_len_sub)
+        ys = batch['ys'][perm_idx]
+        y_lens = batch['y_lens'][perm_idx]
+        ys_sub = batch['ys_sub'][perm_idx]
+        y_lens_sub = batch['y_lens_sub'][perm_idx]
+
+        for b in range(len(batch['xs'])):
+
+            ##############################
+            # Reference
+            ##############################
+            if dataset.is_test:
+                str_ref = ys[b][0]
+                str_ref_sub = ys_sub[b][0]
+                # NOTE: transcript is seperated by space('_')
+            else:
+                # Convert from list of index to string
+                str_ref = idx2word(ys[b][:y_lens[b]])
+                str_ref_sub = idx2char(ys_sub[b][:y_lens_sub[b]])
+
+            ##############################
+            # Hypothesis
+            ##############################
+            str_hyp = idx2word(best_hyps[b])
+            str_hyp_sub = idx2char(best_hyps_sub[b])
+            if 'attention' in model.model_type:
+                str_hyp = str_hyp.split('>')[0]
+                str_hyp_sub = str_hyp_sub.split('>')[0]
+                # NOTE: Trancate by the first <EOS>
+
+                # Remove the last space
+                if len(str_hyp) > 0 and str_hyp[-1] == '_':
+                    str_hyp = str_hyp[:-1]
+                if len(str_hyp_sub) > 0 and str_hyp_sub[-1] == '_':
+                    str_hyp_sub = str_hyp_sub[:-1]
+
+            # Remove consecutive spaces
+            str_hyp_sub = re.sub(r'[_]+', '_', str_hyp_sub)
+
+            ##############################
+            # Post-proccessing
+            ##############################
+            # Remove garbage labels
+            str_ref = re.sub(r'[\'>]+', '', str_ref)
+            str_hyp = re.sub(r'[\'>]+', '', str_hyp)
+            str_ref_sub = re.sub(r'[\'>]+', '', str_ref_sub)
+            str_hyp_sub = re.sub(r'[\'>]+', '', str_hyp_sub)
+
+            # Compute WER of the main task
+            wer_b, sub_b, ins_b, del_b = compute_wer(
+                ref=str_ref.split('_'),
+                hyp=str_hyp.split('_'),
+                normalize=False)
+            wer += wer_b
+            sub_word += sub_b
+            ins_word += ins_b
+            del_word += del_b
+            num_words += len(str_ref.split('_'))
+
+            # Compute CER of the sub task
+            cer_b, sub_b, ins_b, del_b = compute_wer(
+                ref=list(str_ref_sub.replace('_', '')),
+                hyp=list(str_hyp_sub.replace('_', '')),
+                normalize=False)
+            cer += cer_b
+            sub_char += sub_b
+            ins_char += ins_b
+            del_char += del_b
+            num_chars += len(str_ref_sub.replace('_', ''))
+
+            if progressbar:
+                pbar.update(1)
+
+        if is_new_epoch:
+            break
+
+    if progressbar:
+        pbar.close()
+
+    # Reset data counters
+    dataset.reset()
+
+    wer /= num_words
+    cer /= num_chars
+    sub_word /= num_words
+    ins_word /= num_words
+    del_word /= num_words
+    sub_char /= num_chars
+    ins_char /= num_chars
+    del_char /= num_chars
+
+    df_wer_cer = pd.DataFrame(
+        {'SUB': [sub_word * 100, sub_char * 100],
+         'INS': [ins_word * 100, ins_char * 100],
+         'DEL': [del_word * 100, del_char * 100]},
+        columns=['SUB', 'INS', 'DEL'], index=['WER', 'CER'])
+
+    return wer, cer, df_wer_cer
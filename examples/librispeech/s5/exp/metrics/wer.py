@@ -13,10 +13,12 @@ import pandas as pd
 
 from utils.io.labels.word import Idx2word
 from utils.evaluation.edit_distance import compute_wer
+from utils.training.distributed import all_reduce_sum
 
 
 def do_eval_wer(model, dataset, beam_width, max_decode_len,
-                eval_batch_size=None, progressbar=False):
+                eval_batch_size=None, progressbar=False, distributed=False,
+                ctc_weight=0):
     """Evaluate trained model by Word Error Rate.
     Args:
         model: the model to evaluate
@@ -27,6 +29,10 @@ def do_eval_wer(model, dataset, beam_width, max_decode_len,
             This is used for seq2seq models.
         eval_batch_size (int, optional): the batch size when evaluating the model
         progressbar (bool, optional): if True, visualize the progressbar
+        distributed (bool, optional): if True, errors and lengths are summed
+            over all processes, each of which evaluates its own shard
+        ctc_weight (float, optional): the weight of CTC prefix scores in
+            joint CTC/attention decoding (attention models only)
     Returns:
         wer (float): Word error rate
         df_wer (pd.DataFrame): dataframe of substitution, insertion, and deletion
@@ -41,13 +47,18 @@ def do_eval_wer(model, dataset, beam_width, max_decode_len,
     num_words = 0
     if progressbar:
         pbar = tqdm(total=len(dataset))  # TODO: fix this
+    # NOTE: CTC models do not take ctc_weight
+    decode_kwargs = {}
+    if ctc_weight > 0:
+        decode_kwargs['ctc_weight'] = ctc_weight
     while True:
         batch, is_new_epoch = dataset.next(batch_size=eval_batch_size)
 
         # Decode
-        best_hyps, perm_idx = model.decode(batch['xs'], batch['x_lens'],
-                                           beam_width=beam_width,
-                                           max_decode_len=max_decode_len)
+        best_hyps, _, perm_idx = model.decode(batch['xs'], batch['x_lens'],
+                                              beam_width=beam_width,
+                                              max_decode_len=max_decode_len,
+                                              **decode_kwargs)
         ys = batch['ys'][perm_idx]
         y_lens = batch['y_lens'][perm_idx]
 
@@ -103,6 +114,10 @@ def do_eval_wer(model, dataset, beam_width, max_decode_len,
     if progressbar:
         pbar.close()
 
+    if distributed:
+        wer, sub, ins, dele, num_words = all_reduce_sum(
+            [wer, sub, ins, dele, num_words])
+
     wer /= num_words
     sub /= num_words
     ins /= num_words
@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Evaluate checkpoints during training in another process (Librispeech corpus)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import argparse
+
+import torch
+
+sys.path.append(os.path.abspath('../../../'))
+from models.load_model import load
+from examples.librispeech.s5.exp.dataset.load_dataset import Dataset
+from examples.librispeech.s5.exp.metrics.cer import do_eval_cer
+from examples.librispeech.s5.exp.metrics.wer import do_eval_wer
+from utils.training.eval_worker import watch_checkpoints, load_results
+from utils.config import load_config
+
+MAX_DECODE_LEN_WORD = 200
+MAX_DECODE_LEN_CHAR = 600
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--gpu', type=int, default=-1,
+                    help='the index of GPU (negative value indicates CPU)')
+parser.add_argument('--saved_model_path', type=str,
+                    help='path to the directory where checkpoints are saved')
+parser.add_argument('--data_save_path', type=str, help='path to saved data')
+parser.add_argument('--num_threads', type=int, default=4,
+                    help='the number of CPU threads for evaluation')
+parser.add_argument('--poll_interval', type=float, default=60,
+                    help='the interval to look for new checkpoints in seconds')
+
+
+def build_evaluate(model, datasets, label_type, save_path):
+    """Build the function to evaluate a checkpoint.
+    Args:
+        model: the model to load checkpoints into
+        datasets (dict): instances of a `Dataset' class, whose keys are
+            dev_clean, dev_other, test_clean and test_other
+        label_type (string): the label type of the model
+        save_path (string): path to the saved models (directory)
+    Returns:
+        evaluate (function): takes an epoch and returns a dict of metrics
+    """
+    # Restart from the results evaluated before
+    # NOTE: dev-other and test sets are evaluated only when the dev score
+    # is improved
+    best = {'metric_dev': min([1] + [result['metric_dev']
+                                     for result in load_results(save_path)])}
+
+    def evaluate(epoch):
+        model.load_checkpoint(save_path=save_path, epoch=epoch)
+
+        # dev
+        result = {}
+        if 'word' in label_type:
+            result['metric_dev'], _ = do_eval_wer(
+                model=model,
+                dataset=datasets['dev_clean'],
+                beam_width=1,
+                max_decode_len=MAX_DECODE_LEN_WORD,
+                eval_batch_size=1)
+        else:
+            result['metric_dev'], result['wer_dev_clean'], _ = do_eval_cer(
+                model=model,
+                dataset=datasets['dev_clean'],
+                beam_width=1,
+                max_decode_len=MAX_DECODE_LEN_CHAR,
+                eval_batch_size=1)
+
+        # dev-other & test
+        if result['metric_dev'] < best['metric_dev']:
+            best['metric_dev'] = result['metric_dev']
+            for data_type in ['dev_other', 'test_clean', 'test_other']:
+                if 'word' in label_type:
+                    result['wer_' + data_type], _ = do_eval_wer(
+                        model=model,
+                        dataset=datasets[data_type],
+                        beam_width=1,
+                        max_decode_len=MAX_DECODE_LEN_WORD,
+                        eval_batch_size=1)
+                else:
+                    result['cer_' + data_type], result['wer_' + data_type], _ = do_eval_cer(
+                        model=model,
+                        dataset=datasets[data_type],
+                        beam_width=1,
+                        max_decode_len=MAX_DECODE_LEN_CHAR,
+                        eval_batch_size=1)
+        return result
+
+    return evaluate
+
+
+def main():
+
+    args = parser.parse_args()
+
+    # NOTE: do not slow down training
+    os.nice(10)
+    torch.set_num_threads(args.num_threads)
+
+    # Load a config file (.yml)
+    params = load_config(os.path.join(args.saved_model_path, 'config.yml'))
+
+    # Load dataset
+    datasets = {}
+    for data_type in ['dev_clean', 'dev_other', 'test_clean', 'test_other']:
+        datasets[data_type] = Dataset(
+            data_save_path=args.data_save_path,
+            backend=params['backend'],
+            input_channel=params['input_channel'],
+            use_delta=params['use_delta'],
+            use_double_delta=params['use_double_delta'],
+            data_type=data_type, data_size=params['data_size'],
+            label_type=params['label_type'],
+            batch_size=params['batch_size'], splice=params['splice'],
+            num_stack=params['num_stack'], num_skip=params['num_skip'],
+            tool=params['tool'])
+    params['num_classes'] = datasets['dev_clean'].num_classes
+
+    # Load model
+    model = load(model_type=params['model_type'],
+                 params=params,
+                 backend=params['backend'])
+    model.save_path = args.saved_model_path
+
+    # GPU setting
+    if args.gpu < 0:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = str(args.gpu)
+    model.set_cuda(deterministic=False, benchmark=True)
+
+    evaluate = build_evaluate(model, datasets, params['label_type'],
+                              args.saved_model_path)
+    watch_checkpoints(args.saved_model_path, evaluate,
+                      poll_interval=args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test the evaluation worker on a saved checkpoint (Librispeech corpus)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+import torch
+torch.manual_seed(1623)
+
+sys.path.append(os.path.abspath('../../../../../../'))
+from models.pytorch.ctc.ctc import CTC
+from examples.librispeech.s5.exp.training.eval_worker import build_evaluate
+from utils.training.eval_worker import watch_checkpoints, load_results
+
+WORDS = ['she', 'had', 'your', 'dark', 'suit', 'in', 'greasy', 'wash',
+         'water', 'all', 'year']
+
+
+class _Dataset(object):
+    """A dataset of one mini-batch, which has the interface used in
+        do_eval_wer."""
+
+    def __init__(self, vocab_file_path, batch_size=2, input_size=120):
+        self.vocab_file_path = vocab_file_path
+        self.label_type = 'word'
+        self.is_test = False
+        self.num_classes = len(WORDS)
+
+        np.random.seed(1)
+        x_lens = np.array([50] * batch_size, dtype=np.int32)
+        y_lens = np.array([5] * batch_size, dtype=np.int32)
+        self.batch = {
+            'xs': np.random.randn(batch_size, x_lens[0], input_size).astype(np.float32),
+            'x_lens': x_lens,
+            'ys': np.random.randint(0, len(WORDS), size=(batch_size, y_lens[0])).astype(np.int32),
+            'y_lens': y_lens}
+
+    def __len__(self):
+        return len(self.batch['xs'])
+
+    def reset(self):
+        pass
+
+    def next(self, batch_size=None):
+        return self.batch, True
+
+
+class TestEvalWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.save_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.save_path)
+
+    def test(self):
+        vocab_file_path = os.path.join(self.save_path, 'word.txt')
+        with open(vocab_file_path, 'w') as f:
+            f.write('\n'.join(WORDS) + '\n')
+        dataset = _Dataset(vocab_file_path)
+
+        model = CTC(
+            input_size=120,
+            encoder_type='lstm',
+            encoder_bidirectional=True,
+            encoder_num_units=64,
+            encoder_num_proj=0,
+            encoder_num_layers=1,
+            fc_list=[],
+            dropout_input=0,
+            dropout_encoder=0,
+            num_classes=dataset.num_classes,
+            parameter_init_distribution='uniform',
+            parameter_init=0.1,
+            recurrent_weight_orthogonal=False,
+            init_forget_gate_bias_with_one=True,
+            subsample_list=[],
+            num_stack=1,
+            splice=1,
+            input_channel=3)
+        model.set_optimizer('adam', learning_rate_init=1e-3)
+        model.save_checkpoint(self.save_path, epoch=1, step=10, lr=1e-3,
+                              metric_dev_best=1)
+
+        # NOTE: the worker evaluates the remaining checkpoints and exits
+        with open(os.path.join(self.save_path, 'COMPLETE'), 'w') as f:
+            f.write('')
+
+        datasets = {data_type: dataset for data_type in [
+            'dev_clean', 'dev_other', 'test_clean', 'test_other']}
+        evaluate = build_evaluate(model, datasets, 'word', self.save_path)
+        watch_checkpoints(self.save_path, evaluate, poll_interval=0)
+
+        results = load_results(self.save_path)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['epoch'], 1)
+        self.assertIn('metric_dev', results[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
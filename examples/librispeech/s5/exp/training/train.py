@@ -10,8 +10,9 @@ from __future__ import print_function
 import os
 import sys
 import time
+import subprocess
+import logging
 from setproctitle import setproctitle
-import copy
 import argparse
 from tensorboardX import SummaryWriter
 from tqdm import tqdm
@@ -27,8 +28,15 @@ from examples.librispeech.s5.exp.metrics.cer import do_eval_cer
 from examples.librispeech.s5.exp.metrics.wer import do_eval_wer
 from utils.training.learning_rate_controller import Controller
 from utils.training.plot import plot_loss
-from utils.training.training_loop import train_step
+from utils.training.training_loop import train_step, log_split_stats
 from utils.training.logging import set_logger
+from utils.training.profiler import StepProfiler
+from utils.training.histogram_logger import HistogramLogger
+from utils.training.checkpointer import Checkpointer
+from utils.training.best_model_tracker import BestModelTracker
+from utils.training.eval_worker import EvalResultReader, stop_worker
+from utils.training.distributed import init_distributed, broadcast_model, all_reduce_mean, broadcast_object
+from utils.training.local_sgd import ModelAverager
 from utils.directory import mkdir_join
 from utils.config import load_config, save_config
 
@@ -45,12 +53,17 @@ parser.add_argument('--model_save_path', type=str,
 parser.add_argument('--saved_model_path', type=str, default=None,
                     help='path to the saved model to retrain')
 parser.add_argument('--data_save_path', type=str, help='path to saved data')
+parser.add_argument('--dist_backend', type=str, default='gloo',
+                    help='the backend of data-parallel training (gloo or nccl)')
 
 
 def main():
 
     args = parser.parse_args()
 
+    # Setting for data-parallel training
+    rank, world_size = init_distributed(args.dist_backend)
+
     ##################################################
     # DATSET
     ##################################################
@@ -125,6 +138,13 @@ def main():
 
     params['num_classes'] = train_data.num_classes
 
+    # NOTE: each mini-batch is divided among processes in training, and
+    # utterances are divided in evaluation
+    if world_size > 1:
+        train_data.set_rank(rank, world_size)
+        for data in [dev_clean_data, dev_other_data, test_clean_data, test_other_data]:
+            data.set_rank(rank, world_size, shard_dataset=True)
+
     ##################################################
     # MODEL
     ##################################################
@@ -136,17 +156,27 @@ def main():
     if args.model_save_path is not None:
 
         # Set save path
-        save_path = mkdir_join(
-            args.model_save_path, params['backend'],
-            params['model_type'], params['label_type'],
-            params['data_size'], model.name)
-        model.set_save_path(save_path)
-
-        # Save config file
-        save_config(config_path=args.config_path, save_path=model.save_path)
+        if rank == 0:
+            save_path = mkdir_join(
+                args.model_save_path, params['backend'],
+                params['model_type'], params['label_type'],
+                params['data_size'], model.name)
+            model.set_save_path(save_path)
+
+            # Save config file
+            save_config(config_path=args.config_path,
+                        save_path=model.save_path)
+            save_path = model.save_path
+        else:
+            save_path = None
+        # NOTE: all processes share the directory made by rank 0
+        model.save_path = broadcast_object(save_path)
 
         # Setting for logging
-        logger = set_logger(model.save_path)
+        if rank == 0:
+            logger = set_logger(model.save_path)
+        else:
+            logger = logging.getLogger('training')
 
         if os.path.isdir(params['char_init']):
             # NOTE: Start training from the pre-trained character model
@@ -182,7 +212,10 @@ def main():
         model.save_path = args.saved_model_path
 
         # Setting for logging
-        logger = set_logger(model.save_path, restart=True)
+        if rank == 0:
+            logger = set_logger(model.save_path, restart=True)
+        else:
+            logger = logging.getLogger('training')
 
         # Define optimizer
         model.set_optimizer(
@@ -206,6 +239,35 @@ def main():
     # GPU setting
     model.set_cuda(deterministic=False, benchmark=True)
 
+    # Setting for mixed precision training
+    if 'mixed_precision' in params.keys() and params['mixed_precision']:
+        model.set_mixed_precision()
+
+    # Setting for activation checkpointing
+    if 'checkpoint_layers' in params.keys() or 'checkpoint_conv' in params.keys():
+        model.set_activation_checkpointing(
+            layers=params['checkpoint_layers'] if 'checkpoint_layers' in params.keys() else [],
+            conv='checkpoint_conv' in params.keys() and params['checkpoint_conv'])
+
+    model_averager = None
+    data_parallel = False
+    if world_size > 1 and 'local_sgd_period' in params.keys() and params['local_sgd_period'] > 0:
+        # NOTE: each process updates its own model, which is averaged
+        # every K steps
+        model_averager = ModelAverager(
+            model, period=params['local_sgd_period'],
+            block_momentum=params['local_sgd_block_momentum'] if 'local_sgd_block_momentum' in params.keys() else 0.,
+            block_lr=params['local_sgd_block_lr'] if 'local_sgd_block_lr' in params.keys() else 1.,
+            patterns=params['local_sgd_params'] if 'local_sgd_params' in params.keys() else None)
+        logger.info('Local SGD (rank: %d, world_size: %d, period: %d)' %
+                    (rank, world_size, model_averager.period))
+    elif world_size > 1:
+        # NOTE: gradients are averaged over processes in each step
+        broadcast_model(model)
+        data_parallel = True
+        logger.info('Data-parallel training (rank: %d, world_size: %d)' %
+                    (rank, world_size))
+
     logger.info('PID: %s' % os.getpid())
     logger.info('USERNAME: %s' % os.uname()[1])
 
@@ -226,8 +288,37 @@ def main():
         lower_better=True)
 
     # Setting for tensorboard
-    if params['backend'] == 'pytorch':
+    if params['backend'] == 'pytorch' and rank == 0:
         tf_writer = SummaryWriter(model.save_path)
+        histogram_options = {}
+        for key, name in [('histogram_max_num_params', 'max_num_params'),
+                          ('histogram_interval', 'min_interval'),
+                          ('histogram_time_budget', 'time_budget'),
+                          ('histogram_patterns', 'patterns'),
+                          ('histogram_queue_size', 'queue_size')]:
+            if key in params.keys():
+                histogram_options[name] = params[key]
+        histogram_logger = HistogramLogger(tf_writer, **histogram_options)
+
+    # Setting for profiling
+    if 'profile' in params.keys() and params['profile'] and params['backend'] == 'pytorch' and rank == 0:
+        profiler = StepProfiler(use_cuda=model.use_cuda,
+                                num_stack=params['num_stack'])
+        profiler.instrument_model(model)
+        profiler.instrument_dataset(train_data)
+    else:
+        profiler = None
+
+    # Setting for checkpointing
+    checkpointer = Checkpointer(model.save_path, backend=params['backend'],
+                                rank=rank)
+    if 'keep_last_checkpoints' in params.keys():
+        checkpointer.keep_last = params['keep_last_checkpoints']
+    if 'keep_best_checkpoints' in params.keys():
+        checkpointer.keep_best = params['keep_best_checkpoints']
+    if 'checkpoint_interval' in params.keys():
+        # NOTE: the interval is set in minutes
+        checkpointer.interval = params['checkpoint_interval'] * 60
 
     # Train model
     csv_steps, csv_loss_train, csv_loss_dev = [], [], []
@@ -235,218 +326,401 @@ def main():
     start_time_epoch = time.time()
     start_time_step = time.time()
     not_improved_epoch = 0
-    best_model = model
-    loss_train_mean = 0.
-    pbar_epoch = tqdm(total=len(train_data))
-    while True:
-        # Compute loss in the training set (including parameter update)
-        batch_train, is_new_epoch = train_data.next()
-        model, loss_train_val = train_step(
-            model, batch_train, params['clip_grad_norm'], backend=params['backend'])
-        loss_train_mean += loss_train_val
-
-        pbar_epoch.update(len(batch_train['xs']))
-
-        if (step + 1) % params['print_step'] == 0:
-
-            # Compute loss in the dev set
-            batch_dev = dev_clean_data.next()[0]
-            loss_dev = model(
-                batch_dev['xs'], batch_dev['ys'],
-                batch_dev['x_lens'], batch_dev['y_lens'], is_eval=True)
-
-            loss_train_mean /= params['print_step']
-            csv_steps.append(step)
-            csv_loss_train.append(loss_train_mean)
-            csv_loss_dev.append(loss_dev)
-
-            # Logging by tensorboard
-            if params['backend'] == 'pytorch':
-                tf_writer.add_scalar(
-                    'train/loss', loss_train_mean, step + 1)
-                tf_writer.add_scalar('dev/loss', loss_dev, step + 1)
-                for name, param in model.named_parameters():
-                    name = name.replace('.', '/')
-                    tf_writer.add_histogram(
-                        name, param.data.cpu().numpy(), step + 1)
-                    tf_writer.add_histogram(
-                        name + '/grad', param.grad.data.cpu().numpy(), step + 1)
-
-            duration_step = time.time() - start_time_step
-            logger.info("...Step:%d(epoch:%.3f) loss:%.3f(%.3f)/lr:%.5f/batch:%d/x_lens:%d (%.3f min)" %
-                        (step + 1, train_data.epoch_detail,
-                         loss_train_mean, loss_dev,
-                         learning_rate, train_data.current_batch_size,
-                         max(batch_train['x_lens']) * params['num_stack'],
-                         duration_step / 60))
-            start_time_step = time.time()
-            loss_train_mean = 0.
-        step += 1
-
-        # Save checkpoint and evaluate model per epoch
-        if is_new_epoch:
-            duration_epoch = time.time() - start_time_epoch
-            logger.info('===== EPOCH:%d (%.3f min) =====' %
-                        (epoch, duration_epoch / 60))
-
-            # Save fugure of loss
-            plot_loss(csv_loss_train, csv_loss_dev, csv_steps,
-                      save_path=model.save_path)
-
-            if epoch < params['eval_start_epoch']:
-                # Save the model
-                model.save_checkpoint(model.save_path, epoch, step,
+    if 'best_model_dtype' in params.keys():
+        # NOTE: float16 halves host memory of the snapshot of the best model
+        best_model_dtype = getattr(torch, params['best_model_dtype'])
+    else:
+        best_model_dtype = None
+    best_model_tracker = BestModelTracker(backend=params['backend'],
+                                          dtype=best_model_dtype)
+
+    # Setting for evaluation in another process
+    if 'async_eval' in params.keys() and params['async_eval']:
+        if world_size > 1:
+            raise ValueError(
+                'async_eval is not supported in data-parallel training.')
+        eval_worker = subprocess.Popen(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval_worker.py'),
+             '--saved_model_path', model.save_path,
+             '--data_save_path', args.data_save_path])
+        eval_results = EvalResultReader(model.save_path)
+        # NOTE: the best model is restored from the checkpoint
+        best_model_tracker.keep_in_memory = False
+    else:
+        eval_worker = None
+        eval_results = None
+
+    # NOTE: the evaluation worker must not outlive training
+    try:
+        loss_train_mean = 0.
+        pbar_epoch = tqdm(total=len(train_data))
+        if 'max_frames_per_step' in params.keys():
+            # NOTE: gradients are accumulated over micro-batches. The budget is
+            # counted in input frames before frame stacking
+            max_frames_per_step = params['max_frames_per_step']
+        else:
+            max_frames_per_step = 0
+        while True:
+            # Compute loss in the training set (including parameter update)
+            batch_train, is_new_epoch = train_data.next()
+            model, loss_train_val = train_step(
+                model, batch_train, params['clip_grad_norm'], backend=params['backend'],
+                max_frames_per_step=max_frames_per_step, profiler=profiler,
+                data_parallel=data_parallel)
+            loss_train_mean += loss_train_val
+            if model_averager is not None:
+                model_averager.step()
+
+            pbar_epoch.update(len(batch_train['xs']))
+
+            # Save checkpoint per interval
+            checkpointer.save_step(model, epoch, step,
+                                   learning_rate, metric_dev_best)
+
+            if (step + 1) % params['print_step'] == 0:
+
+                # Compute loss in the dev set
+                batch_dev = dev_clean_data.next()[0]
+                loss_dev = model(
+                    batch_dev['xs'], batch_dev['ys'],
+                    batch_dev['x_lens'], batch_dev['y_lens'], is_eval=True)
+
+                loss_train_mean /= params['print_step']
+                loss_train_mean = all_reduce_mean(loss_train_mean)
+                loss_dev = all_reduce_mean(loss_dev)
+                csv_steps.append(step)
+                csv_loss_train.append(loss_train_mean)
+                csv_loss_dev.append(loss_dev)
+
+                # Logging by tensorboard
+                if params['backend'] == 'pytorch' and rank == 0:
+                    tf_writer.add_scalar(
+                        'train/loss', loss_train_mean, step + 1)
+                    tf_writer.add_scalar('dev/loss', loss_dev, step + 1)
+                    histogram_logger.log(model, step + 1)
+
+                # Logging of per-phase time
+                if profiler is not None:
+                    profiler.report(step + 1, tf_writer)
+
+                duration_step = time.time() - start_time_step
+                logger.info("...Step:%d(epoch:%.3f) loss:%.3f(%.3f)/lr:%.5f/batch:%d/x_lens:%d (%.3f min)" %
+                            (step + 1, train_data.epoch_detail,
+                             loss_train_mean, loss_dev,
+                             learning_rate, train_data.current_batch_size,
+                             max(batch_train['x_lens']) * params['num_stack'],
+                             duration_step / 60))
+                start_time_step = time.time()
+                loss_train_mean = 0.
+            step += 1
+
+            # Save checkpoint and evaluate model per epoch
+            if is_new_epoch:
+                duration_epoch = time.time() - start_time_epoch
+                logger.info('===== EPOCH:%d (%.3f min) =====' %
+                            (epoch, duration_epoch / 60))
+
+                # NOTE: all processes evaluate and save the same model
+                if model_averager is not None:
+                    model_averager.average()
+
+                # Save fugure of loss
+                plot_loss(csv_loss_train, csv_loss_dev, csv_steps,
+                          save_path=model.save_path)
+
+                if eval_results is not None:
+                    # Save the model, which is evaluated by the worker
+                    checkpointer.save(model, epoch, step,
                                       learning_rate, metric_dev_best)
-            else:
-                start_time_eval = time.time()
-                # dev
-                if 'word' in params['label_type']:
-                    metric_dev_epoch, _ = do_eval_wer(
-                        models=[model],
-                        dataset=dev_clean_data,
-                        beam_width=1,
-                        max_decode_len=MAX_DECODE_LEN_WORD,
-                        eval_batch_size=1)
-                    logger.info('  WER (dev-clean): %.3f %%' %
-                                (metric_dev_epoch * 100))
-                else:
-                    metric_dev_epoch, wer_dev_clean_epoch, _ = do_eval_cer(
-                        models=[model],
-                        dataset=dev_clean_data,
-                        beam_width=1,
-                        max_decode_len=MAX_DECODE_LEN_CHAR,
-                        eval_batch_size=1)
-                    logger.info('  CER / WER (dev-clean): %.3f %% / %.3f %%' %
-                                ((metric_dev_epoch * 100), (wer_dev_clean_epoch * 100)))
-
-                if metric_dev_epoch < metric_dev_best:
-                    metric_dev_best = metric_dev_epoch
-                    not_improved_epoch = 0
-                    best_model = copy.deepcopy(model)
-                    logger.info('||||| Best Score |||||')
 
+                    # Consume results which have been evaluated so far
+                    is_stopped = False
+                    for result in eval_results.poll():
+                        logger.info('  (epoch:%d) %s' % (result['epoch'], ' / '.join(
+                            ['%s: %.3f %%' % (k, v * 100) for k, v in sorted(result.items()) if k != 'epoch'])))
+                        if params['backend'] == 'pytorch':
+                            for k, v in result.items():
+                                if k != 'epoch':
+                                    tf_writer.add_scalar('eval/' + k, v, result['epoch'])
+
+                        if result['metric_dev'] < metric_dev_best:
+                            metric_dev_best = result['metric_dev']
+                            not_improved_epoch = 0
+                            best_model_tracker.update(
+                                model, model_path=os.path.join(model.save_path, 'model.epoch-' + str(result['epoch'])))
+                            checkpointer.update_metric(
+                                result['epoch'], result['metric_dev'])
+                            logger.info('||||| Best Score (epoch:%d) |||||' %
+                                        result['epoch'])
+                        else:
+                            not_improved_epoch += 1
+
+                        # Early stopping
+                        if not_improved_epoch == params['not_improved_patient_epoch']:
+                            is_stopped = True
+
+                        # Update learning rate
+                        model.optimizer, learning_rate = lr_controller.decay_lr(
+                            optimizer=model.optimizer,
+                            learning_rate=learning_rate,
+                            epoch=result['epoch'],
+                            value=result['metric_dev'])
+                    if is_stopped:
+                        break
+
+                    if epoch == params['convert_to_sgd_epoch']:
+                        # Convert to fine-tuning stage
+                        model.set_optimizer(
+                            'sgd',
+                            learning_rate_init=learning_rate,
+                            weight_decay=float(params['weight_decay']),
+                            clip_grad_norm=params['clip_grad_norm'],
+                            lr_schedule=False,
+                            factor=params['decay_rate'],
+                            patience_epoch=params['decay_patient_epoch'])
+                        logger.info('========== Convert to SGD ==========')
+
+                        # Inject Gaussian noise to all parameters
+                        if float(params['weight_noise_std']) > 0:
+                            model.weight_noise_injection = True
+
+                elif epoch < params['eval_start_epoch']:
                     # Save the model
-                    model.save_checkpoint(model.save_path, epoch, step,
-                                          learning_rate, metric_dev_best)
-
-                    # dev-other & test
+                    checkpointer.save(model, epoch, step,
+                                      learning_rate, metric_dev_best)
+                else:
+                    start_time_eval = time.time()
+                    # dev
                     if 'word' in params['label_type']:
-                        metric_dev_other_epoch, _ = do_eval_wer(
-                            models=[model],
-                            dataset=dev_other_data,
+                        metric_dev_epoch, _ = do_eval_wer(
+                            model=model,
+                            dataset=dev_clean_data,
                             beam_width=1,
                             max_decode_len=MAX_DECODE_LEN_WORD,
-                            eval_batch_size=1)
-                        logger.info('  WER (dev-other): %.3f %%' %
-                                    (metric_dev_other_epoch * 100))
-
-                        wer_test_clean, _ = do_eval_wer(
-                            models=[model],
-                            dataset=test_clean_data,
-                            beam_width=1,
-                            max_decode_len=MAX_DECODE_LEN_WORD,
-                            eval_batch_size=1)
-                        logger.info('  WER (test-clean): %.3f %%' %
-                                    (wer_test_clean * 100))
-
-                        wer_test_other, _ = do_eval_wer(
-                            models=[model],
-                            dataset=test_other_data,
-                            beam_width=1,
-                            max_decode_len=MAX_DECODE_LEN_WORD,
-                            eval_batch_size=1)
-                        logger.info('  WER (test-other): %.3f %%' %
-                                    (wer_test_other * 100))
-
-                        logger.info('  WER (test-mean): %.3f %%' %
-                                    ((wer_test_clean + wer_test_other) * 100 / 2))
+                            eval_batch_size=1,
+                            distributed=world_size > 1)
+                        logger.info('  WER (dev-clean): %.3f %%' %
+                                    (metric_dev_epoch * 100))
                     else:
-                        metric_dev_other_epoch, wer_dev_other_epoch, _ = do_eval_cer(
-                            models=[model],
-                            dataset=dev_other_data,
-                            beam_width=1,
-                            max_decode_len=MAX_DECODE_LEN_CHAR,
-                            eval_batch_size=1)
-                        logger.info('  CER / WER (dev-other): %.3f %% / %.3f %%' %
-                                    ((metric_dev_other_epoch * 100), (wer_dev_other_epoch * 100)))
-
-                        cer_test_clean, wer_test_clean, _ = do_eval_cer(
-                            models=[model],
-                            dataset=test_clean_data,
-                            beam_width=1,
-                            max_decode_len=MAX_DECODE_LEN_CHAR,
-                            eval_batch_size=1)
-                        logger.info('  CER / WER (test-clean): %.3f %% / %.3f %%' %
-                                    ((cer_test_clean * 100), (wer_test_clean * 100)))
-
-                        cer_test_other, wer_test_other, _ = do_eval_cer(
-                            models=[model],
-                            dataset=test_other_data,
+                        metric_dev_epoch, wer_dev_clean_epoch, _ = do_eval_cer(
+                            model=model,
+                            dataset=dev_clean_data,
                             beam_width=1,
                             max_decode_len=MAX_DECODE_LEN_CHAR,
-                            eval_batch_size=1)
-                        logger.info('  CER / WER (test-other): %.3f %% / %.3f %%' %
-                                    ((cer_test_other * 100), (wer_test_other * 100)))
+                            eval_batch_size=1,
+                            distributed=world_size > 1)
+                        logger.info('  CER / WER (dev-clean): %.3f %% / %.3f %%' %
+                                    ((metric_dev_epoch * 100), (wer_dev_clean_epoch * 100)))
+
+                    if metric_dev_epoch < metric_dev_best:
+                        metric_dev_best = metric_dev_epoch
+                        not_improved_epoch = 0
+                        best_model_tracker.update(model)
+                        logger.info('||||| Best Score |||||')
+
+                        # Save the model
+                        checkpointer.save(model, epoch, step,
+                                          learning_rate, metric_dev_best,
+                                          metric=metric_dev_best)
+
+                        # dev-other & test
+                        if 'word' in params['label_type']:
+                            metric_dev_other_epoch, _ = do_eval_wer(
+                                model=model,
+                                dataset=dev_other_data,
+                                beam_width=1,
+                                max_decode_len=MAX_DECODE_LEN_WORD,
+                                eval_batch_size=1,
+                                distributed=world_size > 1)
+                            logger.info('  WER (dev-other): %.3f %%' %
+                                        (metric_dev_other_epoch * 100))
+
+                            wer_test_clean, _ = do_eval_wer(
+                                model=model,
+                                dataset=test_clean_data,
+                                beam_width=1,
+                                max_decode_len=MAX_DECODE_LEN_WORD,
+                                eval_batch_size=1,
+                                distributed=world_size > 1)
+                            logger.info('  WER (test-clean): %.3f %%' %
+                                        (wer_test_clean * 100))
+
+                            wer_test_other, _ = do_eval_wer(
+                                model=model,
+                                dataset=test_other_data,
+                                beam_width=1,
+                                max_decode_len=MAX_DECODE_LEN_WORD,
+                                eval_batch_size=1,
+                                distributed=world_size > 1)
+                            logger.info('  WER (test-other): %.3f %%' %
+                                        (wer_test_other * 100))
+
+                            logger.info('  WER (test-mean): %.3f %%' %
+                                        ((wer_test_clean + wer_test_other) * 100 / 2))
+                        else:
+                            metric_dev_other_epoch, wer_dev_other_epoch, _ = do_eval_cer(
+                                model=model,
+                                dataset=dev_other_data,
+                                beam_width=1,
+                                max_decode_len=MAX_DECODE_LEN_CHAR,
+                                eval_batch_size=1,
+                                distributed=world_size > 1)
+                            logger.info('  CER / WER (dev-other): %.3f %% / %.3f %%' %
+                                        ((metric_dev_other_epoch * 100), (wer_dev_other_epoch * 100)))
+
+                            cer_test_clean, wer_test_clean, _ = do_eval_cer(
+                                model=model,
+                                dataset=test_clean_data,
+                                beam_width=1,
+                                max_decode_len=MAX_DECODE_LEN_CHAR,
+                                eval_batch_size=1,
+                                distributed=world_size > 1)
+                            logger.info('  CER / WER (test-clean): %.3f %% / %.3f %%' %
+                                        ((cer_test_clean * 100), (wer_test_clean * 100)))
+
+                            cer_test_other, wer_test_other, _ = do_eval_cer(
+                                model=model,
+                                dataset=test_other_data,
+                                beam_width=1,
+                                max_decode_len=MAX_DECODE_LEN_CHAR,
+                                eval_batch_size=1,
+                                distributed=world_size > 1)
+                            logger.info('  CER / WER (test-other): %.3f %% / %.3f %%' %
+                                        ((cer_test_other * 100), (wer_test_other * 100)))
+
+                            logger.info('  CER / WER (test-mean): %.3f %% / %.3f %%' %
+                                        (((cer_test_clean + cer_test_other) * 100 / 2),
+                                         ((wer_test_clean + wer_test_other) * 100 / 2)))
 
-                        logger.info('  CER / WER (test-mean): %.3f %% / %.3f %%' %
-                                    (((cer_test_clean + cer_test_other) * 100 / 2),
-                                     ((wer_test_clean + wer_test_other) * 100 / 2)))
-
-                else:
-                    not_improved_epoch += 1
-
-                duration_eval = time.time() - start_time_eval
-                logger.info('Evaluation time: %.3f min' % (duration_eval / 60))
-
-                # Early stopping
-                if not_improved_epoch == params['not_improved_patient_epoch']:
+                    else:
+                        not_improved_epoch += 1
+
+                    duration_eval = time.time() - start_time_eval
+                    logger.info('Evaluation time: %.3f min' % (duration_eval / 60))
+
+                    # Early stopping
+                    if not_improved_epoch == params['not_improved_patient_epoch']:
+                        break
+
+                    # Update learning rate
+                    model.optimizer, learning_rate = lr_controller.decay_lr(
+                        optimizer=model.optimizer,
+                        learning_rate=learning_rate,
+                        epoch=epoch,
+                        value=metric_dev_epoch)
+
+                    if epoch == params['convert_to_sgd_epoch']:
+                        # Convert to fine-tuning stage
+                        model.set_optimizer(
+                            'sgd',
+                            learning_rate_init=learning_rate,
+                            weight_decay=float(params['weight_decay']),
+                            clip_grad_norm=params['clip_grad_norm'],
+                            lr_schedule=False,
+                            factor=params['decay_rate'],
+                            patience_epoch=params['decay_patient_epoch'])
+                        logger.info('========== Convert to SGD ==========')
+
+                        # Inject Gaussian noise to all parameters
+                        if float(params['weight_noise_std']) > 0:
+                            model.weight_noise_injection = True
+
+                pbar_epoch = tqdm(total=len(train_data))
+                print('========== EPOCH:%d (%.3f min) ==========' %
+                      (epoch, duration_epoch / 60))
+
+                if epoch == params['num_epoch']:
                     break
 
-                # Update learning rate
-                model.optimizer, learning_rate = lr_controller.decay_lr(
-                    optimizer=model.optimizer,
-                    learning_rate=learning_rate,
-                    epoch=epoch,
-                    value=metric_dev_epoch)
-
-                if epoch == params['convert_to_sgd_epoch']:
-                    # Convert to fine-tuning stage
-                    model.set_optimizer(
-                        'sgd',
-                        learning_rate_init=learning_rate,
-                        weight_decay=float(params['weight_decay']),
-                        clip_grad_norm=params['clip_grad_norm'],
-                        lr_schedule=False,
-                        factor=params['decay_rate'],
-                        patience_epoch=params['decay_patient_epoch'])
-                    logger.info('========== Convert to SGD ==========')
-
-                    # Inject Gaussian noise to all parameters
-                    if float(params['weight_noise_std']) > 0:
-                        model.weight_noise_injection = True
-
-            pbar_epoch = tqdm(total=len(train_data))
-            print('========== EPOCH:%d (%.3f min) ==========' %
-                  (epoch, duration_epoch / 60))
-
-            if epoch == params['num_epoch']:
-                break
-
-            start_time_step = time.time()
-            start_time_epoch = time.time()
-            epoch += 1
-
-    # TODO: evaluate the best model by beam search here
-
-    duration_train = time.time() - start_time_train
-    logger.info('Total time: %.3f hour' % (duration_train / 3600))
-
-    if params['backend'] == 'pytorch':
-        tf_writer.close()
-
-    # Training was finished correctly
-    with open(os.path.join(model.save_path, 'COMPLETE'), 'w') as f:
-        f.write('')
+                start_time_step = time.time()
+                start_time_epoch = time.time()
+                epoch += 1
+
+        # Wait for pending checkpoints to be written
+        checkpointer.close()
+
+        # Training was finished correctly
+        # NOTE: the evaluation worker evaluates the remaining checkpoints and
+        # exits when it finds this file
+        if rank == 0:
+            with open(os.path.join(model.save_path, 'COMPLETE'), 'w') as f:
+                f.write('')
+
+        if eval_worker is not None:
+            # Wait for the results of the remaining checkpoints so that they
+            # are considered in selecting the best model
+            stop_worker(eval_worker, model.save_path, timeout=None)
+            for result in eval_results.poll():
+                logger.info('  (epoch:%d) %s' % (result['epoch'], ' / '.join(
+                    ['%s: %.3f %%' % (k, v * 100) for k, v in sorted(result.items()) if k != 'epoch'])))
+                if params['backend'] == 'pytorch':
+                    for k, v in result.items():
+                        if k != 'epoch':
+                            tf_writer.add_scalar('eval/' + k, v, result['epoch'])
+
+                if result['metric_dev'] < metric_dev_best:
+                    metric_dev_best = result['metric_dev']
+                    best_model_tracker.update(
+                        model, model_path=os.path.join(model.save_path, 'model.epoch-' + str(result['epoch'])))
+                    logger.info('||||| Best Score (epoch:%d) |||||' %
+                                result['epoch'])
+
+        duration_train = time.time() - start_time_train
+        logger.info('Total time: %.3f hour' % (duration_train / 3600))
+
+        # Report which utterance lengths needed splitting for OOM recovery
+        log_split_stats()
+
+        if params['backend'] == 'pytorch' and rank == 0:
+            histogram_logger.close()
+            tf_writer.close()
+
+        # Evaluate the best model by beam search
+        best_model = best_model_tracker.restore(model)
+        if 'word' in params['label_type']:
+            wer_test_clean_best, _ = do_eval_wer(
+                model=best_model,
+                dataset=test_clean_data,
+                beam_width=10,
+                max_decode_len=MAX_DECODE_LEN_WORD,
+                eval_batch_size=1,
+                distributed=world_size > 1)
+            logger.info('  WER (test-clean, beam: 10): %.3f %%' %
+                        (wer_test_clean_best * 100))
+
+            wer_test_other_best, _ = do_eval_wer(
+                model=best_model,
+                dataset=test_other_data,
+                beam_width=10,
+                max_decode_len=MAX_DECODE_LEN_WORD,
+                eval_batch_size=1,
+                distributed=world_size > 1)
+            logger.info('  WER (test-other, beam: 10): %.3f %%' %
+                        (wer_test_other_best * 100))
+        else:
+            cer_test_clean_best, wer_test_clean_best, _ = do_eval_cer(
+                model=best_model,
+                dataset=test_clean_data,
+                beam_width=10,
+                max_decode_len=MAX_DECODE_LEN_CHAR,
+                eval_batch_size=1,
+                distributed=world_size > 1)
+            logger.info('  CER / WER (test-clean, beam: 10): %.3f %% / %.3f %%' %
+                        ((cer_test_clean_best * 100), (wer_test_clean_best * 100)))
+
+            cer_test_other_best, wer_test_other_best, _ = do_eval_cer(
+                model=best_model,
+                dataset=test_other_data,
+                beam_width=10,
+                max_decode_len=MAX_DECODE_LEN_CHAR,
+                eval_batch_size=1,
+                distributed=world_size > 1)
+            logger.info('  CER / WER (test-other, beam: 10): %.3f %% / %.3f %%' %
+                        ((cer_test_other_best * 100), (wer_test_other_best * 100)))
+
+    finally:
+        if eval_worker is not None:
+            stop_worker(eval_worker, model.save_path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,315 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Train the RNN language model (Librispeech corpus)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import time
+import math
+from setproctitle import setproctitle
+import argparse
+from tensorboardX import SummaryWriter
+from tqdm import tqdm
+
+import torch
+torch.manual_seed(1623)
+torch.cuda.manual_seed_all(1623)
+
+sys.path.append(os.path.abspath('../../../'))
+from models.load_model import load
+from examples.librispeech.s5.exp.dataset.load_dataset_lm import Dataset
+from utils.training.learning_rate_controller import Controller
+from utils.training.training_loop import train_lm_step
+from utils.training.plot import plot_loss
+from utils.training.logging import set_logger
+from utils.directory import mkdir_join
+from utils.config import load_config, save_config
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--gpu', type=int, default=-1,
+                    help='the index of GPU (negative value indicates CPU)')
+parser.add_argument('--config_path', type=str, default=None,
+                    help='path to the configuration file')
+parser.add_argument('--model_save_path', type=str,
+                    help='path to save the model')
+parser.add_argument('--saved_model_path', type=str, default=None,
+                    help='path to the saved model to retrain')
+parser.add_argument('--data_save_path', type=str, help='path to saved data')
+
+
+def eval_ppl(model, dataset):
+    """Compute perplexity over the whole dataset.
+    Args:
+        model: the RNNLM
+        dataset: An instance of a `Dataset' class
+    Returns:
+        ppl (float): perplexity
+    """
+    # Reset data counter
+    dataset.reset()
+
+    loss_sum, num_tokens = 0., 0
+    while True:
+        batch, is_new_epoch = dataset.next()
+
+        # NOTE: the loss is averaged over tokens including <EOS>
+        num_tokens_batch = sum(batch['y_lens']) + len(batch['y_lens'])
+        loss_sum += model(batch['ys'], batch['y_lens'],
+                          is_eval=True) * num_tokens_batch
+        num_tokens += num_tokens_batch
+
+        if is_new_epoch:
+            break
+
+    return math.exp(loss_sum / num_tokens)
+
+
+def main():
+
+    args = parser.parse_args()
+
+    ##################################################
+    # DATSET
+    ##################################################
+    if args.model_save_path is not None:
+        # Load a config file (.yml)
+        params = load_config(args.config_path)
+    # NOTE: Retrain the saved model from the last checkpoint
+    elif args.saved_model_path is not None:
+        params = load_config(os.path.join(args.saved_model_path, 'config.yml'))
+    else:
+        raise ValueError("Set model_save_path or saved_model_path.")
+
+    # Load dataset
+    vocab_file_path = '../metrics/vocab_files/' + \
+        params['label_type'] + '_' + params['data_size'] + '.txt'
+    train_data = Dataset(
+        data_save_path=args.data_save_path,
+        data_type='train', data_size=params['data_size'],
+        label_type=params['label_type'], vocab_file_path=vocab_file_path,
+        batch_size=params['batch_size'], max_epoch=params['num_epoch'],
+        sort_utt=True, sort_stop_epoch=params['sort_stop_epoch'],
+        save_format=params['save_format'])
+    dev_clean_data = Dataset(
+        data_save_path=args.data_save_path,
+        data_type='dev_clean', data_size=params['data_size'],
+        label_type=params['label_type'], vocab_file_path=vocab_file_path,
+        batch_size=params['batch_size'], shuffle=True,
+        save_format=params['save_format'])
+    params['num_classes'] = train_data.num_classes
+
+    ##################################################
+    # MODEL
+    ##################################################
+    # Model setting
+    model = load(model_type=params['model_type'],
+                 params=params,
+                 backend=params['backend'])
+
+    if args.model_save_path is not None:
+
+        # Set save path
+        save_path = mkdir_join(
+            args.model_save_path, params['backend'],
+            params['model_type'], params['label_type'],
+            params['data_size'], model.name)
+        model.set_save_path(save_path)
+
+        # Save config file
+        save_config(config_path=args.config_path, save_path=model.save_path)
+
+        # Setting for logging
+        logger = set_logger(model.save_path)
+
+        # Count total parameters
+        for name in sorted(list(model.num_params_dict.keys())):
+            num_params = model.num_params_dict[name]
+            logger.info("%s %d" % (name, num_params))
+        logger.info("Total %.3f M parameters" %
+                    (model.total_parameters / 1000000))
+
+        # Define optimizer
+        model.set_optimizer(
+            optimizer=params['optimizer'],
+            learning_rate_init=float(params['learning_rate']),
+            weight_decay=float(params['weight_decay']),
+            clip_grad_norm=params['clip_grad_norm'],
+            lr_schedule=False,
+            factor=params['decay_rate'],
+            patience_epoch=params['decay_patient_epoch'])
+
+        epoch, step = 1, 0
+        learning_rate = float(params['learning_rate'])
+        ppl_dev_best = float('inf')
+
+    # NOTE: Retrain the saved model from the last checkpoint
+    elif args.saved_model_path is not None:
+
+        # Set save path
+        model.save_path = args.saved_model_path
+
+        # Setting for logging
+        logger = set_logger(model.save_path, restart=True)
+
+        # Define optimizer
+        model.set_optimizer(
+            optimizer=params['optimizer'],
+            learning_rate_init=float(params['learning_rate']),  # on-the-fly
+            weight_decay=float(params['weight_decay']),
+            clip_grad_norm=params['clip_grad_norm'],
+            lr_schedule=False,
+            factor=params['decay_rate'],
+            patience_epoch=params['decay_patient_epoch'])
+
+        # Restore the last saved model
+        epoch, step, learning_rate, ppl_dev_best = model.load_checkpoint(
+            save_path=args.saved_model_path, epoch=-1, restart=True)
+
+    else:
+        raise ValueError("Set model_save_path or saved_model_path.")
+
+    train_data.epoch = epoch - 1
+
+    # GPU setting
+    model.set_cuda(deterministic=False, benchmark=True)
+
+    # Setting for mixed precision training
+    if 'mixed_precision' in params.keys() and params['mixed_precision']:
+        model.set_mixed_precision()
+
+    logger.info('PID: %s' % os.getpid())
+    logger.info('USERNAME: %s' % os.uname()[1])
+
+    # Set process name
+    setproctitle('libri_' + params['backend'] + '_' + params['model_type'] + '_' +
+                 params['label_type'] + '_' + params['data_size'])
+
+    ##################################################
+    # TRAINING LOOP
+    ##################################################
+    # Define learning rate controller
+    lr_controller = Controller(
+        learning_rate_init=learning_rate,
+        backend=params['backend'],
+        decay_start_epoch=params['decay_start_epoch'],
+        decay_rate=params['decay_rate'],
+        decay_patient_epoch=params['decay_patient_epoch'],
+        lower_better=True)
+
+    # Setting for tensorboard
+    tf_writer = SummaryWriter(model.save_path)
+
+    # Train model
+    csv_steps, csv_loss_train, csv_loss_dev = [], [], []
+    start_time_train = time.time()
+    start_time_epoch = time.time()
+    start_time_step = time.time()
+    not_improved_epoch = 0
+    loss_train_mean = 0.
+    pbar_epoch = tqdm(total=len(train_data))
+    while True:
+        # Compute loss in the training set (including parameter update)
+        batch_train, is_new_epoch = train_data.next()
+        # NOTE: the loss is scaled in mixed precision training
+        model, loss_train_val = train_lm_step(
+            model, batch_train, params['clip_grad_norm'])
+        loss_train_mean += loss_train_val
+
+        pbar_epoch.update(len(batch_train['ys']))
+
+        if (step + 1) % params['print_step'] == 0:
+
+            # Compute loss in the dev set
+            batch_dev = dev_clean_data.next()[0]
+            loss_dev = model(batch_dev['ys'], batch_dev['y_lens'],
+                             is_eval=True)
+
+            loss_train_mean /= params['print_step']
+            csv_steps.append(step)
+            csv_loss_train.append(loss_train_mean)
+            csv_loss_dev.append(loss_dev)
+
+            # Logging by tensorboard
+            tf_writer.add_scalar('train/loss', loss_train_mean, step + 1)
+            tf_writer.add_scalar('dev/loss', loss_dev, step + 1)
+
+            duration_step = time.time() - start_time_step
+            logger.info("...Step:%d(epoch:%.3f) loss:%.3f(%.3f)/ppl:%.3f(%.3f)/lr:%.5f/batch:%d (%.3f min)" %
+                        (step + 1, train_data.epoch_detail,
+                         loss_train_mean, loss_dev,
+                         math.exp(loss_train_mean), math.exp(loss_dev),
+                         learning_rate, train_data.current_batch_size,
+                         duration_step / 60))
+            start_time_step = time.time()
+            loss_train_mean = 0.
+        step += 1
+
+        # Save checkpoint and evaluate model per epoch
+        if is_new_epoch:
+            duration_epoch = time.time() - start_time_epoch
+            logger.info('===== EPOCH:%d (%.3f min) =====' %
+                        (epoch, duration_epoch / 60))
+
+            # Save fugure of loss
+            plot_loss(csv_loss_train, csv_loss_dev, csv_steps,
+                      save_path=model.save_path)
+
+            start_time_eval = time.time()
+            # dev
+            ppl_dev_epoch = eval_ppl(model, dev_clean_data)
+            logger.info('  PPL (dev-clean): %.3f' % ppl_dev_epoch)
+            tf_writer.add_scalar('dev/ppl', ppl_dev_epoch, epoch)
+
+            if ppl_dev_epoch < ppl_dev_best:
+                ppl_dev_best = ppl_dev_epoch
+                not_improved_epoch = 0
+                logger.info('||||| Best Score |||||')
+
+                # Save the model
+                model.save_checkpoint(model.save_path, epoch, step,
+                                      learning_rate, ppl_dev_best)
+            else:
+                not_improved_epoch += 1
+
+            duration_eval = time.time() - start_time_eval
+            logger.info('Evaluation time: %.3f min' % (duration_eval / 60))
+
+            # Early stopping
+            if not_improved_epoch == params['not_improved_patient_epoch']:
+                break
+
+            # Update learning rate
+            model.optimizer, learning_rate = lr_controller.decay_lr(
+                optimizer=model.optimizer,
+                learning_rate=learning_rate,
+                epoch=epoch,
+                value=ppl_dev_epoch)
+
+            pbar_epoch = tqdm(total=len(train_data))
+            print('========== EPOCH:%d (%.3f min) ==========' %
+                  (epoch, duration_epoch / 60))
+
+            if epoch == params['num_epoch']:
+                break
+
+            start_time_step = time.time()
+            start_time_epoch = time.time()
+            epoch += 1
+
+    duration_train = time.time() - start_time_train
+    logger.info('Total time: %.3f hour' % (duration_train / 3600))
+
+    tf_writer.close()
+
+    # Training was finished correctly
+    with open(os.path.join(model.save_path, 'COMPLETE'), 'w') as f:
+        f.write('')
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,7 @@ import re
 
 sys.path.append(abspath('../../../'))
 from models.load_model import load
-from examples.librispeech.data.load_dataset_hierarchical import Dataset
+from examples.librispeech.s5.exp.dataset.load_dataset_hierarchical import Dataset
 from utils.io.labels.character import Idx2char
 from utils.io.labels.word import Idx2word
 from utils.config import load_config
@@ -28,6 +28,8 @@ parser.add_argument('--epoch', type=int, default=-1,
 parser.add_argument('--beam_width', type=int, default=1,
                     help='beam_width (int, optional): beam width for beam search.' +
                     ' 1 disables beam search, which mean greedy decoding.')
+parser.add_argument('--beam_width_sub', type=int, default=1,
+                    help='the size of beam in the sub task')
 parser.add_argument('--eval_batch_size', type=int, default=1,
                     help='the size of mini-batch in evaluation')
 parser.add_argument('--max_decode_len', type=int, default=100,
@@ -80,6 +82,7 @@ def main():
     decode(model=model,
            dataset=test_data,
            beam_width=args.beam_width,
+           beam_width_sub=args.beam_width_sub,
            max_decode_len=args.max_decode_len,
            max_decode_len_sub=args.max_decode_len_sub,
            eval_batch_size=args.eval_batch_size,
@@ -88,7 +91,7 @@ def main():
 
 
 def decode(model, dataset, beam_width, max_decode_len, max_decode_len_sub,
-           eval_batch_size=None, save_path=None):
+           beam_width_sub=1, eval_batch_size=None, save_path=None):
     """Visualize label outputs.
     Args:
         model: the model to evaluate
@@ -98,6 +101,7 @@ def decode(model, dataset, beam_width, max_decode_len, max_decode_len_sub,
             to stop prediction when EOS token have not been emitted.
             This is used for seq2seq models.
         max_decode_len_sub (int)
+        beam_width_sub (int, optional): the size of beam in the sub task
         eval_batch_size (int, optional): the batch size when evaluating the model
         save_path (string): path to save decoding results
     """
@@ -125,15 +129,12 @@ def decode(model, dataset, beam_width, max_decode_len, max_decode_len_sub,
                 max_decode_len=max_decode_len,
                 max_decode_len_sub=100)
         else:
-            best_hyps, perm_idx = model.decode(
+            best_hyps, _, best_hyps_sub, _, perm_idx = model.decode_multi_task(
                 batch['xs'], batch['x_lens'],
                 beam_width=beam_width,
-                max_decode_len=max_decode_len)
-            best_hyps_sub, perm_idx = model.decode(
-                batch['xs'], batch['x_lens'],
-                beam_width=beam_width,
-                max_decode_len=max_decode_len_sub,
-                is_sub_task=True)
+                max_decode_len=max_decode_len,
+                beam_width_sub=beam_width_sub,
+                max_decode_len_sub=max_decode_len_sub)
 
         ys = batch['ys'][perm_idx]
         y_lens = batch['y_lens'][perm_idx]
@@ -11,7 +11,6 @@ import os
 import sys
 import time
 from setproctitle import setproctitle
-import copy
 import argparse
 from tensorboardX import SummaryWriter
 from tqdm import tqdm
@@ -27,8 +26,12 @@ from examples.swbd.s5c.exp.metrics.character import eval_char
 from examples.swbd.s5c.exp.metrics.word import eval_word
 from utils.training.learning_rate_controller import Controller
 from utils.training.plot import plot_loss
-from utils.training.training_loop import train_step
+from utils.training.training_loop import train_step, log_split_stats
 from utils.training.logging import set_logger
+from utils.training.profiler import StepProfiler
+from utils.training.histogram_logger import HistogramLogger
+from utils.training.checkpointer import Checkpointer
+from utils.training.best_model_tracker import BestModelTracker
 from utils.directory import mkdir_join
 from utils.config import load_config, save_config
 
@@ -195,6 +198,16 @@ def main():
     # GPU setting
     model.set_cuda(deterministic=False, benchmark=True)
 
+    # Setting for mixed precision training
+    if 'mixed_precision' in params.keys() and params['mixed_precision']:
+        model.set_mixed_precision()
+
+    # Setting for activation checkpointing
+    if 'checkpoint_layers' in params.keys() or 'checkpoint_conv' in params.keys():
+        model.set_activation_checkpointing(
+            layers=params['checkpoint_layers'] if 'checkpoint_layers' in params.keys() else [],
+            conv='checkpoint_conv' in params.keys() and params['checkpoint_conv'])
+
     logger.info('PID: %s' % os.getpid())
     logger.info('USERNAME: %s' % os.uname()[1])
 
@@ -217,6 +230,34 @@ def main():
     # Setting for tensorboard
     if params['backend'] == 'pytorch':
         tf_writer = SummaryWriter(model.save_path)
+        histogram_options = {}
+        for key, name in [('histogram_max_num_params', 'max_num_params'),
+                          ('histogram_interval', 'min_interval'),
+                          ('histogram_time_budget', 'time_budget'),
+                          ('histogram_patterns', 'patterns'),
+                          ('histogram_queue_size', 'queue_size')]:
+            if key in params.keys():
+                histogram_options[name] = params[key]
+        histogram_logger = HistogramLogger(tf_writer, **histogram_options)
+
+    # Setting for profiling
+    if 'profile' in params.keys() and params['profile'] and params['backend'] == 'pytorch':
+        profiler = StepProfiler(use_cuda=model.use_cuda,
+                                num_stack=params['num_stack'])
+        profiler.instrument_model(model)
+        profiler.instrument_dataset(train_data)
+    else:
+        profiler = None
+
+    # Setting for checkpointing
+    checkpointer = Checkpointer(model.save_path, backend=params['backend'])
+    if 'keep_last_checkpoints' in params.keys():
+        checkpointer.keep_last = params['keep_last_checkpoints']
+    if 'keep_best_checkpoints' in params.keys():
+        checkpointer.keep_best = params['keep_best_checkpoints']
+    if 'checkpoint_interval' in params.keys():
+        # NOTE: the interval is set in minutes
+        checkpointer.interval = params['checkpoint_interval'] * 60
 
     # Train model
     csv_steps, csv_loss_train, csv_loss_dev = [], [], []
@@ -224,18 +265,35 @@ def main():
     start_time_epoch = time.time()
     start_time_step = time.time()
     not_improved_epoch = 0
-    best_model = model
     loss_train_mean = 0.
     pbar_epoch = tqdm(total=len(train_data))
+    if 'max_frames_per_step' in params.keys():
+        # NOTE: gradients are accumulated over micro-batches. The budget is
+        # counted in input frames before frame stacking
+        max_frames_per_step = params['max_frames_per_step']
+    else:
+        max_frames_per_step = 0
+    if 'best_model_dtype' in params.keys():
+        # NOTE: float16 halves host memory of the snapshot of the best model
+        best_model_dtype = getattr(torch, params['best_model_dtype'])
+    else:
+        best_model_dtype = None
+    best_model_tracker = BestModelTracker(backend=params['backend'],
+                                          dtype=best_model_dtype)
     while True:
         # Compute loss in the training set (including parameter update)
         batch_train, is_new_epoch = train_data.next()
         model, loss_train_val = train_step(
-            model, batch_train, params['clip_grad_norm'], backend=params['backend'])
+            model, batch_train, params['clip_grad_norm'], backend=params['backend'],
+            max_frames_per_step=max_frames_per_step, profiler=profiler)
         loss_train_mean += loss_train_val
 
         pbar_epoch.update(len(batch_train['xs']))
 
+        # Save checkpoint per interval
+        checkpointer.save_step(model, epoch, step,
+                               learning_rate, metric_dev_best)
+
         if (step + 1) % params['print_step'] == 0:
 
             # Compute loss in the dev set
@@ -253,12 +311,11 @@ def main():
             if params['backend'] == 'pytorch':
                 tf_writer.add_scalar('train/loss', loss_train_mean, step + 1)
                 tf_writer.add_scalar('dev/loss', loss_dev, step + 1)
-                for name, param in model.named_parameters():
-                    name = name.replace('.', '/')
-                    tf_writer.add_histogram(
-                        name, param.data.cpu().numpy(), step + 1)
-                    tf_writer.add_histogram(
-                        name + '/grad', param.grad.data.cpu().numpy(), step + 1)
+                histogram_logger.log(model, step + 1)
+
+            # Logging of per-phase time
+            if profiler is not None:
+                profiler.report(step + 1, tf_writer)
 
             duration_step = time.time() - start_time_step
             logger.info("...Step:%d(epoch:%.3f) loss:%.3f(%.3f)/lr:%.5f/batch:%d/x_lens:%d (%.3f min)" %
@@ -283,8 +340,8 @@ def main():
 
             if epoch < params['eval_start_epoch']:
                 # Save the model
-                model.save_checkpoint(model.save_path, epoch, step,
-                                      learning_rate, metric_dev_best)
+                checkpointer.save(model, epoch, step,
+                                  learning_rate, metric_dev_best)
             else:
                 start_time_eval = time.time()
                 # dev
@@ -310,12 +367,13 @@ def main():
                 if metric_dev < metric_dev_best:
                     metric_dev_best = metric_dev
                     not_improved_epoch = 0
-                    best_model = copy.deepcopy(model)
+                    best_model_tracker.update(model)
                     logger.info('||||| Best Score |||||')
 
                     # Save the model
-                    model.save_checkpoint(model.save_path, epoch, step,
-                                          learning_rate, metric_dev_best)
+                    checkpointer.save(model, epoch, step,
+                                      learning_rate, metric_dev_best,
+                                      metric=metric_dev_best)
 
                     # test
                     if 'word' in params['label_type']:
@@ -406,14 +464,58 @@ def main():
             start_time_epoch = time.time()
             epoch += 1
 
-    # TODO: evaluate the best model by beam search here
+    # Wait for pending checkpoints to be written
+    checkpointer.close()
 
     duration_train = time.time() - start_time_train
     logger.info('Total time: %.3f hour' % (duration_train / 3600))
 
+    # Report which utterance lengths needed splitting for OOM recovery
+    log_split_stats()
+
     if params['backend'] == 'pytorch':
+        histogram_logger.close()
         tf_writer.close()
 
+    # Evaluate the best model by beam search
+    best_model = best_model_tracker.restore(model)
+    if 'word' in params['label_type']:
+        wer_eval2000_swbd_best, _ = eval_word(
+            models=[best_model],
+            dataset=eval2000_swbd_data,
+            beam_width=10,
+            max_decode_len=MAX_DECODE_LEN_WORD,
+            eval_batch_size=1)
+        logger.info('  WER (SWB, beam: 10): %.3f %%' %
+                    (wer_eval2000_swbd_best * 100))
+
+        wer_eval2000_ch_best, _ = eval_word(
+            models=[best_model],
+            dataset=eval2000_ch_data,
+            beam_width=10,
+            max_decode_len=MAX_DECODE_LEN_WORD,
+            eval_batch_size=1)
+        logger.info('  WER (CHE, beam: 10): %.3f %%' %
+                    (wer_eval2000_ch_best * 100))
+    else:
+        wer_eval2000_swbd_best, cer_eval2000_swbd_best, _ = eval_char(
+            models=[best_model],
+            dataset=eval2000_swbd_data,
+            beam_width=10,
+            max_decode_len=MAX_DECODE_LEN_CHAR,
+            eval_batch_size=1)
+        logger.info('  WER / CER (SWB, beam: 10): %.3f / %.3f %%' %
+                    ((wer_eval2000_swbd_best * 100), (cer_eval2000_swbd_best * 100)))
+
+        wer_eval2000_ch_best, cer_eval2000_ch_best, _ = eval_char(
+            models=[best_model],
+            dataset=eval2000_ch_data,
+            beam_width=10,
+            max_decode_len=MAX_DECODE_LEN_CHAR,
+            eval_batch_size=1)
+        logger.info('  WER / CER (CHE, beam: 10): %.3f / %.3f %%' %
+                    ((wer_eval2000_ch_best * 100), (cer_eval2000_ch_best * 100)))
+
     # Training was finished correctly
     with open(os.path.join(model.save_path, 'COMPLETE'), 'w') as f:
         f.write('')
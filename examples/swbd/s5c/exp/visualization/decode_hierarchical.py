@@ -83,7 +83,7 @@ def main():
            beam_width=args.beam_width,
            beam_width_sub=args.beam_width_sub,
            eval_batch_size=args.eval_batch_size,
-           save_path=None
+           save_path=None,
            # save_path=args.model_path
            resolving_unk=False)
 
@@ -126,15 +126,13 @@ def decode(model, dataset, beam_width, beam_width_sub,
                 max_decode_len=MAX_DECODE_LEN_WORD,
                 max_decode_len_sub=MAX_DECODE_LEN_CHAR)
         else:
-            best_hyps, aw, perm_idx = model.decode(
+            best_hyps, aw, best_hyps_sub, aw_sub, perm_idx = model.decode_multi_task(
                 batch['xs'], batch['x_lens'],
                 beam_width=beam_width,
-                max_decode_len=MAX_DECODE_LEN_WORD)
-            best_hyps_sub, aw_sub, _ = model.decode(
-                batch['xs'], batch['x_lens'],
-                beam_width=beam_width_sub,
-                max_decode_len=MAX_DECODE_LEN_CHAR,
-                task_index=1)
+                max_decode_len=MAX_DECODE_LEN_WORD,
+                beam_width_sub=beam_width_sub,
+                max_decode_len_sub=MAX_DECODE_LEN_CHAR,
+                return_aw=True)
 
         ys = batch['ys'][perm_idx]
         y_lens = batch['y_lens'][perm_idx]
@@ -98,20 +98,16 @@ def plot(model, dataset, eval_batch_size, save_path=None):
 
     for batch, is_new_epoch in dataset:
 
-        # Get CTC probs
-        probs = model.posteriors(batch['xs'], batch['x_lens'],
-                                 temperature=1)
-        probs_sub = model.posteriors(batch['xs'], batch['x_lens'], is_sub_task=True,
-                                     temperature=1)
+        # Decode and get CTC probs with a single pass of the encoder
+        best_hyps, probs, best_hyps_sub, probs_sub, perm_idx = model.decode_multi_task(
+            batch['xs'], batch['x_lens'],
+            beam_width=1,
+            beam_width_sub=1,
+            return_probs=True)
         # NOTE: probs: '[B, T, num_classes]'
         # NOTE: probs_sub: '[B, T, num_classes_sub]'
-
-        # Decode
-        best_hyps = model.decode(batch['xs'], batch['x_lens'],
-                                 beam_width=1)
-        best_hyps_sub = model.decode(batch['xs'], batch['x_lens'],
-                                     beam_width=1,
-                                     is_sub_task=True)
+        x_lens = batch['x_lens'][perm_idx]
+        input_names = batch['input_names'][perm_idx]
 
         # Visualize
         for b in range(len(batch['xs'])):
@@ -120,15 +116,15 @@ def plot(model, dataset, eval_batch_size, save_path=None):
             str_hyp = idx2word(best_hyps[b])
             str_hyp_sub = idx2char(best_hyps_sub[b])
 
-            speaker = batch['input_names'][b].split('_')[0]
+            speaker = input_names[b].split('_')[0]
             plot_hierarchical_ctc_probs(
-                probs[b, :batch['x_lens'][b], :],
-                probs_sub[b, :batch['x_lens'][b], :],
-                frame_num=batch['x_lens'][b],
+                probs[b, :x_lens[b], :],
+                probs_sub[b, :x_lens[b], :],
+                frame_num=x_lens[b],
                 num_stack=dataset.num_stack,
                 str_hyp=str_hyp,
                 str_hyp_sub=str_hyp_sub,
-                save_path=mkdir_join(save_path, speaker, batch['input_names'][b] + '.png'))
+                save_path=mkdir_join(save_path, speaker, input_names[b] + '.png'))
 
         if is_new_epoch:
             break
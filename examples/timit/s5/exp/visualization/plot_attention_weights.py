@@ -103,7 +103,8 @@ def plot_attention(model, dataset, eval_batch_size, beam_width, length_penalty,
             batch['xs'], batch['x_lens'],
             beam_width=beam_width,
             max_decode_len=MAX_DECODE_LEN_PHONE,
-            length_penalty=length_penalty)
+            length_penalty=length_penalty,
+            return_aw=True)
 
         ys = batch['ys'][perm_idx]
         y_lens = batch['y_lens'][perm_idx]
@@ -19,7 +19,7 @@ from utils.evaluation.resolving_unk import resolve_unk
 
 
 def eval_word(models, dataset, beam_width, max_decode_len,
-              beam_width_sub=1, max_decode_len_sub=300,
+              beam_width_sub=None, max_decode_len_sub=300,
               eval_batch_size=None, length_penalty=0,
               progressbar=False, temperature=1,
               resolving_unk=False, a2c_oracle=False):
@@ -30,9 +30,12 @@ def eval_word(models, dataset, beam_width, max_decode_len,
         max_decode_len (int): the length of output sequences
             to stop prediction. This is used for seq2seq models.
         beam_width_sub (int, optional): the size of beam in ths sub task
-            This is used for the nested attention
+            This is used for the nested attention and resolving UNK.
+            If None, 1 is used for the nested attention and beam_width is
+            used for resolving UNK.
         max_decode_len_sub (int, optional): the length of output sequences
             to stop prediction. This is used for the nested attention
+            and resolving UNK
         eval_batch_size (int, optional): the batch size when evaluating the model
         progressbar (bool, optional): if True, visualize the progressbar
         temperature (int, optional):
@@ -105,26 +108,29 @@ def eval_word(models, dataset, beam_width, max_decode_len,
                 best_hyps, aw, best_hyps_sub, aw_sub, perm_idx = model.decode(
                     batch['xs'], batch['x_lens'],
                     beam_width=beam_width,
-                    beam_width_sub=beam_width_sub,
+                    beam_width_sub=1 if beam_width_sub is None else beam_width_sub,
                     max_decode_len=max_decode_len,
                     max_decode_len_sub=max_label_num if a2c_oracle else max_decode_len_sub,
                     length_penalty=length_penalty,
                     teacher_forcing=a2c_oracle,
                     ys_sub=ys_sub,
                     y_lens_sub=y_lens_sub)
+            elif resolving_unk:
+                # Decode both tasks with a single pass of the encoder
+                best_hyps, aw, best_hyps_sub, aw_sub, perm_idx = model.decode_multi_task(
+                    batch['xs'], batch['x_lens'],
+                    beam_width=beam_width,
+                    max_decode_len=max_decode_len,
+                    beam_width_sub=beam_width if beam_width_sub is None else beam_width_sub,
+                    max_decode_len_sub=max_decode_len_sub,
+                    length_penalty=length_penalty,
+                    return_aw=True)
             else:
                 best_hyps, aw, perm_idx = model.decode(
                     batch['xs'], batch['x_lens'],
                     beam_width=beam_width,
                     max_decode_len=max_decode_len,
                     length_penalty=length_penalty)
-                if resolving_unk:
-                    best_hyps_sub, aw_sub, _ = model.decode(
-                        batch['xs'], batch['x_lens'],
-                        beam_width=beam_width,
-                        max_decode_len=max_decode_len_sub,
-                        length_penalty=length_penalty,
-                        task_index=1)
 
         ys = batch['ys'][perm_idx]
         y_lens = batch['y_lens'][perm_idx]
@@ -15,11 +15,15 @@ def load(model_type, params, backend):
     Args:
         model_type (string): ctc or student_ctc or attention or
             hierarchical_ctc or hierarchical_attention or nested_attention
+            or rnnlm
         params (dict): dict of hyperparameters
         backend (string): pytorch or chainer
     Returns:
         model (nn.Module): An encoder class
     """
+    if model_type == 'rnnlm':
+        return _load_rnnlm(params, backend)
+
     model_name = params['encoder_type']
     if params['encoder_type'] in ['cnn', 'resnet']:
         for c in params['conv_channels']:
@@ -700,4 +704,60 @@ def load(model_type, params, backend):
         if bool(params['relax_context_vec_dec']):
             model.name += '_relax'
 
+    # Windowed attention
+    if backend == 'pytorch' and 'attention_window' in params.keys() and params['attention_window'] > 0:
+        model.set_attention_window(
+            params['attention_window'],
+            left=params['attention_window_left'] if 'attention_window_left' in params.keys() else None,
+            center=params['attention_window_center'] if 'attention_window_center' in params.keys() else 'median')
+        model.name += '_win' + str(params['attention_window'])
+
+    return model
+
+
+def _load_rnnlm(params, backend):
+    """Load an RNN language model.
+    Args:
+        params (dict): dict of hyperparameters
+        backend (string): pytorch
+    Returns:
+        model (nn.Module):
+    """
+    if backend != 'pytorch':
+        raise NotImplementedError
+
+    from models.pytorch.lm.rnnlm import RNNLM
+
+    model = RNNLM(
+        num_classes=params['num_classes'],
+        embedding_dim=params['embedding_dim'],
+        rnn_type=params['rnn_type'],
+        bidirectional=params['bidirectional'],
+        num_units=params['num_units'],
+        num_layers=params['num_layers'],
+        dropout_embedding=params['dropout_embedding'],
+        dropout_hidden=params['dropout_hidden'],
+        dropout_output=params['dropout_output'],
+        parameter_init_distribution=params['parameter_init_distribution'],
+        parameter_init=params['parameter_init'],
+        recurrent_weight_orthogonal=params['recurrent_weight_orthogonal'],
+        init_forget_gate_bias_with_one=params['init_forget_gate_bias_with_one'],
+        tie_weights=params['tie_weights'],
+        weight_noise_std=params['weight_noise_std'])
+
+    model.name = params['rnn_type']
+    if params['bidirectional']:
+        model.name = 'b' + model.name
+    model.name += str(params['num_units']) + 'H'
+    model.name += str(params['num_layers']) + 'L'
+    model.name += '_emb' + str(params['embedding_dim'])
+    model.name += '_' + params['optimizer']
+    model.name += '_lr' + str(params['learning_rate'])
+    if params['dropout_hidden'] != 0:
+        model.name += '_drop' + str(params['dropout_hidden'])
+    if params['tie_weights']:
+        model.name += '_tie'
+    if params['weight_noise_std'] != 0:
+        model.name += '_noise' + str(params['weight_noise_std'])
+
     return model
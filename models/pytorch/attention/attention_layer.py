@@ -36,6 +36,12 @@ class AttentionMechanism(nn.Module):
         kernel_size (int, optional): the size of kernel.
             This must be the odd number.
         num_heads (int, optional): the number of heads in the multi-head attention
+        window_size (int, optional): if larger than 0, only encoder frames in
+            a window around the previous attention are scored
+        window_left (int, optional): the number of frames in the window
+            before the center. Default is window_size // 4.
+        window_center (string, optional): median or peak of the previous
+            attention weights
     """
 
     def __init__(self,
@@ -47,7 +53,10 @@ class AttentionMechanism(nn.Module):
                  sigmoid_smoothing=False,
                  out_channels=10,
                  kernel_size=201,
-                 num_heads=1):
+                 num_heads=1,
+                 window_size=0,
+                 window_left=None,
+                 window_center='median'):
 
         super(AttentionMechanism, self).__init__()
 
@@ -57,68 +66,176 @@ class AttentionMechanism(nn.Module):
         self.sigmoid_smoothing = sigmoid_smoothing
         self.num_heads = num_heads
 
+        # Setting for windowed attention
+        self.set_window(window_size, window_left, window_center)
+
         # Multi-head attention
         if num_heads > 1:
             setattr(self, 'W_mha', LinearND(
                 encoder_num_units * num_heads, encoder_num_units))
 
-        for h in range(num_heads):
-            if self.attention_type == 'content':
-                setattr(self, 'W_enc_head' + str(h),
-                        LinearND(encoder_num_units, attention_dim, bias=True))
-                setattr(self, 'W_dec_head' + str(h),
-                        LinearND(decoder_num_units, attention_dim, bias=False))
-                setattr(self, 'V_head' + str(h),
-                        LinearND(attention_dim, 1, bias=False))
-
-            elif self.attention_type == 'location':
-                assert kernel_size % 2 == 1
-
-                setattr(self, 'W_enc_head' + str(h),
-                        LinearND(encoder_num_units, attention_dim, bias=True))
-                setattr(self, 'W_dec_head' + str(h),
-                        LinearND(decoder_num_units, attention_dim, bias=False))
-                setattr(self, 'W_conv_head' + str(h),
-                        LinearND(out_channels, attention_dim, bias=False))
-                # setattr(self, 'conv_head' + str(h),
-                #         nn.Conv1d(in_channels=1,
-                #                   out_channels=out_channels,
-                #                   kernel_size=kernel_size,
-                #                   stride=1,
-                #                   padding=kernel_size // 2,
-                #                   bias=False))
-                setattr(self, 'conv_head' + str(h),
-                        nn.Conv2d(in_channels=1,
-                                  out_channels=out_channels,
+        # NOTE: parameters of all heads are fused into single layers, and
+        # the head dimension is split after projection: `[B, T, H, d]`
+        if self.attention_type == 'content':
+            self.W_enc = LinearND(encoder_num_units, attention_dim * num_heads,
+                                  bias=True)
+            self.W_dec = LinearND(decoder_num_units, attention_dim * num_heads,
+                                  bias=False)
+            self.V = nn.Parameter(torch.Tensor(num_heads, attention_dim))
+
+        elif self.attention_type == 'location':
+            assert kernel_size % 2 == 1
+
+            self.W_enc = LinearND(encoder_num_units, attention_dim * num_heads,
+                                  bias=True)
+            self.W_dec = LinearND(decoder_num_units, attention_dim * num_heads,
+                                  bias=False)
+            self.W_conv = nn.Parameter(
+                torch.Tensor(num_heads, attention_dim, out_channels))
+            # NOTE: grouped convolution (one group per head)
+            self.conv = nn.Conv2d(in_channels=num_heads,
+                                  out_channels=out_channels * num_heads,
                                   kernel_size=(1, kernel_size),
                                   stride=1,
                                   padding=(0, kernel_size // 2),
-                                  bias=False))
-                setattr(self, 'V_head' + str(h),
-                        LinearND(attention_dim, 1, bias=False))
-
-            elif self.attention_type == 'dot_product':
-                setattr(self, 'W_enc_head' + str(h),
-                        LinearND(encoder_num_units, decoder_num_units, bias=False))
-
-            elif self.attention_type == 'rnn_attention':
-                raise NotImplementedError
-
-            elif self.attention_type == 'coverage':
-                setattr(self, 'W_enc_head' + str(h),
-                        LinearND(encoder_num_units, attention_dim, bias=True))
-                setattr(self, 'W_dec_head' + str(h),
-                        LinearND(decoder_num_units, attention_dim, bias=False))
-                setattr(self, 'W_cov_head' + str(h),
-                        LinearND(encoder_num_units, attention_dim, bias=False))
-                setattr(self, 'V_head' + str(h),
-                        LinearND(attention_dim, 1, bias=False))
-                self.aw_cumsum = None
-
-            else:
-                raise TypeError(
-                    "attention_type should be one of [%s], you provided %s." %
-                    (", ".join(ATTENTION_TYPE), attention_type))
+                                  groups=num_heads,
+                                  bias=False)
+            self.V = nn.Parameter(torch.Tensor(num_heads, attention_dim))
+
+        elif self.attention_type == 'dot_product':
+            self.W_enc = LinearND(encoder_num_units, decoder_num_units * num_heads,
+                                  bias=False)
+
+        elif self.attention_type == 'rnn_attention':
+            raise NotImplementedError
+
+        elif self.attention_type == 'coverage':
+            self.W_enc = LinearND(encoder_num_units, attention_dim * num_heads,
+                                  bias=True)
+            self.W_dec = LinearND(decoder_num_units, attention_dim * num_heads,
+                                  bias=False)
+            self.W_cov = LinearND(encoder_num_units, attention_dim * num_heads,
+                                  bias=False)
+            self.V = nn.Parameter(torch.Tensor(num_heads, attention_dim))
+            self.aw_cumsum = None
+
+        else:
+            raise TypeError(
+                "attention_type should be one of [%s], you provided %s." %
+                (", ".join(ATTENTION_TYPE), attention_type))
+
+        for name, param in self.named_parameters():
+            if name in ['V', 'W_conv']:
+                # NOTE: the same initialization as nn.Linear
+                bound = 1 / param.size(-1) ** 0.5
+                nn.init.uniform_(param.data, a=-bound, b=bound)
+
+        # Convert checkpoints saved with per-head layers
+        self._register_load_state_dict_pre_hook(self._convert_state_dict)
+
+        # Cache per mini-batch
+        self.clear()
+
+    def reset(self, enc_out, x_lens):
+        """Precompute the projection of encoder outputs and the mask of
+            padded frames once per mini-batch. They are reused in forward()
+            while the same enc_out is given, until clear() is called.
+        Args:
+            enc_out (torch.FloatTensor): A tensor of size
+                `[B, T_in, encoder_num_units]`
+            x_lens (torch.IntTensor): A tensor of size `[B]`
+        """
+        self._enc_out = enc_out
+        self._x_lens = x_lens
+        self._enc_out_a = self._project_enc_out(enc_out)
+        self._mask = self._make_mask(enc_out, x_lens)
+
+    def clear(self):
+        """Release the cache made by reset()."""
+        self._enc_out = None
+        self._x_lens = None
+        self._enc_out_a = None
+        self._mask = None
+
+    def set_window(self, window_size, left=None, center='median'):
+        """Set windowed attention. Per-step cost is independent of the
+            length of encoder outputs.
+        Args:
+            window_size (int): the number of frames in the window.
+                0 means all frames are scored.
+            left (int, optional): the number of frames before the center.
+                Default is window_size // 4.
+            center (string, optional): median or peak of the previous
+                attention weights
+        """
+        if center not in ['median', 'peak']:
+            raise ValueError('center must be "median" or "peak".')
+        self.window_size = window_size
+        self.window_left = window_size // 4 if left is None else left
+        self.window_center = center
+
+    def _window_indices(self, aw_step, max_time):
+        """Returns indices of encoder frames in the window.
+        Args:
+            aw_step (torch.FloatTensor): A tensor of size `[B, T_in, num_heads]`
+            max_time (int):
+        Returns:
+            indices (torch.LongTensor): A tensor of size `[B, window_size]`
+        """
+        aw_sum = aw_step.detach().sum(dim=2)
+        if self.window_center == 'median':
+            # NOTE: the first frame where the cumulative weight exceeds a half
+            # (the first frame before the first step)
+            aw_cumsum = aw_sum.cumsum(dim=1)
+            center = (aw_cumsum < aw_cumsum[:, -1:] * 0.5).sum(dim=1)
+        else:
+            center = aw_sum.argmax(dim=1)
+        start = (center - self.window_left).clamp(0, max_time - self.window_size)
+        return start.unsqueeze(1) + torch.arange(
+            self.window_size, device=aw_step.device).unsqueeze(0)
+
+    def _convert_state_dict(self, state_dict, prefix, local_metadata, strict,
+                            missing_keys, unexpected_keys, error_msgs):
+        """Fuse parameters of per-head layers (W_enc_head0, V_head0, ...)
+            in old checkpoints into those of the fused layers."""
+        def pop_heads(name):
+            keys = [prefix + name.replace('%d', str(h))
+                    for h in range(self.num_heads)]
+            if not all(k in state_dict for k in keys):
+                return None
+            return [state_dict.pop(k) for k in keys]
+
+        for old, new in [('W_enc_head%d.fc.weight', 'W_enc.fc.weight'),
+                         ('W_enc_head%d.fc.bias', 'W_enc.fc.bias'),
+                         ('W_dec_head%d.fc.weight', 'W_dec.fc.weight'),
+                         ('W_cov_head%d.fc.weight', 'W_cov.fc.weight'),
+                         ('conv_head%d.weight', 'conv.weight')]:
+            params = pop_heads(old)
+            if params is not None:
+                state_dict[prefix + new] = torch.cat(params, dim=0)
+
+        # `[1, attention_dim]` * H -> `[H, attention_dim]`
+        params = pop_heads('V_head%d.fc.weight')
+        if params is not None:
+            state_dict[prefix + 'V'] = torch.cat(params, dim=0)
+
+        # `[attention_dim, out_channels]` * H -> `[H, attention_dim, out_channels]`
+        params = pop_heads('W_conv_head%d.fc.weight')
+        if params is not None:
+            state_dict[prefix + 'W_conv'] = torch.stack(params, dim=0)
+
+    def _project_enc_out(self, enc_out):
+        """Returns a tensor of size `[B, T_in, H, d]`."""
+        if self.attention_type in ['content', 'location', 'dot_product', 'coverage']:
+            batch_size, max_time = enc_out.size()[:2]
+            return self.W_enc(enc_out).view(
+                batch_size, max_time, self.num_heads, -1)
+        return None
+
+    def _make_mask(self, enc_out, x_lens):
+        max_time = enc_out.size(1)
+        x_lens = x_lens.to(enc_out.device)
+        return torch.arange(max_time, device=enc_out.device).unsqueeze(0) < x_lens.unsqueeze(1)
 
     def forward(self, enc_out, x_lens, dec_out, aw_step):
         """Forward computation.
@@ -138,112 +255,128 @@ class AttentionMechanism(nn.Module):
         """
         batch_size, max_time = enc_out.size()[:2]
 
-        energy = []
-        for h in range(self.num_heads):
-            if self.attention_type == 'content':
-                ##############################################################
-                # energy = <v, tanh(W([h_dec; h_enc] + b))>
-                ##############################################################
-                dec_out = dec_out.expand_as(torch.zeros(
-                    (batch_size, max_time, dec_out.size(2))))
-                energy_head = getattr(self, 'V_head' + str(h))(F.tanh(
-                    getattr(self, 'W_enc_head' + str(h))(enc_out) +
-                    getattr(self, 'W_dec_head' + str(h))(dec_out))).squeeze(2)
-
-            elif self.attention_type == 'location':
-                ##############################################################
-                # f = F * α_{i-1}
-                # energy = <v, tanh(W([h_dec; h_enc] + W_conv(f) + b))>
-                ##############################################################
-                # For 1D conv
-                # conv_feat = getattr(self, 'conv_head' + str(h))(
-                #     aw_step[:, :, h].contiguous().unsqueeze(dim=1))
-
-                # For 2D conv
-                conv_feat = getattr(self, 'conv_head' + str(h))(
-                    aw_step[:, :, h].contiguous().view(batch_size, 1, 1, max_time)).squeeze(2)
-
-                # # -> `[B, out_channels, T_in]`
-                conv_feat = conv_feat.transpose(1, 2).contiguous()
-                # -> `[B, T_in, out_channels]`
-
-                dec_out = dec_out.expand_as(torch.zeros(
-                    (batch_size, max_time, dec_out.size(2))))
-                energy_head = getattr(self, 'V_head' + str(h))(F.tanh(
-                    getattr(self, 'W_enc_head' + str(h))(enc_out) +
-                    getattr(self, 'W_dec_head' + str(h))(dec_out) +
-                    getattr(self, 'W_conv_head' + str(h))(conv_feat))).squeeze(2)
-
-            elif self.attention_type == 'dot_product':
-                ##############################################################
-                # energy = <W_enc(h_enc), h_dec>
-                ##############################################################
-                energy_head = torch.bmm(
-                    getattr(self, 'W_enc_head' + str(h))(enc_out),
-                    dec_out.transpose(1, 2)).squeeze(2)
-
-            elif self.attention_type == 'rnn_attention':
-                raise NotImplementedError
-
-            elif self.attention_type == 'coverage':
-                raise NotImplementedError
-
-                ##############################################################
-                # energy = <v, tanh(W([h_dec; h_enc, coverage] + b))>
-                ##############################################################
-                # Sum all previous attention weights
-                if self.aw_cumsum is None:
-                    self.aw_cumsum = aw_step
-                else:
-                    self.aw_cumsum += aw_step
-
-                dec_out = dec_out.expand_as(torch.zeros(
-                    (batch_size, max_time, dec_out.size(2))))
-                energy_head = getattr(self, 'V_head' + str(h))(F.tanh(
-                    getattr(self, 'W_enc_head' + str(h))(enc_out) +
-                    getattr(self, 'W_dec_head' + str(h))(dec_out) +
-                    getattr(self, 'W_cov_head' + str(h))(self.aw_cumsum))).squeeze(2)
-
-            else:
-                raise NotImplementedError
-
-            energy.append(energy_head)
-
-        context_vec = []
-        aw_step = []
-        for h in range(self.num_heads):
-            # Mask attention distribution
-            energy_mask = torch.ones(batch_size, max_time)
-            if enc_out.is_cuda:
-                energy_mask = energy_mask.cuda()
-            for b in range(batch_size):
-                if x_lens[b].item() < max_time:
-                    energy_mask[b, x_lens[b]:] = 0
-            energy[h] *= energy_mask
-            # NOTE: energy[h]: `[B, T_in]`
-
-            # Sharpening
-            energy[h] *= self.sharpening_factor
-
-            # Compute attention weights
-            if self.sigmoid_smoothing:
-                aw_step_head = F.sigmoid(energy[h])
-                # for b in range(batch_size):
-                #     aw_step_head[b] /= aw_step_head[b].sum()
+        # NOTE: the cache is used only for the tensors given to reset()
+        if self._enc_out is enc_out and self._x_lens is x_lens:
+            enc_out_a = self._enc_out_a
+            mask = self._mask
+        else:
+            enc_out_a = self._project_enc_out(enc_out)
+            mask = self._make_mask(enc_out, x_lens)
+
+        # Windowed attention
+        max_time_full = max_time
+        if self.window_size > 0 and max_time > self.window_size:
+            indices = self._window_indices(aw_step, max_time)
+            enc_out = _gather_time(enc_out, indices)
+            if enc_out_a is not None:
+                enc_out_a = _gather_time(enc_out_a, indices)
+            mask = mask.gather(1, indices)
+            aw_step = _gather_time(aw_step, indices)
+            max_time = self.window_size
+            # NOTE: the frames out of the window are not scored
+        else:
+            indices = None
+
+        if self.attention_type in ['content', 'location', 'coverage']:
+            # NOTE: `[B, 1, H, attention_dim]` is broadcasted along T_in
+            dec_out_a = self.W_dec(dec_out).view(
+                batch_size, 1, self.num_heads, -1)
+
+        if self.attention_type == 'content':
+            ##############################################################
+            # energy = <v, tanh(W([h_dec; h_enc] + b))>
+            ##############################################################
+            energy = torch.einsum('bthd,hd->bth',
+                                  F.tanh(enc_out_a + dec_out_a), self.V)
+
+        elif self.attention_type == 'location':
+            ##############################################################
+            # f = F * α_{i-1}
+            # energy = <v, tanh(W([h_dec; h_enc] + W_conv(f) + b))>
+            ##############################################################
+            conv_feat = self.conv(
+                aw_step.transpose(1, 2).contiguous().unsqueeze(2))
+            # -> `[B, H * out_channels, 1, T_in]`
+            conv_feat = conv_feat.view(
+                batch_size, self.num_heads, -1, max_time)
+            # -> `[B, H, out_channels, T_in]`
+            conv_feat = torch.einsum('bhct,hdc->bthd', conv_feat, self.W_conv)
+            # -> `[B, T_in, H, attention_dim]`
+
+            energy = torch.einsum('bthd,hd->bth',
+                                  F.tanh(enc_out_a + dec_out_a + conv_feat), self.V)
+
+        elif self.attention_type == 'dot_product':
+            ##############################################################
+            # energy = <W_enc(h_enc), h_dec>
+            ##############################################################
+            energy = torch.einsum('bthd,bd->bth', enc_out_a, dec_out[:, 0])
+
+        elif self.attention_type == 'rnn_attention':
+            raise NotImplementedError
+
+        elif self.attention_type == 'coverage':
+            raise NotImplementedError
+
+            ##############################################################
+            # energy = <v, tanh(W([h_dec; h_enc, coverage] + b))>
+            ##############################################################
+            # Sum all previous attention weights
+            if self.aw_cumsum is None:
+                self.aw_cumsum = aw_step
             else:
-                aw_step_head = F.softmax(energy[h], dim=-1)
-            aw_step.append(aw_step_head)
+                self.aw_cumsum += aw_step
+
+            cov_a = self.W_cov(self.aw_cumsum).view(
+                batch_size, max_time, self.num_heads, -1)
+            energy = torch.einsum('bthd,hd->bth',
+                                  F.tanh(enc_out_a + dec_out_a + cov_a), self.V)
+
+        else:
+            raise NotImplementedError
+        # NOTE: energy: `[B, T_in, H]`
+
+        # Mask attention distribution
+        energy = energy.masked_fill(~mask.unsqueeze(2), 0)
 
-            # Compute context vector (weighted sum of encoder outputs)
-            context_vec_head = torch.sum(
-                enc_out * aw_step_head.unsqueeze(2), dim=1, keepdim=True)
-            context_vec.append(context_vec_head)
+        # Sharpening
+        energy = energy * self.sharpening_factor
 
-        # Concatenate all convtext vectors and attention distributions
-        context_vec = torch.cat(context_vec, dim=-1)
-        aw_step = torch.stack(aw_step, dim=-1)
+        # Compute attention weights
+        # NOTE: attention weights are always computed in float32
+        if self.sigmoid_smoothing:
+            aw_step = F.sigmoid(energy.float())
+        else:
+            aw_step = F.softmax(energy.float(), dim=1)
+
+        # Compute context vectors of all heads (weighted sum of encoder outputs)
+        context_vec = torch.bmm(aw_step.transpose(1, 2).type_as(enc_out),
+                                enc_out)
+        # -> `[B, H, encoder_num_units]`
+        context_vec = context_vec.view(batch_size, 1, -1)
+        # NOTE: the same order as concatenating heads
 
         if self.num_heads > 1:
             context_vec = getattr(self, 'W_mha')(context_vec)
 
+        # The attention weights out of the window are 0
+        if indices is not None:
+            aw_step = aw_step.new_zeros(
+                batch_size, max_time_full, self.num_heads).scatter(
+                1, indices.unsqueeze(2).expand(-1, -1, self.num_heads), aw_step)
+
         return context_vec, aw_step
+
+
+def _gather_time(xs, indices):
+    """Pick up frames along the time axis.
+    Args:
+        xs (torch.FloatTensor): A tensor of size `[B, T, ...]`
+        indices (torch.LongTensor): A tensor of size `[B, W]`
+    Returns:
+        xs (torch.FloatTensor): A tensor of size `[B, W, ...]`
+    """
+    size = list(xs.size())
+    indices = indices.view(indices.size(0), indices.size(1),
+                           *([1] * (len(size) - 2)))
+    return xs.gather(1, indices.expand(-1, -1, *size[2:]))
@@ -21,9 +21,12 @@ from models.pytorch.attention.attention_layer import AttentionMechanism
 from models.pytorch.ctc.ctc import _concatenate_labels, my_warpctc
 from models.pytorch.criterion import cross_entropy_label_smoothing
 from models.pytorch.ctc.decoders.greedy_decoder import GreedyDecoder
-from models.pytorch.ctc.decoders.beam_search_decoder import BeamSearchDecoder
+from models.pytorch.ctc.decoders.prefix_beam_search import PrefixBeamSearchDecoder
+from models.pytorch.ctc.ctc_prefix_scorer import CTCPrefixScorer
 
+LOG_0 = -float("inf")
 LOG_1 = 0
+CTC_SCORING_RATIO = 1.5
 
 
 class AttentionSeq2seq(ModelBase):
@@ -229,6 +232,12 @@ class AttentionSeq2seq(ModelBase):
         # Setting for MTL
         self.ctc_loss_weight = ctc_loss_weight
 
+        # Setting for pruning in beam search
+        self.beam_score_threshold = 0
+        self.beam_max_active = 0
+        self.beam_end_detection = False
+        self.beam_search_stats = []
+
         ##############################
         # Encoder
         ##############################
@@ -391,7 +400,7 @@ class AttentionSeq2seq(ModelBase):
 
             # Set CTC decoders
             self._decode_ctc_greedy_np = GreedyDecoder(blank_index=0)
-            self._decode_ctc_beam_np = BeamSearchDecoder(blank_index=0)
+            self._decode_ctc_beam_np = PrefixBeamSearchDecoder(blank_index=0)
             # TODO: set space index
 
         ##################################################
@@ -434,7 +443,7 @@ class AttentionSeq2seq(ModelBase):
         """
         if is_eval:
             self.eval()
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 loss = self._forward(xs, ys, x_lens, y_lens).item()
         else:
             self.train()
@@ -443,16 +452,23 @@ class AttentionSeq2seq(ModelBase):
             if self.weight_noise_injection:
                 self.inject_weight_noise(mean=0, std=self.weight_noise_std)
 
-            loss = self._forward(xs, ys, x_lens, y_lens)
+            with self.autocast():
+                loss = self._forward(xs, ys, x_lens, y_lens)
 
             # Update the probability of scheduled sampling
-            self._step += 1
-            if self.ss_prob > 0:
-                self._ss_prob = min(
-                    self.ss_prob, self.ss_prob / self.ss_max_step * self._step)
+            if not getattr(self, 'step_deferred', False):
+                self.advance_step()
 
         return loss
 
+    def advance_step(self):
+        """Advance the training step by one and update the probability of
+            scheduled sampling."""
+        self._step += 1
+        if self.ss_prob > 0:
+            self._ss_prob = min(
+                self.ss_prob, self.ss_prob / self.ss_max_step * self._step)
+
     def _forward(self, xs, ys, x_lens, y_lens):
         # Wrap by Tensor
         xs = self.np2tensor(xs, dtype=torch.float)
@@ -571,6 +587,9 @@ class AttentionSeq2seq(ModelBase):
         # Teacher-forcing
         logits, aw = self._decode_train(enc_out, x_lens, ys_in, task, dir)
 
+        # NOTE: XE loss is always computed in float32
+        logits = logits.float()
+
         # Output smoothing
         if self.logits_temperature != 1:
             logits /= self.logits_temperature
@@ -618,6 +637,9 @@ class AttentionSeq2seq(ModelBase):
         # Path through the fully-connected layer
         logits = getattr(self, 'fc_ctc_' + str(task))(enc_out)
 
+        # NOTE: CTC loss is always computed in float32
+        logits = logits.float()
+
         # Compute CTC loss
         loss = my_warpctc(logits.transpose(0, 1),  # time-major
                           concatenated_labels.cpu(),
@@ -708,6 +730,10 @@ class AttentionSeq2seq(ModelBase):
             (batch_size, max_time, getattr(self, 'num_heads_' + str(task))),
             fill_value=0, dtype=torch.float)
 
+        # Precompute the projection of encoder outputs
+        attend = getattr(self, 'attend_' + str(task) + '_' + dir)
+        attend.reset(enc_out, x_lens)
+
         logits, aw = [], []
         for t in range(ys.size(1)):
             # for scheduled sampling
@@ -716,7 +742,7 @@ class AttentionSeq2seq(ModelBase):
 
             if self.decoding_order == 'attend_generate_update':
                 # Score
-                context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
+                context_vec, aw_step = attend(
                     enc_out, x_lens, dec_out, aw_step)
 
                 # Generate
@@ -738,7 +764,7 @@ class AttentionSeq2seq(ModelBase):
 
             elif self.decoding_order == 'attend_update_generate':
                 # Score
-                context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
+                context_vec, aw_step = attend(
                     enc_out, x_lens, dec_out, aw_step)
 
                 # Sample
@@ -769,7 +795,7 @@ class AttentionSeq2seq(ModelBase):
                     y, dec_state)
 
                 # Score
-                context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
+                context_vec, aw_step = attend(
                     enc_out, x_lens, _dec_out, aw_step)
 
                 # Recurrency of the second decoder
@@ -784,6 +810,8 @@ class AttentionSeq2seq(ModelBase):
             logits.append(logits_step)
             aw.append(aw_step)
 
+        attend.clear()
+
         # Concatenate in T_out-dimension
         logits = torch.cat(logits, dim=1)
         aw = torch.stack(aw, dim=1)
@@ -859,7 +887,7 @@ class AttentionSeq2seq(ModelBase):
 
     def decode(self, xs, x_lens, beam_width, max_decode_len,
                length_penalty=0, coverage_penalty=0, task_index=0,
-               resolving_unk=False):
+               resolving_unk=False, return_aw=False, ctc_weight=0):
         """Decoding in the inference stage.
         Args:
             xs (np.ndarray): A tensor of size `[B, T_in, input_size]`
@@ -871,6 +899,11 @@ class AttentionSeq2seq(ModelBase):
             coverage_penalty (float, optional):
             task_index (int, optional): not used (to make compatible)
             resolving_unk (bool, optional): not used (to make compatible)
+            return_aw (bool, optional): if True, return attention weights.
+                Otherwise they are not kept in beam search and None is
+                returned, which saves memory.
+            ctc_weight (float, optional): the weight of CTC prefix scores in
+                joint CTC/attention decoding. 0 means attention only.
         Returns:
             best_hyps (np.ndarray): A tensor of size `[B]`
             # aw (np.ndarray): A tensor of size `[B, T_out, T_in, num_heads]`
@@ -888,16 +921,20 @@ class AttentionSeq2seq(ModelBase):
 
             dir = 'fwd'if self.fwd_weight_0 >= self.bwd_weight_0 else 'bwd'
 
-            if beam_width == 1:
+            # NOTE: joint CTC/attention decoding is always done by beam search
+            if beam_width == 1 and ctc_weight == 0:
                 best_hyps, aw = self._decode_infer_greedy(
                     enc_out, x_lens, max_decode_len, task=0, dir=dir)
             else:
                 best_hyps, aw = self._decode_infer_beam(
                     enc_out, x_lens, beam_width, max_decode_len,
-                    length_penalty, coverage_penalty, task=0, dir=dir)
+                    length_penalty, coverage_penalty, task=0, dir=dir,
+                    keep_aw=return_aw, ctc_weight=ctc_weight)
 
         # TODO: fix this
-        if beam_width == 1:
+        if not return_aw:
+            aw = None
+        elif beam_width == 1 and ctc_weight == 0:
             aw = aw[:, :, :, 0]
 
         # Permutate indices to the original order
@@ -935,75 +972,35 @@ class AttentionSeq2seq(ModelBase):
         eos = getattr(self, 'eos_' + str(task))
         y = self._create_tensor(
             (batch_size, 1), fill_value=sos, dtype=torch.long)
-        y_emb = getattr(self, 'embed_' + str(task))(y)
+        context_vec = None
+
+        # Precompute the projection of encoder outputs
+        attend = getattr(self, 'attend_' + str(task) + '_' + dir)
+        attend.reset(enc_out, x_lens)
+
+        # Setting for shallow fusion
+        # NOTE: the language model predicts tokens in the forward order
+        rnnlm = getattr(self, 'rnnlm_' + str(task), None) if dir == 'fwd' else None
+        lm_state = None
 
         best_hyps, aw = [], []
         y_lens = np.zeros((batch_size,), dtype=np.int32)
         eos_flag = [False] * batch_size
-        for _ in range(max_decode_len):
-            if self.decoding_order == 'attend_generate_update':
-                # Score
-                context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
-                    enc_out, x_lens, dec_out, aw_step)
-
-                # Generate
-                logits_step = getattr(self, 'fc_' + str(task) + '_' + dir)(F.tanh(
-                    getattr(self, 'W_d_' + str(task) + '_' + dir)(dec_out) +
-                    getattr(self, 'W_c_' + str(task) + '_' + dir)(context_vec)))
-
-                # Pick up 1-best
-                y = torch.max(logits_step.squeeze(1), dim=1)[1].unsqueeze(1)
-                best_hyps.append(y)
-                y_emb = getattr(self, 'embed_' + str(task))(y)
-
-                # Recurrency
-                dec_in = torch.cat([y_emb, context_vec], dim=-1)
-                dec_out, dec_state = getattr(
-                    self, 'decoder_' + str(task) + '_' + dir)(dec_in, dec_state)
-
-            elif self.decoding_order == 'attend_update_generate':
-                # Score
-                context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
-                    enc_out, x_lens, dec_out, aw_step)
-
-                # Recurrency
-                dec_in = torch.cat([y_emb, context_vec], dim=-1)
-                dec_out, dec_state = getattr(
-                    self, 'decoder_' + str(task) + '_' + dir)(dec_in, dec_state)
-
-                # Generate
-                logits_step = getattr(self, 'fc_' + str(task) + '_' + dir)(F.tanh(
-                    getattr(self, 'W_d_' + str(task) + '_' + dir)(dec_out) +
-                    getattr(self, 'W_c_' + str(task) + '_' + dir)(context_vec)))
-
-                # Pick up 1-best
-                y = torch.max(logits_step.squeeze(1), dim=1)[1].unsqueeze(1)
-                best_hyps.append(y)
-                y_emb = getattr(self, 'embed_' + str(task))(y)
-
-            elif self.decoding_order == 'conditional':
-                # Recurrency of the first decoder
-                _dec_out, _dec_state = getattr(self, 'decoder_first_' + str(task) + '_' + dir)(
-                    y_emb, dec_state)
-
-                # Score
-                context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
-                    enc_out, x_lens, _dec_out, aw_step)
-
-                # Recurrency of the second decoder
-                dec_out, dec_state = getattr(self, 'decoder_second_' + str(task) + '_' + dir)(
-                    context_vec, _dec_state)
-
-                # Generate
-                logits_step = getattr(self, 'fc_' + str(task) + '_' + dir)(F.tanh(
-                    getattr(self, 'W_d_' + str(task) + '_' + dir)(dec_out) +
-                    getattr(self, 'W_c_' + str(task) + '_' + dir)(context_vec)))
-
-                # Pick up 1-best
-                y = torch.max(logits_step.squeeze(1), dim=1)[1].unsqueeze(1)
-                best_hyps.append(y)
-                y_emb = getattr(self, 'embed_' + str(task))(y)
-
+        for t in range(max_decode_len):
+            logits_step, context_vec, dec_out, dec_state, aw_step = self._decode_step(
+                enc_out, x_lens, y, context_vec, dec_out, dec_state, aw_step,
+                task, dir, is_first=(t == 0))
+            scores_step = logits_step.squeeze(1)
+
+            # Shallow fusion
+            if rnnlm is not None:
+                lm_log_probs, lm_state = rnnlm.predict(y, lm_state)
+                scores_step = F.log_softmax(scores_step, dim=-1) + \
+                    getattr(self, 'rnnlm_weight_' + str(task)) * lm_log_probs
+
+            # Pick up 1-best
+            y = torch.max(scores_step, dim=1)[1].unsqueeze(1)
+            best_hyps.append(y)
             aw.append(aw_step)
 
             # Count lengths of hypotheses
@@ -1020,6 +1017,8 @@ class AttentionSeq2seq(ModelBase):
             if torch.sum(y == eos) == y.numel():
                 break
 
+        attend.clear()
+
         # Concatenate in T_out dimension
         best_hyps = torch.cat(best_hyps, dim=1)
         aw = torch.stack(aw, dim=1)
@@ -1036,8 +1035,17 @@ class AttentionSeq2seq(ModelBase):
         return best_hyps, aw
 
     def _decode_infer_beam(self, enc_out, x_lens, beam_width, max_decode_len,
-                           length_penalty, coverage_penalty, task, dir):
+                           length_penalty, coverage_penalty, task, dir,
+                           keep_aw=True, ctc_weight=0, keep_dec_out=False):
         """Beam search decoding in the inference stage.
+            All hypotheses of all utterances are decoded as one batch of size
+            `[B * beam_width]`. Each step keeps only the parent index and the
+            token of each hypothesis, and hypotheses are backtracked at the end.
+            Active hypotheses are pruned as set by set_beam_pruning(), and the
+            number of steps and pruned hypotheses of each utterance are
+            appended to self.beam_search_stats while pruning is enabled.
+            If ctc_weight > 0, the top candidates of each hypothesis are
+            rescored by CTC prefix scores (joint CTC/attention decoding).
         Args:
             enc_out (torch.FloatTensor): A tensor of size
                 `[B, T_in, encoder_num_units]`
@@ -1049,163 +1057,384 @@ class AttentionSeq2seq(ModelBase):
             coverage_penalty (float):
             task (int): the index of a task
             dir (str): fwd or bwd
+            keep_aw (bool, optional): if True, keep attention weights of
+                all steps to return them
+            ctc_weight (float, optional): the weight of CTC prefix scores
+            keep_dec_out (bool, optional): if True, also return the decoder
+                outputs which generated each token of the best hypotheses
         Returns:
             best_hyps (np.ndarray): A tensor of size `[B]`
+            aw (list): list of np.ndarray of size `[T_out, T_in]`.
+                None if keep_aw is False.
+            dec_outs (list): list of torch.FloatTensor of size
+                `[T_out, decoder_num_units]` (only if keep_dec_out is True)
         """
         if dir == 'bwd':
             assert getattr(self, 'bwd_weight_' + str(task)) > 0
+            if ctc_weight > 0:
+                raise ValueError(
+                    'ctc_weight is not supported with the backward decoder.')
+
+        batch_size, max_time = enc_out.size()[:2]
+
+        if ctc_weight > 0:
+            if not hasattr(self, 'fc_ctc_' + str(task)):
+                raise ValueError(
+                    'ctc_weight > 0 requires a model trained with the CTC loss.')
+            # NOTE: CTC posteriors are computed before expanding to beams
+            ctc_log_probs = F.log_softmax(
+                getattr(self, 'fc_ctc_' + str(task))(enc_out), dim=-1)
 
         # Start from <SOS>
         sos = getattr(self, 'sos_' + str(task))
         eos = getattr(self, 'eos_' + str(task))
 
-        best_hyps, aw = [], []
-        for b in range(enc_out.size(0)):
-            # Initialization per utterance
-            dec_state, dec_out = self._init_dec_state(
-                enc_out[b:b + 1], x_lens[b:b + 1], task, dir)
-            aw_step = self._create_tensor(
-                (1, x_lens[b].item(), getattr(self, 'num_heads_' + str(task))),
-                fill_value=0, dtype=torch.float)
+        # Expand to `[B * beam_width]`
+        beam_offset = torch.arange(
+            batch_size, device=enc_out.device) * beam_width
+        indices = torch.arange(
+            batch_size, device=enc_out.device).repeat_interleave(beam_width)
+        enc_out = enc_out.index_select(0, indices)
+        x_lens = x_lens.index_select(0, indices)
+
+        # Setting for joint CTC/attention decoding
+        if ctc_weight > 0:
+            # NOTE: index 0 is reserved for blank in warpctc_pytorch
+            ctc_scorer = CTCPrefixScorer(ctc_log_probs.index_select(0, indices),
+                                         x_lens, blank=0, eos=eos)
+            ctc_state = ctc_scorer.initial_state()
+        else:
+            ctc_scorer = None
+
+        # Initialize decoder state
+        dec_state, dec_out = self._init_dec_state(enc_out, x_lens, task, dir)
+        aw_step = self._create_tensor(
+            (batch_size * beam_width, max_time,
+             getattr(self, 'num_heads_' + str(task))),
+            fill_value=0, dtype=torch.float)
+        context_vec = None
 
-            complete = []
-            beam = [{'hyp': [sos],
-                     'score': LOG_1,
-                     'dec_state': dec_state,
-                     'dec_out': dec_out,
-                     'aw_steps': [aw_step]}]
-            for t in range(max_decode_len):
-                new_beam = []
-                for i_beam in range(len(beam)):
-                    if self.decoding_order == 'attend_generate_update':
-                        # Score
-                        context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
-                            enc_out[b:b + 1], x_lens[b:b + 1],
-                            beam[i_beam]['dec_out'], beam[i_beam]['aw_steps'][-1])
-
-                        # Generate
-                        logits_step = getattr(self, 'fc_' + str(task) + '_' + dir)(F.tanh(
-                            getattr(self, 'W_d_' + str(task) + '_' + dir)(beam[i_beam]['dec_out']) +
-                            getattr(self, 'W_c_' + str(task) + '_' + dir)(context_vec)))
-                        # NOTE: Recurrency is placed at the latter stage
-
-                    elif self.decoding_order == 'attend_update_generate':
-                        y = self._create_tensor(
-                            (1,), fill_value=beam[i_beam]['hyp'][-1], dtype=torch.long).unsqueeze(1)
-                        y = getattr(self, 'embed_' + str(task))(y)
-
-                        # Score
-                        context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
-                            enc_out[b:b + 1], x_lens[b:b + 1],
-                            beam[i_beam]['dec_out'], beam[i_beam]['aw_steps'][-1])
-
-                        # Recurrency
-                        dec_in = torch.cat([y, context_vec], dim=-1)
-                        dec_out, dec_state = getattr(self, 'decoder_' + str(task) + '_' + dir)(
-                            dec_in, beam[i_beam]['dec_state'])
-
-                        # Generate
-                        logits_step = getattr(self, 'fc_' + str(task) + '_' + dir)(F.tanh(
-                            getattr(self, 'W_d_' + str(task) + '_' + dir)(dec_out) +
-                            getattr(self, 'W_c_' + str(task) + '_' + dir)(context_vec)))
-
-                    elif self.decoding_order == 'conditional':
-                        y = self._create_tensor(
-                            (1,), fill_value=beam[i_beam]['hyp'][-1], dtype=torch.long).unsqueeze(1)
-                        y = getattr(self, 'embed_' + str(task))(y)
-
-                        # Recurrency of the first decoder
-                        _dec_out, _dec_state = getattr(self, 'decoder_first_' + str(task) + '_' + dir)(
-                            y, beam[i_beam]['dec_state'])
-
-                        # Score
-                        context_vec, aw_step = getattr(self, 'attend_' + str(task) + '_' + dir)(
-                            enc_out[b:b + 1], x_lens[b:b + 1],
-                            _dec_out, beam[i_beam]['aw_steps'][-1])
-
-                        # Recurrency of the second decoder
-                        dec_out, dec_state = getattr(self, 'decoder_second_' + str(task) + '_' + dir)(
-                            context_vec, _dec_state)
-
-                        # Generate
-                        logits_step = getattr(self, 'fc_' + str(task) + '_' + dir)(F.tanh(
-                            getattr(self, 'W_d_' + str(task) + '_' + dir)(dec_out) +
-                            getattr(self, 'W_c_' + str(task) + '_' + dir)(context_vec)))
-
-                    # Path through the softmax layer & convert to log-scale
-                    log_probs = F.log_softmax(logits_step.squeeze(1), dim=1)
-                    # NOTE: `[1 (B), 1, num_classes]` -> `[1 (B), num_classes]`
-
-                    # Pick up the top-k scores
-                    log_probs_topk, indices_topk = log_probs.topk(
-                        beam_width, dim=1, largest=True, sorted=True)
-
-                    for k in range(beam_width):
-                        if self.decoding_order == 'attend_generate_update':
-                            y = self._create_tensor(
-                                (1,), fill_value=indices_topk[0, k].item(), dtype=torch.long).unsqueeze(1)
-                            y = getattr(self, 'embed_' + str(task))(y)
-
-                            # Recurrency
-                            dec_in = torch.cat([y, context_vec], dim=-1)
-                            dec_out, dec_state = getattr(
-                                self, 'decoder_' + str(task) + '_' + dir)(dec_in, beam[i_beam]['dec_state'])
-
-                        new_beam.append(
-                            {'hyp': beam[i_beam]['hyp'] + [indices_topk[0, k].item()],
-                             'score': beam[i_beam]['score'] + log_probs_topk[0, k].item(),
-                             'dec_state': copy.deepcopy(dec_state),
-                             'dec_out': dec_out,
-                             'aw_steps': beam[i_beam]['aw_steps'] + [aw_step]})
-
-                new_beam = sorted(
-                    new_beam, key=lambda x: x['score'], reverse=True)
-
-                # Remove complete hypotheses
-                not_complete = []
-                for cand in new_beam[:beam_width]:
-                    if cand['hyp'][-1] == eos:
-                        complete.append(cand)
-                    else:
-                        not_complete.append(cand)
-                if len(complete) >= beam_width:
-                    complete = complete[:beam_width]
+        # Precompute the projection of encoder outputs
+        attend = getattr(self, 'attend_' + str(task) + '_' + dir)
+        attend.reset(enc_out, x_lens)
+
+        # NOTE: only the first hypothesis is active at the beginning, the
+        # others are copies of it
+        scores = self._create_tensor(
+            (batch_size, beam_width), fill_value=LOG_0, dtype=torch.float)
+        scores[:, 0] = LOG_1
+        y = self._create_tensor(
+            (batch_size * beam_width, 1), fill_value=sos, dtype=torch.long)
+
+        # Setting for shallow fusion
+        # NOTE: the language model predicts tokens in the forward order
+        rnnlm = getattr(self, 'rnnlm_' + str(task), None) if dir == 'fwd' else None
+        lm_state = None
+
+        # Back-pointers of each step
+        parents, tokens, aw_steps, dec_outs = [], [], [], []
+
+        # Setting for pruning
+        score_threshold = self.beam_score_threshold
+        max_active = self.beam_max_active if 0 < self.beam_max_active < beam_width else 0
+        end_detection = self.beam_end_detection
+        num_pruned = self._create_tensor(
+            (batch_size,), fill_value=0, dtype=torch.long)
+        num_steps = [max_decode_len] * batch_size
+
+        complete = [[] for _ in range(batch_size)]
+        is_done = [False] * batch_size
+        for t in range(max_decode_len):
+            logits_step, context_vec, dec_out, dec_state, aw_step = self._decode_step(
+                enc_out, x_lens, y, context_vec, dec_out, dec_state, aw_step,
+                task, dir, is_first=(t == 0))
+
+            # Path through the softmax layer & convert to log-scale
+            log_probs = F.log_softmax(logits_step.squeeze(1), dim=-1)
+            num_classes = log_probs.size(-1)
+            if ctc_scorer is not None:
+                log_probs = log_probs * (1 - ctc_weight)
+
+            # Shallow fusion
+            # NOTE: the language model runs one batched step for all
+            # hypotheses
+            if rnnlm is not None:
+                lm_log_probs, lm_state = rnnlm.predict(y, lm_state)
+                log_probs = log_probs + \
+                    getattr(self, 'rnnlm_weight_' + str(task)) * lm_log_probs
+
+            # Joint CTC/attention decoding
+            # NOTE: only the top candidates of each hypothesis are rescored,
+            # and the others are pruned
+            if ctc_scorer is not None:
+                log_probs_cand, candidates = log_probs.topk(
+                    min(num_classes, int(beam_width * CTC_SCORING_RATIO)), dim=1)
+                ctc_log_psi, ctc_r = ctc_scorer.score(ctc_state, candidates)
+                log_probs = torch.full_like(log_probs, LOG_0).scatter_(
+                    1, candidates, log_probs_cand + ctc_weight *
+                    (ctc_log_psi - ctc_state[1].unsqueeze(1)))
+
+            # Pick up the top-k scores over all hypotheses of each utterance
+            scores_cand = scores.view(-1, 1) + log_probs
+            scores, indices_topk = scores_cand.view(
+                batch_size, -1).topk(beam_width, dim=1, largest=True, sorted=True)
+            parent = torch.div(indices_topk, num_classes, rounding_mode='floor')
+            parent = (parent + beam_offset.unsqueeze(1)).view(-1)
+            y = (indices_topk % num_classes).view(-1, 1)
+
+            # Reorder hypotheses
+            context_vec = context_vec.index_select(0, parent)
+            dec_out = dec_out.index_select(0, parent)
+            dec_state = self._reorder_dec_state(dec_state, parent)
+            aw_step = aw_step.index_select(0, parent)
+            if rnnlm is not None:
+                lm_state = rnnlm.reorder_state(lm_state, parent)
+            if ctc_scorer is not None:
+                candidate_index = (candidates.index_select(
+                    0, parent) == y).long().argmax(dim=1)
+                ctc_state = ctc_scorer.select(
+                    ctc_state, ctc_log_psi, ctc_r, parent, candidate_index,
+                    y.view(-1))
+            parents.append(parent)
+            tokens.append(y.view(-1))
+            if keep_aw:
+                aw_steps.append(aw_step[:, :, 0])
+                # TODO: fix for multi-head atteniton
+            if keep_dec_out:
+                dec_outs.append(dec_out.squeeze(1))
+
+            # Remove complete hypotheses
+            is_eos = (y.view(batch_size, beam_width) == eos) & (scores > LOG_0)
+            has_eos = is_eos.any().item()
+            if has_eos:
+                scores_np = self.tensor2np(scores)
+                for b, k in zip(*np.nonzero(self.tensor2np(is_eos))):
+                    complete[b].append({'step': t,
+                                        'index': b * beam_width + k,
+                                        'score': scores_np[b, k]})
+                scores = scores.masked_fill(is_eos, LOG_0)
+
+            # Prune active hypotheses
+            if score_threshold > 0 or max_active > 0:
+                is_active = scores > LOG_0
+                if score_threshold > 0:
+                    # NOTE: relative to the best active hypothesis
+                    scores = scores.masked_fill(
+                        scores < scores.max(dim=1, keepdim=True)[0] - score_threshold, LOG_0)
+                if max_active > 0:
+                    # NOTE: scores are sorted in the descending order
+                    rank = (scores > LOG_0).long().cumsum(dim=1)
+                    scores = scores.masked_fill(rank > max_active, LOG_0)
+                num_pruned += (is_active & (scores == LOG_0)).long().sum(dim=1)
+
+            # Check the end of each utterance
+            if has_eos or score_threshold > 0 or max_active > 0 or end_detection:
+                scores_best = self.tensor2np(scores.max(dim=1)[0])
+                for b in range(batch_size):
+                    if is_done[b]:
+                        continue
+                    if len(complete[b]) >= beam_width:
+                        complete[b] = complete[b][:beam_width]
+                        is_done[b] = True
+                    elif scores_best[b] == LOG_0:
+                        is_done[b] = True
+                    elif end_detection and len(complete[b]) > 0:
+                        # NOTE: log-probabilities of the following steps are
+                        # not positive, so the upper bound of active
+                        # hypotheses is given by the maximum length
+                        score_complete_best = max(
+                            [c['score'] + (c['step'] + 2) * length_penalty
+                             for c in complete[b]])
+                        if scores_best[b] + (max_decode_len + 1) * length_penalty <= score_complete_best:
+                            is_done[b] = True
+                    if is_done[b]:
+                        scores[b] = LOG_0
+                        num_steps[b] = t + 1
+                if all(is_done):
                     break
-                beam = not_complete[:beam_width]
 
-            if len(complete) == 0:
-                complete = beam
+        attend.clear()
 
+        # Report the statistics of pruning
+        # NOTE: only while pruning is enabled so that the list does not grow
+        # for the lifetime of the model
+        if self.beam_score_threshold > 0 or self.beam_max_active > 0 or end_detection:
+            num_pruned = self.tensor2np(num_pruned)
+            for b in range(batch_size):
+                self.beam_search_stats.append({
+                    'steps': min(num_steps[b], len(tokens)),
+                    'pruned': int(num_pruned[b])})
+
+        # Use active hypotheses if no hypothesis is complete
+        scores_np = self.tensor2np(scores)
+        for b in range(batch_size):
+            if len(complete[b]) == 0:
+                for k in range(beam_width):
+                    if scores_np[b, k] > LOG_0:
+                        complete[b].append({'step': len(tokens) - 1,
+                                            'index': b * beam_width + k,
+                                            'score': scores_np[b, k]})
+
+        # NOTE: copy back-pointers to CPU at once
+        parents = self.tensor2np(torch.stack(parents, dim=0))
+        tokens = self.tensor2np(torch.stack(tokens, dim=0))
+        if keep_aw:
+            aw_steps = torch.stack(aw_steps, dim=0)
+        if keep_dec_out:
+            dec_outs = torch.stack(dec_outs, dim=0)
+
+        best_hyps, aw, best_dec_outs = [], [], []
+        for b in range(batch_size):
             # Renormalized hypotheses by length
             if length_penalty > 0:
-                for j in range(len(complete)):
-                    complete[j]['score'] += len(complete[j]
-                                                ['hyp']) * length_penalty
+                for j in range(len(complete[b])):
+                    complete[b][j]['score'] += (
+                        complete[b][j]['step'] + 2) * length_penalty
+                    # NOTE: the length includes <SOS> and <EOS>
+
+            best = max(complete[b], key=lambda x: x['score'])
+            best_hyp, indices = _backtrack(
+                parents, tokens, best['step'], best['index'])
+            best_hyps.append(best_hyp)
+            if keep_aw:
+                aw.append(self.tensor2np(aw_steps[
+                    torch.arange(len(indices), device=aw_steps.device),
+                    self.np2tensor(indices, dtype=torch.long)]))
+            if keep_dec_out:
+                best_dec_outs.append(dec_outs[
+                    torch.arange(len(indices), device=dec_outs.device),
+                    self.np2tensor(indices, dtype=torch.long)])
 
-            complete = sorted(
-                complete, key=lambda x: x['score'], reverse=True)
-            best_hyps.append(np.array(complete[0]['hyp'][1:]))
-            # NOTE: Exclude <SOS>
-            aw.append(complete[0]['aw_steps'])
+        # Reverse the order
+        # NOTE: <EOS> is kept at the end, and aw and dec_outs are kept in
+        # the decoding order
+        if dir == 'bwd':
+            for b in range(batch_size):
+                y_len = len(best_hyps[b]) - int(best_hyps[b][-1] == eos)
+                best_hyps[b][:y_len] = best_hyps[b][:y_len][::-1]
 
-        # Concatenate in T_out dimension
-        for j in range(len(aw)):
-            aw[j] = aw[j][1:]
-            # NOTE: exclude the first atteniton weights
+        if keep_dec_out:
+            return np.array(best_hyps), (aw if keep_aw else None), best_dec_outs
+        return np.array(best_hyps), (aw if keep_aw else None)
 
-            for k in range(len(aw[j])):
-                aw[j][k] = aw[j][k][:, :, 0]
-                # TODO: fix for multi-head atteniton
+    def _decode_step(self, enc_out, x_lens, y, context_vec, dec_out, dec_state,
+                     aw_step, task, dir, is_first=False):
+        """One step of the decoder in the inference stage.
+        Args:
+            enc_out (torch.FloatTensor): A tensor of size
+                `[B, T_in, encoder_num_units]`
+            x_lens (torch.IntTensor): A tensor of size `[B]`
+            y (torch.LongTensor): the previous tokens of size `[B, 1]`
+            context_vec (torch.FloatTensor): the previous context vectors
+                of size `[B, 1, encoder_num_units]`
+            dec_out (torch.FloatTensor): A tensor of size
+                `[B, 1, decoder_num_units]`
+            dec_state (list or tuple of list):
+            aw_step (torch.FloatTensor): A tensor of size
+                `[B, T_in, num_heads]`
+            task (int): the index of a task
+            dir (str): fwd or bwd
+            is_first (bool, optional): if True, this is the first step
+        Returns:
+            logits_step (torch.FloatTensor): A tensor of size
+                `[B, 1, num_classes]`
+            context_vec (torch.FloatTensor):
+            dec_out (torch.FloatTensor):
+            dec_state (list or tuple of list):
+            aw_step (torch.FloatTensor):
+        """
+        attend = getattr(self, 'attend_' + str(task) + '_' + dir)
+        embed = getattr(self, 'embed_' + str(task))
+
+        if self.decoding_order == 'attend_generate_update':
+            # NOTE: the recurrency of the previous step is placed here,
+            # after the previous token has been chosen
+            if not is_first:
+                dec_in = torch.cat([embed(y), context_vec], dim=-1)
+                dec_out, dec_state = getattr(
+                    self, 'decoder_' + str(task) + '_' + dir)(dec_in, dec_state)
 
-            aw[j] = self.tensor2np(torch.stack(aw[j], dim=1).squeeze(0))
+            # Score
+            context_vec, aw_step = attend(enc_out, x_lens, dec_out, aw_step)
 
-        # Reverse the order
-        if dir == 'bwd':
-            raise NotImplementedError
-            # for b in range(batch_size):
-            #     best_hyps[b, :y_lens[b]] = best_hyps[b, :y_lens[b]][::-1]
+        elif self.decoding_order == 'attend_update_generate':
+            # Score
+            context_vec, aw_step = attend(enc_out, x_lens, dec_out, aw_step)
+
+            # Recurrency
+            dec_in = torch.cat([embed(y), context_vec], dim=-1)
+            dec_out, dec_state = getattr(
+                self, 'decoder_' + str(task) + '_' + dir)(dec_in, dec_state)
+
+        elif self.decoding_order == 'conditional':
+            # Recurrency of the first decoder
+            _dec_out, _dec_state = getattr(self, 'decoder_first_' + str(task) + '_' + dir)(
+                embed(y), dec_state)
+
+            # Score
+            context_vec, aw_step = attend(enc_out, x_lens, _dec_out, aw_step)
+
+            # Recurrency of the second decoder
+            dec_out, dec_state = getattr(self, 'decoder_second_' + str(task) + '_' + dir)(
+                context_vec, _dec_state)
+
+        # Generate
+        logits_step = getattr(self, 'fc_' + str(task) + '_' + dir)(F.tanh(
+            getattr(self, 'W_d_' + str(task) + '_' + dir)(dec_out) +
+            getattr(self, 'W_c_' + str(task) + '_' + dir)(context_vec)))
+
+        return logits_step, context_vec, dec_out, dec_state, aw_step
+
+    def _reorder_dec_state(self, dec_state, indices):
+        """Reorder decoder states along the batch dimension.
+        Args:
+            dec_state (list or tuple of list):
+            indices (torch.LongTensor): A tensor of size `[B]`
+        Returns:
+            dec_state (list or tuple of list):
+        """
+        if self.decoder_type == 'lstm':
+            hx_list, cx_list = dec_state
+            return ([h.index_select(0, indices) for h in hx_list],
+                    [c.index_select(0, indices) for c in cx_list])
+        else:
+            return [h.index_select(0, indices) for h in dec_state]
 
-        return np.array(best_hyps), aw
+    def set_rnnlm(self, rnnlm, lm_weight, task_index=0):
+        """Use an RNN language model in decoding (shallow fusion).
+        Args:
+            rnnlm (RNNLM): None means no language model
+            lm_weight (float): the weight of the language model
+            task_index (int, optional): the index of a task
+        """
+        num_classes = self.num_classes if task_index == 0 else self.num_classes_sub
+        if rnnlm is not None and rnnlm.num_classes != num_classes:
+            raise ValueError(
+                'The vocabulary of the language model does not match.')
+        # NOTE: the language model is registered as a sub-module so that it
+        # moves to GPUs together. Set this after loading checkpoints.
+        setattr(self, 'rnnlm_' + str(task_index), rnnlm)
+        setattr(self, 'rnnlm_weight_' + str(task_index), lm_weight)
+
+    def set_beam_pruning(self, score_threshold=0, max_active=0,
+                         end_detection=False):
+        """Prune active hypotheses in beam search. This also clears
+            self.beam_search_stats, which is filled only while pruning is
+            enabled.
+        Args:
+            score_threshold (float, optional): prune hypotheses whose scores
+                are lower than that of the best active hypothesis by more
+                than this value. 0 means no pruning.
+            max_active (int, optional): the maximum number of active
+                hypotheses of each utterance per step. 0 means beam_width.
+            end_detection (bool, optional): if True, stop decoding an
+                utterance once no active hypothesis can beat the best
+                complete one under the length penalty
+        """
+        self.beam_score_threshold = score_threshold
+        self.beam_max_active = max_active
+        self.beam_end_detection = end_detection
+        self.beam_search_stats = []
 
     def decode_ctc(self, xs, x_lens, beam_width=1, task_index=0):
         """Decoding by the CTC layer in the inference stage.
@@ -1234,15 +1463,36 @@ class AttentionSeq2seq(ModelBase):
             else:
                 raise NotImplementedError
 
-            # Path through the softmax layer
-            batch_size, max_time = enc_out.size()[:2]
-            enc_out = enc_out.contiguous().view(batch_size * max_time, -1)
-            logits_ctc = getattr(self, 'fc_ctc_' + str(task_index))(enc_out)
-            logits_ctc = logits_ctc.view(batch_size, max_time, -1)
+            best_hyps = self._decode_ctc(enc_out, x_lens, beam_width,
+                                         task_index)
+
+        # Permutate indices to the original order
+        perm_idx = self.tensor2np(perm_idx)
+
+        return best_hyps, perm_idx
+
+    def _decode_ctc(self, enc_out, x_lens, beam_width, task_index):
+        """Greedy or beam search decoding by the CTC layer.
+        Args:
+            enc_out (torch.FloatTensor): A tensor of size
+                `[B, T_in, encoder_num_units]`
+            x_lens (torch.IntTensor): A tensor of size `[B]`
+            beam_width (int): the size of beam
+            task_index (int): the index of a task
+        Returns:
+            best_hyps (np.ndarray): A tensor of size `[B]`
+        """
+        # Path through the softmax layer
+        batch_size, max_time = enc_out.size()[:2]
+        enc_out = enc_out.contiguous().view(batch_size * max_time, -1)
+        logits_ctc = getattr(self, 'fc_ctc_' + str(task_index))(enc_out)
+        logits_ctc = logits_ctc.view(batch_size, max_time, -1)
 
         if beam_width == 1:
+            # NOTE: argmax on GPUs, so that only `[B, T]` is copied
             best_hyps = self._decode_ctc_greedy_np(
-                self.tensor2np(logits_ctc), self.tensor2np(x_lens))
+                self.tensor2np(torch.argmax(logits_ctc, dim=-1)),
+                self.tensor2np(x_lens))
         else:
             best_hyps = self._decode_ctc_beam_np(
                 self.tensor2np(F.log_softmax(logits_ctc, dim=-1)),
@@ -1251,7 +1501,22 @@ class AttentionSeq2seq(ModelBase):
         # NOTE: index 0 is reserved for blank in warpctc_pytorch
         best_hyps -= 1
 
-        # Permutate indices to the original order
-        perm_idx = self.tensor2np(perm_idx)
+        return best_hyps
 
-        return best_hyps, perm_idx
+
+def _backtrack(parents, tokens, step, index):
+    """Backtrack a hypothesis in beam search.
+    Args:
+        parents (np.ndarray): A tensor of size `[T_out, B * beam_width]`
+        tokens (np.ndarray): A tensor of size `[T_out, B * beam_width]`
+        step (int): the last step of the hypothesis
+        index (int): the index of the hypothesis in the last step
+    Returns:
+        hyp (np.ndarray): A tensor of size `[step + 1]`
+        indices (np.ndarray): the index of the hypothesis in each step
+    """
+    indices = np.zeros((step + 1,), dtype=np.int64)
+    for t in range(step, -1, -1):
+        indices[t] = index
+        index = parents[t, index]
+    return tokens[np.arange(step + 1), indices], indices
@@ -16,7 +16,7 @@ from models.pytorch.encoders.load_encoder import load
 from models.pytorch.attention.rnn_decoder import RNNDecoder
 from models.pytorch.attention.attention_layer import AttentionMechanism
 from models.pytorch.ctc.decoders.greedy_decoder import GreedyDecoder
-from models.pytorch.ctc.decoders.beam_search_decoder import BeamSearchDecoder
+from models.pytorch.ctc.decoders.prefix_beam_search import PrefixBeamSearchDecoder
 
 
 class HierarchicalAttentionSeq2seq(AttentionSeq2seq):
@@ -334,7 +334,7 @@ class HierarchicalAttentionSeq2seq(AttentionSeq2seq):
 
             # Set CTC decoders
             self._decode_ctc_greedy_np = GreedyDecoder(blank_index=0)
-            self._decode_ctc_beam_np = BeamSearchDecoder(blank_index=0)
+            self._decode_ctc_beam_np = PrefixBeamSearchDecoder(blank_index=0)
             # NOTE: index 0 is reserved for the blank class
 
         ##################################################
@@ -380,7 +380,7 @@ class HierarchicalAttentionSeq2seq(AttentionSeq2seq):
         """
         if is_eval:
             self.eval()
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 loss, loss_main, loss_sub = self._forward(
                     xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
 
@@ -394,14 +394,13 @@ class HierarchicalAttentionSeq2seq(AttentionSeq2seq):
             if self.weight_noise_injection:
                 self.inject_weight_noise(mean=0, std=self.weight_noise_std)
 
-            loss, loss_main, loss_sub = self._forward(
-                xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
+            with self.autocast():
+                loss, loss_main, loss_sub = self._forward(
+                    xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
 
             # Update the probability of scheduled sampling
-            self._step += 1
-            if self.ss_prob > 0:
-                self._ss_prob = min(
-                    self.ss_prob, self.ss_prob / self.ss_max_step * self._step)
+            if not getattr(self, 'step_deferred', False):
+                self.advance_step()
 
         return loss, loss_main, loss_sub
 
@@ -506,7 +505,8 @@ class HierarchicalAttentionSeq2seq(AttentionSeq2seq):
             return loss, loss_main, ctc_loss_sub
 
     def decode(self, xs, x_lens, beam_width, max_decode_len,
-               length_penalty=0, coverage_penalty=0, task_index=0):
+               length_penalty=0, coverage_penalty=0, task_index=0,
+               return_aw=False, ctc_weight=0):
         """Decoding in the inference stage.
         Args:
             xs (np.ndarray): A tensor of size `[B, T_in, input_size]`
@@ -517,6 +517,11 @@ class HierarchicalAttentionSeq2seq(AttentionSeq2seq):
             length_penalty (float, optional):
             coverage_penalty (float, optional):
             task_index (int, optional): the index of a task
+            return_aw (bool, optional): if True, return attention weights.
+                Otherwise they are not kept in beam search and None is
+                returned, which saves memory.
+            ctc_weight (float, optional): the weight of CTC prefix scores in
+                joint CTC/attention decoding. 0 means attention only.
         Returns:
             best_hyps (np.ndarray): A tensor of size `[B]`
             aw ():
@@ -548,19 +553,101 @@ class HierarchicalAttentionSeq2seq(AttentionSeq2seq):
 
                 dir = 'bwd' if task_index == 1 and self.backward_1 else 'fwd'
                 # Decode by attention decoder
-                if beam_width == 1:
+                if beam_width == 1 and ctc_weight == 0:
                     best_hyps, aw = self._decode_infer_greedy(
                         enc_out, x_lens, max_decode_len, task_index, dir)
                 else:
                     best_hyps, aw = self._decode_infer_beam(
                         enc_out, x_lens, beam_width, max_decode_len,
-                        length_penalty, coverage_penalty, task_index, dir)
+                        length_penalty, coverage_penalty, task_index, dir,
+                        keep_aw=return_aw, ctc_weight=ctc_weight)
 
             # TODO: fix this
-            if beam_width == 1:
+            if not return_aw:
+                aw = None
+            elif beam_width == 1 and ctc_weight == 0:
                 aw = aw[:, :, :, 0]
 
             # Permutate indices to the original order
             perm_idx = self.tensor2np(perm_idx)
 
             return best_hyps, aw, perm_idx
+
+    def decode_multi_task(self, xs, x_lens, beam_width, max_decode_len,
+                          beam_width_sub=1, max_decode_len_sub=None,
+                          length_penalty=0, coverage_penalty=0,
+                          return_aw=False, ctc_weight=0):
+        """Decode the main and sub tasks with a single pass of the encoder.
+        Args:
+            xs (np.ndarray): A tensor of size `[B, T_in, input_size]`
+            x_lens (np.ndarray): A tensor of size `[B]`
+            beam_width (int): the size of beam in the main task
+            max_decode_len (int): the length of output sequences
+                to stop prediction when EOS token have not been emitted
+            beam_width_sub (int, optional): the size of beam in the sub task
+            max_decode_len_sub (int, optional): the length of output sequences
+                in the sub task. If None, max_decode_len is used.
+            length_penalty (float, optional):
+            coverage_penalty (float, optional):
+            return_aw (bool, optional): if False, attention weights are not
+                kept in beam search and None is returned
+            ctc_weight (float, optional): the weight of CTC prefix scores in
+                joint CTC/attention decoding of the main task
+        Returns:
+            best_hyps (np.ndarray): A tensor of size `[B]`
+            aw (np.ndarray): A tensor of size `[B, T_out, T_in]`
+            best_hyps_sub (np.ndarray): A tensor of size `[B]`
+            aw_sub (np.ndarray): A tensor of size `[B, T_out_sub, T_in]`.
+                None if the sub task is decoded by the CTC layer.
+            perm_idx (np.ndarray): A tensor of size `[B]`
+        """
+        if max_decode_len_sub is None:
+            max_decode_len_sub = max_decode_len
+
+        self.eval()
+        with torch.no_grad():
+            # Wrap by Tensor
+            xs = self.np2tensor(xs, dtype=torch.float)
+            x_lens = self.np2tensor(x_lens, dtype=torch.int)
+
+            # Encode acoustic features only once for both tasks
+            enc_out, x_lens, enc_out_sub, x_lens_sub, perm_idx = self._encode(
+                xs, x_lens, is_multi_task=True)
+
+            # Main task
+            if beam_width == 1 and ctc_weight == 0:
+                best_hyps, aw = self._decode_infer_greedy(
+                    enc_out, x_lens, max_decode_len, 0, 'fwd')
+                if return_aw:
+                    aw = aw[:, :, :, 0]
+            else:
+                best_hyps, aw = self._decode_infer_beam(
+                    enc_out, x_lens, beam_width, max_decode_len,
+                    length_penalty, coverage_penalty, 0, 'fwd',
+                    keep_aw=return_aw, ctc_weight=ctc_weight)
+
+            # Sub task
+            if self.ctc_loss_weight_sub > self.sub_loss_weight:
+                best_hyps_sub = self._decode_ctc(
+                    enc_out_sub, x_lens_sub, beam_width_sub, 1)
+                aw_sub = None
+            else:
+                dir = 'bwd' if self.backward_1 else 'fwd'
+                if beam_width_sub == 1:
+                    best_hyps_sub, aw_sub = self._decode_infer_greedy(
+                        enc_out_sub, x_lens_sub, max_decode_len_sub, 1, dir)
+                    if return_aw:
+                        aw_sub = aw_sub[:, :, :, 0]
+                else:
+                    best_hyps_sub, aw_sub = self._decode_infer_beam(
+                        enc_out_sub, x_lens_sub, beam_width_sub,
+                        max_decode_len_sub, length_penalty, coverage_penalty,
+                        1, dir, keep_aw=return_aw)
+
+            if not return_aw:
+                aw, aw_sub = None, None
+
+            # Permutate indices to the original order
+            perm_idx = self.tensor2np(perm_idx)
+
+            return best_hyps, aw, best_hyps_sub, aw_sub, perm_idx
@@ -13,15 +13,16 @@ import copy
 import torch
 import torch.nn.functional as F
 
-from models.pytorch.attention.attention_seq2seq import AttentionSeq2seq
+from models.pytorch.attention.attention_seq2seq import AttentionSeq2seq, _backtrack
 from models.pytorch.linear import LinearND, Embedding, Embedding_LS
 from models.pytorch.encoders.load_encoder import load
 from models.pytorch.attention.rnn_decoder import RNNDecoder
 from models.pytorch.attention.attention_layer import AttentionMechanism
 from models.pytorch.criterion import cross_entropy_label_smoothing
 from models.pytorch.ctc.decoders.greedy_decoder import GreedyDecoder
-from models.pytorch.ctc.decoders.beam_search_decoder import BeamSearchDecoder
+from models.pytorch.ctc.decoders.prefix_beam_search import PrefixBeamSearchDecoder
 
+LOG_0 = -float("inf")
 LOG_1 = 0
 
 
@@ -415,7 +416,7 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
 
             # Set CTC decoders
             self._decode_ctc_greedy_np = GreedyDecoder(blank_index=0)
-            self._decode_ctc_beam_np = BeamSearchDecoder(blank_index=0)
+            self._decode_ctc_beam_np = PrefixBeamSearchDecoder(blank_index=0)
             # NOTE: index 0 is reserved for the blank class
 
         ##################################################
@@ -467,7 +468,7 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
 
         if is_eval:
             self.eval()
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 loss, loss_main, loss_sub = self._forward(
                     xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
 
@@ -481,14 +482,13 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
             if self.weight_noise_injection:
                 self.inject_weight_noise(mean=0, std=self.weight_noise_std)
 
-            loss, loss_main, loss_sub = self._forward(
-                xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
+            with self.autocast():
+                loss, loss_main, loss_sub = self._forward(
+                    xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
 
             # Update the probability of scheduled sampling
-            self._step += 1
-            if self.ss_prob > 0:
-                self._ss_prob = min(
-                    self.ss_prob, self.ss_prob / self.ss_max_step * self._step)
+            if not getattr(self, 'step_deferred', False):
+                self.advance_step()
 
         if second_pass:
             return loss
@@ -602,6 +602,10 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
             enc_out, x_lens, ys_in,
             enc_out_sub, x_lens_sub, ys_in_sub, y_lens_sub)
 
+        # NOTE: XE loss is always computed in float32
+        logits_main = logits_main.float()
+        logits_sub = logits_sub.float()
+
         ##################################################
         # Main task
         ##################################################
@@ -707,6 +711,9 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
             (batch_size, max_time_sub, self.num_heads_1),
             fill_value=0, dtype=torch.float)
 
+        # Precompute the projection of encoder outputs
+        getattr(self, 'attend_1_' + dir).reset(enc_out_sub, x_lens_sub)
+
         dec_out_sub_seq, logits_sub, aw_sub = [], [], []
         for t in range(ys_sub.size(1)):
             # for scheduled sampling
@@ -788,6 +795,8 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
             else:
                 aw_sub.append(aw_step_sub)
 
+        getattr(self, 'attend_1_' + dir).clear()
+
         # Concatenate in T_out-dimension
         dec_out_sub_seq = torch.cat(dec_out_sub_seq, dim=1)
         logits_sub = torch.cat(logits_sub, dim=1)
@@ -809,6 +818,10 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
             (batch_size, dec_out_sub_seq.size(1), self.num_heads_dec),
             fill_value=0, dtype=torch.float)
 
+        # Precompute the projection of encoder outputs and decoder states
+        self.attend_0_fwd.reset(enc_out, x_lens)
+        self.attend_dec_sub.reset(dec_out_sub_seq, y_lens_sub)
+
         logits, aw, aw_dec = [], [], []
         for t in range(ys.size(1)):
             is_sample = self.ss_prob > 0 and t > 0 and self._step > 0 and random.random(
@@ -920,6 +933,9 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
             aw.append(aw_step_enc)
             aw_dec.append(aw_step_dec)
 
+        self.attend_0_fwd.clear()
+        self.attend_dec_sub.clear()
+
         # Concatenate in T_out-dimension
         logits = torch.cat(logits, dim=1)
         aw = torch.stack(aw, dim=1)
@@ -1044,16 +1060,18 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
                 # Next, decode by word-based decoder with character outputs
                 if teacher_forcing:
                     ys_in_sub = ys_in_sub[perm_idx]
+                    y_lens_sub = y_lens_sub[perm_idx]
 
                 best_hyps, aw, best_hyps_sub, aw_sub, _ = self._decode_infer_joint(
                     enc_out, x_lens, enc_out_sub, x_lens_sub,
-                    beam_width=1,
+                    beam_width=beam_width,
                     beam_width_sub=beam_width_sub,
                     max_decode_len=max_decode_len,
                     max_decode_len_sub=max_decode_len_sub,
                     length_penalty=length_penalty,
                     teacher_forcing=teacher_forcing,
-                    ys_sub=ys_in_sub)
+                    ys_sub=ys_in_sub,
+                    y_lens_sub=y_lens_sub)
 
             elif task_index == 1:
                 _, _, enc_out, x_lens, perm_idx = self._encode(
@@ -1087,9 +1105,14 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
                             beam_width, beam_width_sub,
                             max_decode_len, max_decode_len_sub,
                             length_penalty,
-                            teacher_forcing=False, ys_sub=None,
+                            teacher_forcing=False, ys_sub=None, y_lens_sub=None,
                             reverse_backward=True):
-        """Greedy decoding in the inference stage.
+        """Joint decoding in the inference stage. Both the character model
+            and the word model decode all utterances in the mini-batch at once.
+            Decoder outputs of the best character hypotheses are selected as
+            in training and padded, and the word model attends to them with
+            their lengths as the mask.
+            beam_width (beam_width_sub) == 1 means greedy decoding.
         Args:
             enc_out (torch.FloatTensor): A tensor of size
                 `[B, T_in, encoder_num_units]`
@@ -1104,10 +1127,13 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
             max_decode_len_sub (int): the length of output sequences
                 to stop prediction when EOS token have not been emitted
             length_penalty (float, optional):
-            teacher_forcing (bool, optional):
-            ys_sub ():
-            y_lens_sub ():
-            reverse_backward (bool, optional):
+            teacher_forcing (bool, optional): if True, the character model
+                is fed with ys_sub instead of its own hypotheses
+            ys_sub (torch.LongTensor, optional): A tensor of size
+                `[B, T_out_sub + 1]`, which starts with <SOS>
+            y_lens_sub (torch.IntTensor, optional): A tensor of size `[B]`
+            reverse_backward (bool, optional): if False, hypotheses of the
+                backward character model are kept in the decoding order
         Returns:
             best_hyps (np.ndarray): A tensor of size `[B, T_out]`
             aw (np.ndarray): A tensor of size `[B, T_out, T_in]`
@@ -1117,393 +1143,365 @@ class NestedAttentionSeq2seq(AttentionSeq2seq):
         """
         batch_size, max_time = enc_out.size()[:2]
         dir = 'bwd' if self.backward_1 else 'fwd'
-        if teacher_forcing:
-            beam_width_sub = 1
 
         ##################################################
         # At first, decode by the character model
         ##################################################
-        dec_out_sub_seq, aw_sub, best_hyps_sub = [], [], []
-        y_lens_sub = np.zeros((batch_size,), dtype=np.int32)
-        for b in range(batch_size):
-            # Initialization for the character model per utterance
-            dec_state_sub, dec_out_sub = self._init_dec_state(
-                enc_out_sub[b: b + 1], x_lens_sub[b:b + 1], task=1, dir=dir)
-            aw_step_sub = self._create_tensor(
-                (1, x_lens_sub[b].item(), self.num_heads_1),
-                fill_value=0, dtype=torch.float)
-
-            complete_sub = []
-            beam_sub = [{'hyp': [self.sos_1],
-                         'score': LOG_1,
-                         'dec_state': dec_state_sub,
-                         'dec_outs': [dec_out_sub],  # NOTE: keep all outputs
-                         'aw_steps': [aw_step_sub]}]
-
-            for t in range(max_decode_len_sub):
-                new_beam_sub = []
-                for i_beam in range(len(beam_sub)):
-                    if self.decoding_order == 'attend_generate_update':
-                        # Score
-                        context_vec_sub, aw_step_sub = getattr(self, 'attend_1_' + dir)(
-                            enc_out_sub[b:b + 1], x_lens_sub[b:b + 1],
-                            beam_sub[i_beam]['dec_outs'][-1], beam_sub[i_beam]['aw_steps'][-1])
-
-                        # Generate
-                        logits_step_sub = getattr(self, 'fc_1_' + dir)(F.tanh(
-                            getattr(self, 'W_d_1_' + dir)(dec_out_sub) +
-                            getattr(self, 'W_c_1_' + dir)(context_vec_sub)))
-                        # NOTE: Recurrency is placed at the latter stage
-
-                        # if teacher_forcing:
-                        #     # Sample
-                        #     y_sub = ys_sub[:, t + 1:t + 2]
-                        #     best_hyps_sub.append(y_sub)
-                        #     y_emb_sub = self.embed_1(y_sub)
-
-                    elif self.decoding_order == 'attend_update_generate':
-                        y_sub = self._create_tensor(
-                            (1,), fill_value=beam_sub[i_beam]['hyp'][-1], dtype=torch.long).unsqueeze(1)
-                        y_sub = self.embed_1(y_sub)
-
-                        # Score
-                        context_vec_sub, aw_step_sub = getattr(self, 'attend_1_' + dir)(
-                            enc_out_sub[b:b + 1], x_lens_sub[b:b + 1],
-                            beam_sub[i_beam]['dec_outs'][-1], beam_sub[i_beam]['aw_steps'][-1])
-
-                        # Recurrency
-                        dec_in_sub = torch.cat(
-                            [y_emb_sub, context_vec_sub], dim=-1)
-                        dec_out_sub, dec_state_sub = getattr(self, 'decoder_1_' + dir)(
-                            dec_in_sub, dec_state_sub)
-                        dec_out_sub_seq.append(dec_out_sub)
-
-                        # Generate
-                        logits_step_sub = getattr(self, 'fc_1_' + dir)(F.tanh(
-                            getattr(self, 'W_d_1_' + dir)(dec_out_sub) +
-                            getattr(self, 'W_c_1_' + dir)(context_vec_sub)))
-
-                        # if teacher_forcing:
-                        #     # Sample
-                        #     y_sub = ys_sub[:, t:t + 1]
-                        #     best_hyps_sub.append(y_sub)
-                        #     y_emb_sub = self.embed_1(y_sub)
-
-                    elif self.decoding_order == 'conditional':
-                        y_sub = self._create_tensor(
-                            (1,), fill_value=beam_sub[i_beam]['hyp'][-1], dtype=torch.long).unsqueeze(1)
-                        y_sub = self.embed_1(y_sub)
-
-                        # Recurrency of the first decoder
-                        _dec_out_sub, _dec_state_sub = getattr(self, 'decoder_first_1_' + dir)(
-                            y_sub, beam_sub[i_beam]['dec_state'])
-
-                        # Score
-                        context_vec_sub, aw_step_sub = getattr(self, 'attend_1_' + dir)(
-                            enc_out_sub[b:b + 1], x_lens_sub[b:b + 1],
-                            _dec_out_sub, beam_sub[i_beam]['aw_steps'][-1])
-
-                        # Recurrency of the second decoder
-                        dec_out_sub, dec_state_sub = getattr(self, 'decoder_second_1_' + dir)(
-                            context_vec_sub, _dec_state_sub)
-
-                        # Generate
-                        logits_step_sub = getattr(self, 'fc_1_' + dir)(F.tanh(
-                            getattr(self, 'W_d_1_' + dir)(dec_out_sub) +
-                            getattr(self, 'W_c_1_' + dir)(context_vec_sub)))
-
-                        # if teacher_forcing:
-                        #     # Sample
-                        #     y_sub = ys_sub[:, t:t + 1]
-                        #     best_hyps_sub.append(y_sub)
-                        #     y_emb_sub = self.embed_1(y_sub)
-
-                    # Path through the softmax layer & convert to log-scale
-                    log_probs_sub = F.log_softmax(
-                        logits_step_sub.squeeze(1), dim=1)
-                    # NOTE: `[1 (B), 1, num_classes]` -> `[1 (B), num_classes]`
-
-                    # Pick up the top-k scores
-                    log_probs_sub_topk, indices_sub_topk = log_probs_sub.topk(
-                        beam_width_sub, dim=1, largest=True, sorted=True)
-
-                    for k in range(beam_width_sub):
-                        if self.decoding_order == 'attend_generate_update':
-                            y_sub = self._create_tensor(
-                                (1,), fill_value=indices_sub_topk[0, k].item(), dtype=torch.long).unsqueeze(1)
-                            y_sub = self.embed_1(y_sub)
-
-                            # Recurrency
-                            dec_in_sub = torch.cat(
-                                [y_sub, context_vec_sub], dim=-1)
-                            dec_out_sub, dec_state_sub = getattr(
-                                self, 'decoder_1_' + dir)(dec_in_sub, beam_sub[i_beam]['dec_state'])
-
-                        new_beam_sub.append(
-                            {'hyp': beam_sub[i_beam]['hyp'] + [indices_sub_topk[0, k].item()],
-                             'score': beam_sub[i_beam]['score'] + log_probs_sub_topk[0, k].item(),
-                             'dec_state': copy.deepcopy(dec_state_sub),
-                             'dec_outs': beam_sub[i_beam]['dec_outs'] + [dec_out_sub],
-                             'aw_steps': beam_sub[i_beam]['aw_steps'] + [aw_step_sub]})
-
-                new_beam_sub = sorted(
-                    new_beam_sub, key=lambda x: x['score'], reverse=True)
-
-                # Remove complete hypotheses
-                not_complete_sub = []
-                for cand in new_beam_sub[:beam_width_sub]:
-                    if cand['hyp'][-1] == self.eos_1:
-                        complete_sub.append(cand)
-                    else:
-                        not_complete_sub.append(cand)
-                if len(complete_sub) >= beam_width_sub:
-                    complete_sub = complete_sub[:beam_width_sub]
+        if teacher_forcing:
+            best_hyps_sub, aw_sub, dec_out_sub = self._decode_forced_sub(
+                enc_out_sub, x_lens_sub, ys_sub, y_lens_sub, dir)
+            # NOTE: references are given in the decoding order
+            is_reversed = False
+        else:
+            best_hyps_sub, aw_sub, dec_out_sub = self._decode_infer_beam(
+                enc_out_sub, x_lens_sub, beam_width_sub, max_decode_len_sub,
+                0, 0, task=1, dir=dir, keep_dec_out=True)
+            is_reversed = self.backward_1
+
+        # Reverse the order
+        if self.backward_1 and is_reversed != reverse_backward:
+            for b in range(batch_size):
+                y_len = len(best_hyps_sub[b]) - \
+                    int(best_hyps_sub[b][-1] == self.eos_1)
+                best_hyps_sub[b][:y_len] = best_hyps_sub[b][:y_len][::-1]
+
+        # Pad decoder outputs of the character model
+        dec_out_sub = self._select_dec_out_sub(dec_out_sub, best_hyps_sub)
+        y_lens_sub = self.np2tensor(
+            np.array([len(h) for h in dec_out_sub]), dtype=torch.int)
+        dec_out_sub = torch.nn.utils.rnn.pad_sequence(
+            dec_out_sub, batch_first=True)
+        max_len_sub = dec_out_sub.size(1)
+
+        ##################################################
+        # Next, decode by the word model
+        ##################################################
+        # Expand to `[B * beam_width]`
+        beam_offset = torch.arange(
+            batch_size, device=enc_out.device) * beam_width
+        indices = torch.arange(
+            batch_size, device=enc_out.device).repeat_interleave(beam_width)
+        enc_out = enc_out.index_select(0, indices)
+        x_lens = x_lens.index_select(0, indices)
+        dec_out_sub = dec_out_sub.index_select(0, indices)
+        y_lens_sub_beam = y_lens_sub.index_select(0, indices)
+
+        # Initialization for the word model
+        dec_state, dec_out = self._init_dec_state(
+            enc_out, x_lens, task=0, dir='fwd')
+        aw_step_enc = self._create_tensor(
+            (batch_size * beam_width, max_time, self.num_heads_0),
+            fill_value=0, dtype=torch.float)
+        aw_step_dec = self._create_tensor(
+            (batch_size * beam_width, max_len_sub, self.num_heads_dec),
+            fill_value=0, dtype=torch.float)
+        context_vec_enc, context_vec_dec = None, None
+
+        # Precompute the projection of encoder outputs and decoder states
+        self.attend_0_fwd.reset(enc_out, x_lens)
+        self.attend_dec_sub.reset(dec_out_sub, y_lens_sub_beam)
+
+        # NOTE: only the first hypothesis is active at the beginning
+        scores = self._create_tensor(
+            (batch_size, beam_width), fill_value=LOG_0, dtype=torch.float)
+        scores[:, 0] = LOG_1
+        y = self._create_tensor(
+            (batch_size * beam_width, 1), fill_value=self.sos_0, dtype=torch.long)
+
+        # Back-pointers of each step
+        parents, tokens, aw_steps_enc, aw_steps_dec = [], [], [], []
+
+        complete = [[] for _ in range(batch_size)]
+        is_done = [False] * batch_size
+        for t in range(max_decode_len):
+            logits_step, context_vec_enc, context_vec_dec, dec_out, dec_state, aw_step_enc, aw_step_dec = self._decode_step_joint(
+                enc_out, x_lens, dec_out_sub, y_lens_sub_beam, y,
+                context_vec_enc, context_vec_dec, dec_out, dec_state,
+                aw_step_enc, aw_step_dec, is_first=(t == 0))
+
+            # Path through the softmax layer & convert to log-scale
+            log_probs = F.log_softmax(logits_step.squeeze(1), dim=-1)
+            num_classes = log_probs.size(-1)
+
+            # Pick up the top-k scores over all hypotheses of each utterance
+            scores_cand = scores.view(-1, 1) + log_probs
+            scores, indices_topk = scores_cand.view(
+                batch_size, -1).topk(beam_width, dim=1, largest=True, sorted=True)
+            parent = torch.div(indices_topk, num_classes, rounding_mode='floor')
+            parent = (parent + beam_offset.unsqueeze(1)).view(-1)
+            y = (indices_topk % num_classes).view(-1, 1)
+
+            # Reorder hypotheses
+            context_vec_enc = context_vec_enc.index_select(0, parent)
+            context_vec_dec = context_vec_dec.index_select(0, parent)
+            dec_out = dec_out.index_select(0, parent)
+            dec_state = self._reorder_dec_state(dec_state, parent)
+            aw_step_enc = aw_step_enc.index_select(0, parent)
+            aw_step_dec = aw_step_dec.index_select(0, parent)
+            parents.append(parent)
+            tokens.append(y.view(-1))
+            aw_steps_enc.append(aw_step_enc[:, :, 0])
+            aw_steps_dec.append(aw_step_dec[:, :, 0])
+            # TODO: fix for multi-head atteniton
+
+            # Remove complete hypotheses
+            is_eos = (y.view(batch_size, beam_width) == self.eos_0) & (scores > LOG_0)
+            if is_eos.any().item():
+                scores_np = self.tensor2np(scores)
+                for b, k in zip(*np.nonzero(self.tensor2np(is_eos))):
+                    complete[b].append({'step': t,
+                                        'index': b * beam_width + k,
+                                        'score': scores_np[b, k]})
+                scores = scores.masked_fill(is_eos, LOG_0)
+
+                is_active = self.tensor2np((scores > LOG_0).any(dim=1))
+                for b in range(batch_size):
+                    if is_done[b]:
+                        continue
+                    if len(complete[b]) >= beam_width:
+                        complete[b] = complete[b][:beam_width]
+                        is_done[b] = True
+                        scores[b] = LOG_0
+                    elif not is_active[b]:
+                        is_done[b] = True
+                if all(is_done):
                     break
-                beam_sub = not_complete_sub[:beam_width_sub]
 
-            if len(complete_sub) == 0:
-                complete_sub = beam_sub
+        self.attend_0_fwd.clear()
+        self.attend_dec_sub.clear()
 
+        # Use active hypotheses if no hypothesis is complete
+        scores_np = self.tensor2np(scores)
+        for b in range(batch_size):
+            if len(complete[b]) == 0:
+                for k in range(beam_width):
+                    if scores_np[b, k] > LOG_0:
+                        complete[b].append({'step': len(tokens) - 1,
+                                            'index': b * beam_width + k,
+                                            'score': scores_np[b, k]})
+
+        # NOTE: copy back-pointers to CPU at once
+        parents = self.tensor2np(torch.stack(parents, dim=0))
+        tokens = self.tensor2np(torch.stack(tokens, dim=0))
+        aw_steps_enc = torch.stack(aw_steps_enc, dim=0)
+        aw_steps_dec = torch.stack(aw_steps_dec, dim=0)
+        y_lens_sub = self.tensor2np(y_lens_sub)
+
+        best_hyps, aw, aw_dec = [], [], []
+        for b in range(batch_size):
             # Renormalized hypotheses by length
-            # if length_penalty > 0:
-            #     for j in range(len(complete_sub)):
-            #         complete_sub[j]['score'] += len(complete_sub[j]
-            #                                         ['hyp']) * length_penalty
+            if length_penalty > 0:
+                for j in range(len(complete[b])):
+                    complete[b][j]['score'] += (
+                        complete[b][j]['step'] + 2) * length_penalty
+                    # NOTE: the length includes <SOS> and <EOS>
+
+            best = max(complete[b], key=lambda x: x['score'])
+            best_hyp, indices = _backtrack(
+                parents, tokens, best['step'], best['index'])
+            best_hyps.append(best_hyp)
+            steps = torch.arange(len(indices), device=aw_steps_enc.device)
+            indices = self.np2tensor(indices, dtype=torch.long)
+            aw.append(self.tensor2np(aw_steps_enc[steps, indices]))
+            aw_dec.append(self.tensor2np(
+                aw_steps_dec[steps, indices][:, :y_lens_sub[b]]))
 
-            complete_sub = sorted(
-                complete_sub, key=lambda x: x['score'], reverse=True)
+        return best_hyps, aw, best_hyps_sub, aw_sub, aw_dec
 
-            best_hyps_sub.append(np.array(complete_sub[0]['hyp'][1:]))
-            # NOTE: Exclude <SOS>
-            aw_sub.append(complete_sub[0]['aw_steps'])
-            dec_out_sub_seq.append(
-                torch.cat(complete_sub[0]['dec_outs'][1:], dim=1))
-            # NOTE: Exclude the fist state
+    def _decode_forced_sub(self, enc_out_sub, x_lens_sub, ys_sub, y_lens_sub,
+                           dir):
+        """Run the character model fed with references in the inference stage.
+        Args:
+            enc_out_sub (torch.FloatTensor): A tensor of size
+                `[B, T_in_sub, encoder_num_units]`
+            x_lens_sub (torch.IntTensor): A tensor of size `[B]`
+            ys_sub (torch.LongTensor): A tensor of size `[B, T_out_sub + 1]`,
+                which starts with <SOS>
+            y_lens_sub (torch.IntTensor): A tensor of size `[B]`
+            dir (str): fwd or bwd
+        Returns:
+            best_hyps_sub (list): list of np.ndarray of size `[T_out_sub + 1]`
+            aw_sub (list): list of np.ndarray of size `[T_out_sub + 1, T_in]`
+            dec_out_sub (list): list of torch.FloatTensor of size
+                `[T_out_sub + 1, decoder_num_units]`, the decoder outputs
+                which generated each token
+        """
+        batch_size, max_time_sub = enc_out_sub.size()[:2]
 
-            y_lens_sub[b] = len(complete_sub[0]['hyp'][1:])
-            # NOTE: include <EOS>
+        # Initialization for the character model
+        dec_state_sub, dec_out_sub = self._init_dec_state(
+            enc_out_sub, x_lens_sub, task=1, dir=dir)
+        aw_step_sub = self._create_tensor(
+            (batch_size, max_time_sub, self.num_heads_1),
+            fill_value=0, dtype=torch.float)
+        context_vec_sub = None
 
-        # Concatenate in T_out dimension
-        for j in range(len(aw_sub)):
-            aw_sub[j] = aw_sub[j][1:]
-            # NOTE: exclude the first atteniton weights
+        # Precompute the projection of encoder outputs
+        attend = getattr(self, 'attend_1_' + dir)
+        attend.reset(enc_out_sub, x_lens_sub)
 
-            for k in range(len(aw_sub[j])):
-                aw_sub[j][k] = aw_sub[j][k][:, :, 0]
-                # TODO: fix for multi-head atteniton
+        dec_out_sub_seq, aw_sub = [], []
+        for t in range(ys_sub.size(1)):
+            _, context_vec_sub, dec_out_sub, dec_state_sub, aw_step_sub = self._decode_step(
+                enc_out_sub, x_lens_sub, ys_sub[:, t:t + 1], context_vec_sub,
+                dec_out_sub, dec_state_sub, aw_step_sub, task=1, dir=dir,
+                is_first=(t == 0))
+            dec_out_sub_seq.append(dec_out_sub)
+            aw_sub.append(aw_step_sub[:, :, 0])
+            # TODO: fix for multi-head atteniton
 
-            aw_sub[j] = self.tensor2np(
-                torch.stack(aw_sub[j], dim=1).squeeze(0))
+        attend.clear()
 
-        ##################################################
-        # Next, compute logits of the word model
-        ##################################################
-        y_lens_sub = self.np2tensor(y_lens_sub, dtype=torch.int)
-        # assert max(y_lens_sub.item()) > 0
+        dec_out_sub_seq = torch.cat(dec_out_sub_seq, dim=1)
+        aw_sub = self.tensor2np(torch.stack(aw_sub, dim=1))
+        ys_sub = self.tensor2np(ys_sub)
+        y_lens_sub = self.tensor2np(y_lens_sub)
 
-        best_hyps, aw, aw_dec = [], [], []
-        for b in range(enc_out.size(0)):
-            # Initialization for the word model per utterance
-            dec_state, dec_out = self._init_dec_state(
-                enc_out[b:b + 1], x_lens[b:b + 1], task=0, dir='fwd')
-            aw_step_enc = self._create_tensor(
-                (1, x_lens[b].item(), self.num_heads_0),
-                fill_value=0, dtype=torch.float)
-            aw_step_dec = self._create_tensor(
-                (1, dec_out_sub_seq[b].size(1), self.num_heads_dec),
-                fill_value=0, dtype=torch.float)
-
-            complete = []
-            beam = [{'hyp': [self.sos_0],
-                     'score': LOG_1,
-                     'dec_state': dec_state,
-                     'dec_out': dec_out,
-                     'aw_steps_enc': [aw_step_enc],
-                     'aw_steps_dec': [aw_step_dec]}]
-            for t in range(max_decode_len):
-                new_beam = []
-                for i_beam in range(len(beam)):
-                    if self.decoding_order == 'attend_generate_update':
-                        # Score for the encoder
-                        context_vec_enc, aw_step_enc = self.attend_0_fwd(
-                            enc_out[b:b + 1], x_lens[b:b + 1],
-                            beam[i_beam]['dec_out'], beam[i_beam]['aw_steps_enc'][-1])
-
-                        # Score for the character-level decoder states
-                        context_vec_dec, aw_step_dec = self.attend_dec_sub(
-                            dec_out_sub_seq[b], y_lens_sub[b:b + 1],
-                            beam[i_beam]['dec_out'], beam[i_beam]['aw_steps_dec'][-1])
-                        if self.relax_context_vec_dec:
-                            context_vec_dec = self.W_c_dec_relax(
-                                context_vec_dec)
-
-                        # Generate
-                        out = self.W_d_0_fwd(dec_out) + \
-                            self.W_c_0_fwd(context_vec_enc)
-                        if self.usage_dec_sub == 'all':
-                            out += self.W_c_dec_out(context_vec_dec)
-                        logits_step = self.fc_0_fwd(F.tanh(out))
-
-                    elif self.decoding_order == 'attend_update_generate':
-                        y = self._create_tensor(
-                            (1,), fill_value=beam[i_beam]['hyp'][-1], dtype=torch.long).unsqueeze(1)
-                        y = getattr(self, 'embed_' + str(task))(y)
-
-                        # Score for the encoder
-                        context_vec_enc, aw_step_enc = self.attend_0_fwd(
-                            enc_out[b:b + 1], x_lens[b:b + 1],
-                            beam[i_beam]['dec_out'], beam[i_beam]['aw_steps_enc'][-1])
-
-                        if t == 0:
-                            if self.relax_context_vec_dec:
-                                context_vec_dec = self.W_c_dec_relax(
-                                    beam[i_beam]['dec_out'])
-                            else:
-                                context_vec_dec = beam[i_beam]['dec_out']
-
-                        # Recurrency
-                        dec_in = torch.cat([y, context_vec_enc], dim=-1)
-                        dec_in = torch.cat([dec_in, context_vec_dec], dim=-1)
-                        dec_out, dec_state = self.decoder_0_fwd(
-                            dec_in, beam[i_beam]['dec_state'])
-
-                        # Score for the character-level decoder states
-                        context_vec_dec, aw_step_dec = self.attend_dec_sub(
-                            dec_out_sub_seq[b], y_lens_sub[b:b + 1],
-                            dec_out, beam[i_beam]['aw_steps_dec'][-1])
-                        if self.relax_context_vec_dec:
-                            context_vec_dec = self.W_c_dec_relax(
-                                context_vec_dec)
-
-                        # Generate
-                        out = self.W_d_0_fwd(dec_out) + \
-                            self.W_c_0_fwd(context_vec_enc)
-                        if self.usage_dec_sub == 'all':
-                            out += self.W_c_dec_out(context_vec_dec)
-                        logits_step = self.fc_0_fwd(F.tanh(out))
-
-                    elif self.decoding_order == 'conditional':
-                        y = self._create_tensor(
-                            (1,), fill_value=beam[i_beam]['hyp'][-1], dtype=torch.long).unsqueeze(1)
-                        y = getattr(self, 'embed_' + str(task))(y)
-
-                        # Recurrency of the first decoder
-                        _dec_out, _dec_state = self.decoder_first_0_fwd(
-                            y, beam[i_beam]['dec_state'])
-
-                        # Score for the encoder
-                        context_vec_enc, aw_step_enc = self.attend_0_fwd(
-                            enc_out[b:b + 1], x_lens[b:b + 1],
-                            _dec_out, beam[i_beam]['aw_steps_enc'][-1])
-
-                        if t == 0:
-                            if self.relax_context_vec_dec:
-                                context_vec_dec = self.W_c_dec_relax(
-                                    beam[i_beam]['dec_out'])
-                            else:
-                                context_vec_dec = beam[i_beam]['dec_out']
-
-                        # Recurrency of the second decoder
-                        context_vecs = torch.cat(
-                            [context_vec_enc, context_vec_dec], dim=-1)
-                        dec_out, dec_state = self.decoder_second_0_fwd(
-                            context_vecs, _dec_state)
-
-                        # Score for the character-level decoder states
-                        context_vec_dec, aw_step_dec = self.attend_dec_sub(
-                            dec_out_sub_seq[b], y_lens_sub[b:b + 1],
-                            _dec_out, beam[i_beam]['aw_steps_dec'][-1])
-                        if self.relax_context_vec_dec:
-                            context_vec_dec = self.W_c_dec_relax(
-                                context_vec_dec)
-
-                        # Generate
-                        out = self.W_d_0_fwd(dec_out) + \
-                            self.W_c_0_fwd(context_vec_enc)
-                        if self.usage_dec_sub == 'all':
-                            out += self.W_c_dec_out(context_vec_dec)
-                        logits_step = self.fc_0_fwd(F.tanh(out))
-
-                    # Path through the softmax layer & convert to log-scale
-                    log_probs = F.log_softmax(logits_step.squeeze(1), dim=1)
-                    # NOTE: `[1 (B), 1, num_classes]` -> `[1 (B), num_classes]`
-
-                    # Pick up the top-k scores
-                    log_probs_topk, indices_topk = log_probs.topk(
-                        beam_width, dim=1, largest=True, sorted=True)
-
-                    for k in range(beam_width):
-                        if self.decoding_order == 'attend_generate_update':
-                            y = self._create_tensor(
-                                (1,), fill_value=indices_topk[0, k].item(), dtype=torch.long).unsqueeze(1)
-                            y = self.embed_0(y)
-
-                            # Recurrency
-                            dec_in = torch.cat([y, context_vec_enc], dim=-1)
-                            dec_in = torch.cat(
-                                [dec_in, context_vec_dec], dim=-1)
-                            dec_out, dec_state = self.decoder_0_fwd(
-                                dec_in, beam[i_beam]['dec_state'])
-
-                        new_beam.append(
-                            {'hyp': beam[i_beam]['hyp'] + [indices_topk[0, k].item()],
-                             'score': beam[i_beam]['score'] + log_probs_topk[0, k].item(),
-                             'dec_state': copy.deepcopy(dec_state),
-                             'dec_out': dec_out,
-                             'aw_steps_enc': beam[i_beam]['aw_steps_enc'] + [aw_step_enc],
-                             'aw_steps_dec': beam[i_beam]['aw_steps_dec'] + [aw_step_dec]})
-
-                new_beam = sorted(
-                    new_beam, key=lambda x: x['score'], reverse=True)
-
-                # Remove complete hypotheses
-                not_complete = []
-                for cand in new_beam[:beam_width]:
-                    if cand['hyp'][-1] == self.eos_0:
-                        complete.append(cand)
-                    else:
-                        not_complete.append(cand)
-                if len(complete) >= beam_width:
-                    complete = complete[:beam_width]
-                    break
-                beam = not_complete[:beam_width]
+        best_hyps_sub, aw_sub_list, dec_out_sub_list = [], [], []
+        for b in range(batch_size):
+            # NOTE: the reference and <EOS>
+            best_hyps_sub.append(
+                np.append(ys_sub[b, 1:y_lens_sub[b] + 1], self.eos_1))
+            aw_sub_list.append(aw_sub[b, :y_lens_sub[b] + 1])
+            dec_out_sub_list.append(dec_out_sub_seq[b, :y_lens_sub[b] + 1])
 
-            if len(complete) == 0:
-                complete = beam
+        return best_hyps_sub, aw_sub_list, dec_out_sub_list
 
-            # Renormalized hypotheses by length
-            if length_penalty > 0:
-                for j in range(len(complete)):
-                    complete[j]['score'] += len(complete[j]
-                                                ['hyp']) * length_penalty
-
-            complete = sorted(
-                complete, key=lambda x: x['score'], reverse=True)
-            best_hyps.append(np.array(complete[0]['hyp'][1:]))
-            # NOTE: Exclude <SOS>
-            aw.append(complete[0]['aw_steps_enc'])
-            aw_dec.append(complete[0]['aw_steps_dec'])
-
-        # Concatenate in T_out dimension
-        for j in range(len(aw)):
-            aw[j] = aw[j][1:]
-            aw_dec[j] = aw_dec[j][1:]
-            # NOTE: exclude the first atteniton weights
-
-            for k in range(len(aw[j])):
-                aw[j][k] = aw[j][k][:, :, 0]
-                aw_dec[j][k] = aw_dec[j][k][:, :, 0]
-                # TODO: fix for multi-head atteniton
-
-            aw[j] = self.tensor2np(torch.stack(aw[j], dim=1).squeeze(0))
-            aw_dec[j] = self.tensor2np(
-                torch.stack(aw_dec[j], dim=1).squeeze(0))
+    def _select_dec_out_sub(self, dec_out_sub, best_hyps_sub):
+        """Select decoder outputs of the character model which the word model
+            attends to, in the same way as _decode_train.
+        Args:
+            dec_out_sub (list): list of torch.FloatTensor of size
+                `[T_out_sub, decoder_num_units]`, the decoder outputs which
+                generated each token of best_hyps_sub
+            best_hyps_sub (list): list of np.ndarray of size `[T_out_sub]`
+        Returns:
+            dec_out_sub (list): list of torch.FloatTensor of size
+                `[L, decoder_num_units]`, where L is the number of tokens
+                excluding <EOS>
+        """
+        dec_out_sub_list = []
+        for b in range(len(dec_out_sub)):
+            y_len = len(best_hyps_sub[b]) - \
+                int(best_hyps_sub[b][-1] == self.eos_1)
+            if self.decoding_order == 'attend_generate_update':
+                # NOTE: in training, the state is recorded after the
+                # recurrency fed with each token, which is the one that
+                # generated the next token (or <EOS>)
+                h = dec_out_sub[b][1:y_len + 1]
+                # NOTE: the last state is missing if <EOS> was not emitted
+            else:
+                h = dec_out_sub[b][:y_len]
+            if h.size(0) == 0:
+                # NOTE: keep one state to avoid attention to nothing
+                h = dec_out_sub[b][:1]
+            dec_out_sub_list.append(h)
+        return dec_out_sub_list
+
+    def _decode_step_joint(self, enc_out, x_lens, dec_out_sub, y_lens_sub,
+                           y, context_vec_enc, context_vec_dec, dec_out,
+                           dec_state, aw_step_enc, aw_step_dec, is_first=False):
+        """One step of the word model in the inference stage.
+        Args:
+            enc_out (torch.FloatTensor): A tensor of size
+                `[B, T_in, encoder_num_units]`
+            x_lens (torch.IntTensor): A tensor of size `[B]`
+            dec_out_sub (torch.FloatTensor): padded outputs of the character
+                model of size `[B, T_out_sub, decoder_num_units_sub]`
+            y_lens_sub (torch.IntTensor): A tensor of size `[B]`
+            y (torch.LongTensor): the previous tokens of size `[B, 1]`
+            context_vec_enc (torch.FloatTensor): A tensor of size
+                `[B, 1, encoder_num_units]`
+            context_vec_dec (torch.FloatTensor): A tensor of size
+                `[B, 1, decoder_num_units_sub]`
+            dec_out (torch.FloatTensor): A tensor of size
+                `[B, 1, decoder_num_units]`
+            dec_state (list or tuple of list):
+            aw_step_enc (torch.FloatTensor): A tensor of size
+                `[B, T_in, num_heads]`
+            aw_step_dec (torch.FloatTensor): A tensor of size
+                `[B, T_out_sub, num_heads_dec]`
+            is_first (bool, optional): if True, this is the first step
+        Returns:
+            logits_step (torch.FloatTensor): A tensor of size
+                `[B, 1, num_classes]`
+            context_vec_enc (torch.FloatTensor):
+            context_vec_dec (torch.FloatTensor):
+            dec_out (torch.FloatTensor):
+            dec_state (list or tuple of list):
+            aw_step_enc (torch.FloatTensor):
+            aw_step_dec (torch.FloatTensor):
+        """
+        if self.decoding_order == 'attend_generate_update':
+            # NOTE: the recurrency of the previous step is placed here,
+            # after the previous token has been chosen
+            if not is_first:
+                dec_in = torch.cat([self.embed_0(y), context_vec_enc], dim=-1)
+                dec_in = torch.cat([dec_in, context_vec_dec], dim=-1)
+                dec_out, dec_state = self.decoder_0_fwd(dec_in, dec_state)
 
-        # Reverse the order
-        if self.backward_1 and reverse_backward:
-            y_lens_sub = self.tensor2np(y_lens_sub)
-            for b in range(batch_size):
-                best_hyps_sub[b][:y_lens_sub[b]
-                                 ] = best_hyps_sub[b][:y_lens_sub[b]][::-1]
+            # Score for the encoder
+            context_vec_enc, aw_step_enc = self.attend_0_fwd(
+                enc_out, x_lens, dec_out, aw_step_enc)
 
-        return best_hyps, aw, best_hyps_sub, aw_sub, aw_dec
+            # Score for the character-level decoder states
+            context_vec_dec, aw_step_dec = self.attend_dec_sub(
+                dec_out_sub, y_lens_sub, dec_out, aw_step_dec)
+            if self.relax_context_vec_dec:
+                context_vec_dec = self.W_c_dec_relax(context_vec_dec)
+
+        elif self.decoding_order == 'attend_update_generate':
+            # Score for the encoder
+            context_vec_enc, aw_step_enc = self.attend_0_fwd(
+                enc_out, x_lens, dec_out, aw_step_enc)
+
+            if is_first:
+                if self.relax_context_vec_dec:
+                    context_vec_dec = self.W_c_dec_relax(dec_out)
+                else:
+                    context_vec_dec = dec_out
+
+            # Recurrency
+            dec_in = torch.cat([self.embed_0(y), context_vec_enc], dim=-1)
+            dec_in = torch.cat([dec_in, context_vec_dec], dim=-1)
+            dec_out, dec_state = self.decoder_0_fwd(dec_in, dec_state)
+
+            # Score for the character-level decoder states
+            context_vec_dec, aw_step_dec = self.attend_dec_sub(
+                dec_out_sub, y_lens_sub, dec_out, aw_step_dec)
+            if self.relax_context_vec_dec:
+                context_vec_dec = self.W_c_dec_relax(context_vec_dec)
+
+        elif self.decoding_order == 'conditional':
+            # Recurrency of the first decoder
+            _dec_out, _dec_state = self.decoder_first_0_fwd(
+                self.embed_0(y), dec_state)
+
+            # Score for the encoder
+            context_vec_enc, aw_step_enc = self.attend_0_fwd(
+                enc_out, x_lens, _dec_out, aw_step_enc)
+
+            if is_first:
+                if self.relax_context_vec_dec:
+                    context_vec_dec = self.W_c_dec_relax(dec_out)
+                else:
+                    context_vec_dec = dec_out
+
+            # Recurrency of the second decoder
+            context_vecs = torch.cat([context_vec_enc, context_vec_dec], dim=-1)
+            dec_out, dec_state = self.decoder_second_0_fwd(
+                context_vecs, _dec_state)
+
+            # Score for the character-level decoder states
+            context_vec_dec, aw_step_dec = self.attend_dec_sub(
+                dec_out_sub, y_lens_sub, _dec_out, aw_step_dec)
+            if self.relax_context_vec_dec:
+                context_vec_dec = self.W_c_dec_relax(context_vec_dec)
+
+        # Generate
+        out = self.W_d_0_fwd(dec_out) + self.W_c_0_fwd(context_vec_enc)
+        if self.usage_dec_sub == 'all':
+            out += self.W_c_dec_out(context_vec_dec)
+        logits_step = self.fc_0_fwd(F.tanh(out))
+
+        return logits_step, context_vec_enc, context_vec_dec, dec_out, dec_state, aw_step_enc, aw_step_dec
@@ -10,6 +10,7 @@ from __future__ import print_function
 import os
 from os.path import join, isfile, basename
 from glob import glob
+from contextlib import contextmanager
 import numpy as np
 
 import logging
@@ -21,6 +22,7 @@ import torch.optim as optim
 
 from models.pytorch.tmp.lr_scheduler import ReduceLROnPlateau
 from utils.directory import mkdir
+from utils.training.checkpointer import save_atomic
 
 OPTIMIZER_CLS_NAMES = {
     "sgd": optim.SGD,
@@ -116,7 +118,8 @@ class ModelBase(nn.Module):
 
     @property
     def device(self):
-        return torch.device("cuda:0" if self.use_cuda else "cpu")
+        # NOTE: the current device is set per process in data-parallel training
+        return torch.device("cuda", torch.cuda.current_device()) if self.use_cuda else torch.device("cpu")
 
     def set_cuda(self, deterministic=False, benchmark=True):
         """Set model to the GPU version.
@@ -138,6 +141,111 @@ class ModelBase(nn.Module):
         else:
             logger.info('CPU mode')
 
+    def set_mixed_precision(self, enabled=True):
+        """Set automatic mixed precision (AMP) training. This must be called
+            after set_cuda().
+        Args:
+            enabled (bool, optional): if False, go back to float32 training
+        """
+        if enabled:
+            # NOTE: bfloat16 has the same exponent range as float32,
+            # so the gradient scaler is needed only for float16 on GPUs
+            self.amp_dtype = torch.float16 if self.use_cuda else torch.bfloat16
+            logger.info('AMP mode (%s)' % str(self.amp_dtype))
+        else:
+            self.amp_dtype = None
+        self.scaler = torch.amp.GradScaler(
+            'cuda', enabled=enabled and self.use_cuda)
+
+    def autocast(self):
+        """Returns the autocast context for the forward computation.
+            This is a no-op unless set_mixed_precision() has been called.
+        """
+        amp_dtype = getattr(self, 'amp_dtype', None)
+        return torch.autocast(device_type=self.device.type,
+                              dtype=amp_dtype,
+                              enabled=amp_dtype is not None)
+
+    def advance_step(self):
+        """Advance the training step by one after a parameter update.
+            This is a no-op unless the model has a schedule over steps.
+        """
+        pass
+
+    @contextmanager
+    def defer_step(self):
+        """Returns the context in which the forward computation does not
+            advance the training step, e.g. while gradients are accumulated
+            over micro-batches. advance_step() has to be called once after
+            the parameter update.
+        """
+        self.step_deferred = True
+        try:
+            yield
+        finally:
+            self.step_deferred = False
+
+    def set_activation_checkpointing(self, layers=None, conv=False):
+        """Recompute activations of encoder layers in the backward pass
+            instead of keeping them, in order to save memory.
+        Args:
+            layers (list, optional): indices of RNN layers in the encoder.
+                None means no RNN layer.
+            conv (bool, optional): if True, recompute CNN layers as well.
+                CNN layers with batch normalization are not recomputed.
+        """
+        from models.pytorch.encoders.rnn import RNNEncoder
+        from models.pytorch.encoders.cnn import CNNEncoder
+        if layers is None:
+            layers = []
+        for module in self.modules():
+            if isinstance(module, RNNEncoder):
+                module.checkpoint_layers = list(layers)
+            elif isinstance(module, CNNEncoder):
+                module.use_checkpoint = conv
+                if conv and module.batch_norm:
+                    logger.warning('CNN layers with batch normalization are not recomputed.')
+        logger.info('Activation checkpointing (layers: %s, conv: %s)' %
+                    (str(list(layers)), str(conv)))
+
+    def set_attention_window(self, window_size, left=None, center='median'):
+        """Score only encoder frames in a window around the previous
+            attention in all attention layers (training and inference).
+        Args:
+            window_size (int): the number of frames in the window.
+                0 means all frames are scored.
+            left (int, optional): the number of frames before the center
+            center (string, optional): median or peak of the previous
+                attention weights
+        """
+        from models.pytorch.attention.attention_layer import AttentionMechanism
+        for module in self.modules():
+            if isinstance(module, AttentionMechanism):
+                module.set_window(window_size, left, center)
+        logger.info('Windowed attention (size: %d, center: %s)' %
+                    (window_size, center))
+
+    def set_parallel_decoding(self, num_workers, start_method='spawn'):
+        """Run CTC beam search of utterances in a mini-batch in parallel
+            with a pool of worker processes.
+        Args:
+            num_workers (int): the number of worker processes.
+                1 means decoding in this process.
+            start_method (string, optional): spawn or fork or forkserver
+        """
+        from models.pytorch.ctc.decoders.parallel_decoder import ParallelDecoder
+        for name in ['_decode_beam_np', '_decode_beam_sub_np',
+                     '_decode_ctc_beam_np']:
+            decoder = getattr(self, name, None)
+            if decoder is None:
+                continue
+            if isinstance(decoder, ParallelDecoder):
+                decoder.close()
+                decoder = decoder.decoder
+            if num_workers > 1:
+                decoder = ParallelDecoder(decoder, num_workers, start_method)
+            setattr(self, name, decoder)
+
     def set_optimizer(self, optimizer, learning_rate_init,
                       weight_decay=0, clip_grad_norm=5,
                       lr_schedule=True, factor=0.1, patience_epoch=5):
@@ -238,19 +346,36 @@ class ModelBase(nn.Module):
             step (int): the current step
             lr (float):
             metric_dev_best (float):
-            remove_old_checkpoints (bool, optional): if True, all checkpoints
-                other than the best one will be deleted
+            remove_old_checkpoints (bool, optional): if True, all epoch
+                checkpoints other than the one saved now will be deleted
         Returns:
             model (string): path to the saved model (file)
         """
         model_path = join(save_path, 'model.epoch-' + str(epoch))
 
+        # Save parameters, optimizer, step index etc.
+        checkpoint = self.get_checkpoint(epoch, step, lr, metric_dev_best)
+        save_atomic(checkpoint, model_path)
+
+        logger.info("=> Saved checkpoint (epoch:%d): %s" % (epoch, model_path))
+
         # Remove old checkpoints
+        # NOTE: this must be done after saving the new one
         if remove_old_checkpoints:
             for path in glob(join(save_path, 'model.epoch-*')):
-                os.remove(path)
+                if path != model_path:
+                    os.remove(path)
 
-        # Save parameters, optimizer, step index etc.
+    def get_checkpoint(self, epoch, step, lr, metric_dev_best):
+        """Get the state to save.
+        Args:
+            epoch (int): the currnet epoch
+            step (int): the current step
+            lr (float):
+            metric_dev_best (float):
+        Returns:
+            checkpoint (dict):
+        """
         checkpoint = {
             "state_dict": self.state_dict(),
             "optimizer": self.optimizer.state_dict(),
@@ -259,9 +384,9 @@ class ModelBase(nn.Module):
             "lr": lr,
             "metric_dev_best": metric_dev_best
         }
-        torch.save(checkpoint, model_path)
-
-        logger.info("=> Saved checkpoint (epoch:%d): %s" % (epoch, model_path))
+        if getattr(self, 'scaler', None) is not None:
+            checkpoint["scaler"] = self.scaler.state_dict()
+        return checkpoint
 
     def load_checkpoint(self, save_path, epoch=-1, restart=False,
                         load_pretrained_model=False):
@@ -280,8 +405,9 @@ class ModelBase(nn.Module):
         """
         if int(epoch) == -1:
             # Restore the last saved model
+            # NOTE: step-based checkpoints (model.step-*) are excluded
             epochs = [(int(basename(x).split('-')[-1]), x)
-                      for x in glob(join(save_path, 'model.*'))]
+                      for x in glob(join(save_path, 'model.epoch-*'))]
 
             if len(epochs) == 0:
                 raise ValueError
@@ -329,6 +455,10 @@ class ModelBase(nn.Module):
                             if torch.is_tensor(v):
                                 state[k] = v.to(self.device)
                     # NOTE: from https://github.com/pytorch/pytorch/issues/2830
+
+                    # Restore the loss scale of mixed precision training
+                    if 'scaler' in checkpoint.keys() and getattr(self, 'scaler', None) is not None:
+                        self.scaler.load_state_dict(checkpoint['scaler'])
                 else:
                     raise ValueError('Set optimizer.')
             else:
@@ -23,7 +23,7 @@ from models.pytorch.linear import LinearND
 from models.pytorch.encoders.load_encoder import load
 from models.pytorch.criterion import cross_entropy_label_smoothing
 from models.pytorch.ctc.decoders.greedy_decoder import GreedyDecoder
-from models.pytorch.ctc.decoders.beam_search_decoder import BeamSearchDecoder
+from models.pytorch.ctc.decoders.prefix_beam_search import PrefixBeamSearchDecoder
 # from models.pytorch.ctc.decoders.beam_search_decoder2 import BeamSearchDecoder
 
 
@@ -265,10 +265,14 @@ class CTC(ModelBase):
 
         # Set CTC decoders
         self._decode_greedy_np = GreedyDecoder(blank_index=0)
-        self._decode_beam_np = BeamSearchDecoder(blank_index=0)
+        self._decode_beam_np = PrefixBeamSearchDecoder(blank_index=0)
         # NOTE: index 0 is reserved for the blank class in warpctc_pytorch
         # TODO: set space index
 
+        # Setting for shallow fusion with an n-gram language model
+        self.lm_weight = 0
+        self.insertion_bonus = 0
+
     def forward(self, xs, ys, x_lens, y_lens, is_eval=False):
         """Forward computation.
         Args:
@@ -283,7 +287,7 @@ class CTC(ModelBase):
         """
         if is_eval:
             self.eval()
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 loss = self._forward(xs, ys, x_lens, y_lens).item()
         else:
             self.train()
@@ -292,7 +296,8 @@ class CTC(ModelBase):
             if self.weight_noise_injection:
                 self.inject_weight_noise(mean=0, std=self.weight_noise_std)
 
-            loss = self._forward(xs, ys, x_lens, y_lens)
+            with self.autocast():
+                loss = self._forward(xs, ys, x_lens, y_lens)
 
         return loss
 
@@ -309,6 +314,9 @@ class CTC(ModelBase):
         # Encode acoustic features
         logits, x_lens, perm_idx = self._encode(xs, x_lens)
 
+        # NOTE: CTC loss is always computed in float32
+        logits = logits.float()
+
         # Output smoothing
         if self.logits_temperature != 1:
             logits /= self.logits_temperature
@@ -422,22 +430,66 @@ class CTC(ModelBase):
             else:
                 logits, x_lens, perm_idx = self._encode(xs, x_lens)
 
+        best_hyps = self._decode_logits(logits, x_lens, beam_width,
+                                        task_index=task_index)
+
+        # Permutate indices to the original order
+        perm_idx = self.tensor2np(perm_idx)
+
+        return best_hyps, None, perm_idx
+        # NOTE: None corresponds to aw in attention-based models
+
+    def _decode_logits(self, logits, x_lens, beam_width, task_index=0):
+        """Greedy or beam search decoding of the CTC outputs.
+        Args:
+            logits (torch.FloatTensor): A tensor of size
+                `[B, T, num_classes (including the blank class)]`
+            x_lens (torch.IntTensor): A tensor of size `[B]`
+            beam_width (int): the size of beam
+            task_index (int, optional): the index of a task. The n-gram
+                language model is used only in the main task (0).
+        Returns:
+            best_hyps (np.ndarray): A tensor of size `[B]`
+        """
         if beam_width == 1:
+            # NOTE: argmax on GPUs, so that only `[B, T]` is copied
             best_hyps = self._decode_greedy_np(
-                self.tensor2np(logits), self.tensor2np(x_lens))
-        else:
+                self.tensor2np(torch.argmax(logits, dim=-1)),
+                self.tensor2np(x_lens))
+        elif task_index == 0:
             best_hyps = self._decode_beam_np(
+                self.tensor2np(F.log_softmax(logits, dim=-1)),
+                self.tensor2np(x_lens), beam_width=beam_width,
+                alpha=self.lm_weight, beta=self.insertion_bonus)
+        else:
+            # NOTE: the vocabulary of the sub task is different from that of
+            # the language model
+            best_hyps = self._decode_beam_sub_np(
                 self.tensor2np(F.log_softmax(logits, dim=-1)),
                 self.tensor2np(x_lens), beam_width=beam_width)
 
         # NOTE: index 0 is reserved for the blank class in warpctc_pytorch
         best_hyps -= 1
 
-        # Permutate indices to the original order
-        perm_idx = self.tensor2np(perm_idx)
+        return best_hyps
 
-        return best_hyps, None, perm_idx
-        # NOTE: None corresponds to aw in attention-based models
+    def set_ngram_lm(self, lm, vocab, lm_weight, insertion_bonus=0,
+                     space_index=-1):
+        """Use an n-gram language model in beam search (shallow fusion).
+        Args:
+            lm (NgramLM):
+            vocab (list): the token of each label index (excluding the blank)
+            lm_weight (float): the weight of the language model
+            insertion_bonus (float, optional): the bonus per word
+            space_index (int, optional): the label index of the space.
+                If negative, each label is scored as a word.
+        """
+        # NOTE: index 0 is reserved for the blank class in warpctc_pytorch
+        self._decode_beam_np.set_lm(
+            lm, [None] + list(vocab),
+            space_index=space_index + 1 if space_index >= 0 else -1)
+        self.lm_weight = lm_weight
+        self.insertion_bonus = insertion_bonus
 
     def posteriors(self, xs, x_lens, temperature=1,
                    blank_scale=None, task_idx=0):
@@ -504,7 +556,8 @@ class CTC(ModelBase):
             best_hyps = self._decode_greedy_np(log_probs, x_lens)
         else:
             best_hyps = self._decode_beam_np(
-                log_probs, x_lens, beam_width=beam_width)
+                log_probs, x_lens, beam_width=beam_width,
+                alpha=self.lm_weight, beta=self.insertion_bonus)
 
         # NOTE: index 0 is reserved for the blank class in warpctc_pytorch
         best_hyps -= 1
@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""CTC prefix scores for joint CTC/attention decoding (pytorch).
+    The forward variables of all hypotheses and all candidate tokens are
+    updated as one tensor of size `[T, 2, B * beam_width, num_candidates]`,
+    so that the only loop is the one over time.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+
+# NOTE: -inf is avoided because logaddexp(-inf, -inf) is nan in some versions
+LOG_0 = -1e10
+
+
+class CTCPrefixScorer(object):
+    """Compute CTC prefix scores of hypotheses in beam search.
+    Args:
+        log_probs (torch.FloatTensor): CTC log-probabilities of size
+            `[B, T, num_classes_ctc]`, where B includes all hypotheses
+        x_lens (torch.IntTensor): A tensor of size `[B]`
+        blank (int): the index of the blank class
+        eos (int): the index of <EOS> in the attention-based decoder
+        label_offset (int, optional): token c of the attention-based decoder
+            is c + label_offset in the CTC output
+    """
+
+    def __init__(self, log_probs, x_lens, blank, eos, label_offset=1):
+        self.blank = blank
+        self.eos = eos
+        self.label_offset = label_offset
+
+        # NOTE: padded frames emit only blanks with probability 1, so that
+        # forward variables are carried over to the last frame unchanged
+        log_probs = log_probs.float().transpose(0, 1).contiguous()
+        self.max_time = log_probs.size(0)
+        is_pad = torch.arange(self.max_time, device=log_probs.device).unsqueeze(
+            1) >= x_lens.long().unsqueeze(0)
+        log_probs = log_probs.masked_fill(is_pad.unsqueeze(2), LOG_0)
+        log_probs[:, :, blank] = log_probs[:, :, blank].masked_fill(is_pad, 0)
+        self.log_probs = log_probs
+        # `[T, B, num_classes_ctc]`
+
+    def initial_state(self):
+        """Forward variables of the empty prefix.
+        Returns:
+            state (tuple):
+                r (torch.FloatTensor): A tensor of size `[T, 2, B]`.
+                    The second axis is (non-blank, blank) ending paths.
+                log_psi (torch.FloatTensor): the prefix score of size `[B]`
+                last (torch.LongTensor): the last token of size `[B]`.
+                    -1 means the empty prefix.
+                length (int): the length of the prefix
+        """
+        batch_size = self.log_probs.size(1)
+        r = self.log_probs.new_full((self.max_time, 2, batch_size), LOG_0)
+        r[:, 1] = torch.cumsum(self.log_probs[:, :, self.blank], dim=0)
+        log_psi = self.log_probs.new_zeros((batch_size,))
+        last = torch.full((batch_size,), -1, dtype=torch.long,
+                          device=self.log_probs.device)
+        return r, log_psi, last, 0
+
+    def score(self, state, candidates):
+        """Extend each hypothesis by each of its candidate tokens.
+        Args:
+            state (tuple): the state of the current prefixes
+            candidates (torch.LongTensor): tokens of the attention-based
+                decoder of size `[B, num_candidates]`
+        Returns:
+            log_psi (torch.FloatTensor): prefix scores of the extended
+                hypotheses of size `[B, num_candidates]`
+            r_new (torch.FloatTensor): forward variables of the extended
+                hypotheses of size `[T, 2, B, num_candidates]`
+        """
+        r, _, last, length = state
+        max_time = self.max_time
+        is_eos = candidates == self.eos
+
+        # `[T, B, num_candidates]`
+        x = self.log_probs.gather(2, (candidates + self.label_offset).masked_fill(
+            is_eos, self.blank).unsqueeze(0).expand(max_time, -1, -1))
+        x_blank = self.log_probs[:, :, self.blank].unsqueeze(2)
+
+        # NOTE: a repeated token must be separated by blanks
+        r_sum = torch.logsumexp(r, dim=1)
+        log_phi = torch.where((candidates == last.unsqueeze(1)).unsqueeze(0),
+                              r[:, 1].unsqueeze(2), r_sum.unsqueeze(2))
+
+        # NOTE: a prefix of length L cannot end before the L-th frame
+        start = min(max(length, 1), max_time)
+        r_new = x.new_full((max_time, 2) + candidates.size(), LOG_0)
+        if length == 0:
+            r_new[0, 0] = x[0]
+        for t in range(start, max_time):
+            r_new[t, 0] = torch.logaddexp(r_new[t - 1, 0], log_phi[t - 1]) + x[t]
+            r_new[t, 1] = torch.logaddexp(r_new[t - 1, 0], r_new[t - 1, 1]) + x_blank[t]
+
+        log_psi = torch.logsumexp(torch.cat(
+            [r_new[start - 1, 0].unsqueeze(0),
+             log_phi[start - 1:max_time - 1] + x[start:]], dim=0), dim=0)
+
+        # <EOS> completes the prefix at the last frame
+        log_psi = torch.where(is_eos, r_sum[-1].unsqueeze(1), log_psi)
+
+        return log_psi, r_new
+
+    def select(self, state, log_psi, r_new, parent, candidate_index, tokens):
+        """Keep the extended hypotheses chosen in beam search.
+        Args:
+            state (tuple): the state of the current prefixes
+            log_psi (torch.FloatTensor): A tensor of size `[B, num_candidates]`
+            r_new (torch.FloatTensor): A tensor of size
+                `[T, 2, B, num_candidates]`
+            parent (torch.LongTensor): A tensor of size `[B]`
+            candidate_index (torch.LongTensor): A tensor of size `[B]`
+            tokens (torch.LongTensor): A tensor of size `[B]`
+        Returns:
+            state (tuple): the state of the new prefixes
+        """
+        return (r_new[:, :, parent, candidate_index],
+                log_psi[parent, candidate_index],
+                tokens, state[3] + 1)
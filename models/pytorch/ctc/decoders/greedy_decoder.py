@@ -1,14 +1,17 @@
 #! /usr/bin/env python
 # -*- coding: utf-8 -*-
 
-"""Greedy (best pass) decoder in numpy implementation."""
+"""Greedy (best pass) decoder in numpy implementation.
+    The whole mini-batch is decoded at once: one argmax over `[B, T, V]`,
+    a mask of frames which emit a label (not a blank nor a repeat) and a
+    compaction of masked labels.
+"""
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
 import numpy as np
-from itertools import groupby
 
 
 class GreedyDecoder(object):
@@ -19,29 +22,63 @@ class GreedyDecoder(object):
     def __call__(self, logits, x_lens):
         """
         Args:
-            logits (np.ndarray): A tensor of size `[B, T, num_classes]`
+            logits (np.ndarray): A tensor of size `[B, T, num_classes]`.
+                The best path of size `[B, T]` (e.g. argmax computed on
+                GPUs beforehand) is also accepted.
             x_lens (np.ndarray): A tensor of size `[B]`
         Returns:
             best_hyps (np.ndarray): Best path hypothesis.
                 A tensor of size `[B, labels_max_seq_len]`
         """
-        batch_size = logits.shape[0]
-        best_hyps = []
-
-        # Pickup argmax class
-        for b in range(batch_size):
-            indices = []
-            time = x_lens[b]
-            for t in range(time):
-                argmax = np.argmax(logits[b, t], axis=0)
-                indices.append(argmax)
-
-            # Step 1. Collapse repeated labels
-            collapsed_indices = [x[0] for x in groupby(indices)]
-
-            # Step 2. Remove all blank labels
-            best_hyp = [x for x in filter(
-                lambda x: x != self._blank, collapsed_indices)]
-            best_hyps.append(np.array(best_hyp))
-
-        return np.array(best_hyps)
+        labels, y_lens = self.decode_flat(logits, x_lens)
+        return np.array(split_flat(labels, y_lens))
+
+    def decode_flat(self, logits, x_lens, return_frames=False):
+        """Decode a mini-batch into one flat array.
+        Args:
+            logits (np.ndarray): A tensor of size `[B, T, num_classes]`
+                or the best path of size `[B, T]`
+            x_lens (np.ndarray): A tensor of size `[B]`
+            return_frames (bool, optional): if True, return the frame index
+                where each label is emitted
+        Returns:
+            labels (np.ndarray): A tensor of size `[sum(y_lens)]`
+            y_lens (np.ndarray): A tensor of size `[B]`
+            frames (np.ndarray): A tensor of size `[sum(y_lens)]`
+        """
+        if logits.ndim == 3:
+            best_paths = np.argmax(logits, axis=-1)
+        else:
+            best_paths = logits
+        max_time = best_paths.shape[1]
+
+        # Step 1. Collapse repeated labels
+        mask = np.ones(best_paths.shape, dtype=bool)
+        mask[:, 1:] = best_paths[:, 1:] != best_paths[:, :-1]
+
+        # Step 2. Remove all blank labels
+        mask &= best_paths != self._blank
+
+        # Step 3. Remove padded frames
+        mask &= np.arange(max_time)[None, :] < np.asarray(x_lens)[:, None]
+
+        # NOTE: boolean indexing keeps the row-major order, so labels of
+        # each utterance are contiguous
+        labels = best_paths[mask]
+        y_lens = mask.sum(axis=1)
+
+        if return_frames:
+            frames = np.nonzero(mask)[1]
+            return labels, y_lens, frames
+        return labels, y_lens
+
+
+def split_flat(labels, y_lens):
+    """Split a flat array into utterances.
+    Args:
+        labels (np.ndarray): A tensor of size `[sum(y_lens)]`
+        y_lens (np.ndarray): A tensor of size `[B]`
+    Returns:
+        labels (list): list of np.ndarray
+    """
+    return np.split(labels, np.cumsum(y_lens)[:-1])
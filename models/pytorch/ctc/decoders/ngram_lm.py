@@ -0,0 +1,279 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Back-off n-gram language model loaded from an ARPA file.
+    N-grams of each order are stored in sorted arrays (a trie whose nodes
+    are indices in the arrays of the lower order), not in Python dicts.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import codecs
+import numpy as np
+
+LN_10 = np.log(10)
+
+
+class NgramLM(object):
+    """Back-off n-gram language model.
+    Args:
+        arpa_path (string): path to the ARPA file
+        bos (string, optional): the begin-of-sentence symbol
+        eos (string, optional): the end-of-sentence symbol
+        unk (string, optional): the unknown word symbol
+        oov_logprob (float, optional): the log10 probability of words not
+            in the vocabulary when the LM has no unknown word symbol
+        max_cache_size (int, optional): the maximum number of memoized
+            lookups. The cache is cleared when it is full.
+    """
+
+    def __init__(self, arpa_path, bos='<s>', eos='</s>', unk='<unk>',
+                 oov_logprob=-10., max_cache_size=1000000):
+        self.vocab = {}
+        # NOTE: arrays of order n are stored at index n - 1
+        self._logprobs = []
+        self._backoffs = []
+        self._keys = [None]
+        self._load(arpa_path)
+
+        self.order = len(self._logprobs)
+        self.bos = self.vocab.get(bos, -1)
+        self.eos = self.vocab.get(eos, -1)
+        self.unk = self.vocab.get(unk, -1)
+        self.oov_logprob = oov_logprob
+
+        # (state, word) -> (log probability, next state)
+        self._cache = {}
+        self.max_cache_size = max_cache_size
+
+    def _load(self, arpa_path):
+        counts = {}
+        section = None
+        words, logprobs, backoffs = [], [], []
+
+        with codecs.open(arpa_path, 'r', 'utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                if line == '\\data\\':
+                    section = 0
+                    continue
+                if line.startswith('\\') and line.endswith('-grams:'):
+                    if section > 0:
+                        self._add_ngrams(section, words, logprobs, backoffs)
+                    section = int(line[1:line.index('-')])
+                    words, logprobs, backoffs = [], [], []
+                    continue
+                if line == '\\end\\':
+                    break
+
+                if section == 0:
+                    if line.startswith('ngram '):
+                        n, count = line[6:].split('=')
+                        counts[int(n)] = int(count)
+                    continue
+
+                fields = line.split()
+                logprobs.append(float(fields[0]))
+                if section == 1:
+                    self.vocab[fields[1]] = len(self.vocab)
+                    words.append(self.vocab[fields[1]])
+                else:
+                    words.append([self.vocab[w]
+                                  for w in fields[1:section + 1]])
+                backoffs.append(float(fields[section + 1])
+                                if len(fields) > section + 1 else 0.)
+
+        if section is not None and section > 0:
+            self._add_ngrams(section, words, logprobs, backoffs)
+
+        for n, count in counts.items():
+            if n <= len(self._logprobs) and len(self._logprobs[n - 1]) != count:
+                raise ValueError('The number of %d-grams does not match: %s' %
+                                 (n, arpa_path))
+
+    def _add_ngrams(self, n, words, logprobs, backoffs):
+        """Store n-grams of an order as sorted arrays.
+        Args:
+            n (int): the order
+            words (list): word ids
+            logprobs (list): log10 probabilities
+            backoffs (list): log10 back-off weights
+        """
+        logprobs = np.array(logprobs, dtype=np.float32)
+        backoffs = np.array(backoffs, dtype=np.float32)
+        if n == 1:
+            # NOTE: the node of a unigram is its word id
+            self._logprobs.append(logprobs)
+            self._backoffs.append(backoffs)
+            return
+
+        words = np.array(words, dtype=np.int64).reshape(-1, n)
+        # Find nodes of the histories
+        nodes = words[:, 0]
+        for j in range(1, n - 1):
+            nodes = self._find_children(j, nodes, words[:, j])
+            if (nodes < 0).any():
+                raise ValueError('The history of a %d-gram is not found.' % n)
+        keys = nodes * len(self.vocab) + words[:, n - 1]
+
+        order = np.argsort(keys, kind='stable')
+        self._keys.append(keys[order])
+        self._logprobs.append(logprobs[order])
+        self._backoffs.append(backoffs[order])
+
+    def _find_children(self, j, nodes, words):
+        """Returns the nodes of (j+1)-grams extended from j-grams.
+        Args:
+            j (int): the order of the parent nodes
+            nodes (np.ndarray or int): the parent nodes
+            words (np.ndarray or int): word ids
+        Returns:
+            nodes (np.ndarray or int): -1 means not found
+        """
+        keys = self._keys[j]
+        query = nodes * len(self.vocab) + words
+        if len(keys) == 0:
+            return np.full_like(query, -1)
+        indices = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+        return np.where(keys[indices] == query, indices, -1)
+
+    def _find(self, words):
+        """Returns the node of an n-gram.
+        Args:
+            words (tuple): word ids
+        Returns:
+            node (int): -1 means not found
+        """
+        node = words[0]
+        for j in range(1, len(words)):
+            node = int(self._find_children(j, node, words[j]))
+            if node < 0:
+                return -1
+        return node
+
+    def _logprob(self, history, word):
+        """Returns the log10 probability with back-off.
+        Args:
+            history (tuple): word ids
+            word (int): a word id
+        Returns:
+            logprob (float):
+        """
+        backoff = 0.
+        for i in range(len(history)):
+            context = history[i:]
+            node = self._find(context)
+            if node < 0:
+                continue
+            child = int(self._find_children(len(context), node, word))
+            if child >= 0:
+                return backoff + float(self._logprobs[len(context)][child])
+            backoff += float(self._backoffs[len(context) - 1][node])
+        return backoff + float(self._logprobs[0][word])
+
+    def _logprobs_all(self, history, word_ids):
+        """Returns the log10 probabilities of words with back-off at once.
+        Args:
+            history (tuple): word ids
+            word_ids (np.ndarray): word ids of size `[N]`
+        Returns:
+            logprobs (np.ndarray): A tensor of size `[N]`
+        """
+        logprobs = np.zeros((len(word_ids),), dtype=np.float64)
+        is_found = np.zeros((len(word_ids),), dtype=bool)
+        backoff = 0.
+        for i in range(len(history)):
+            context = history[i:]
+            node = self._find(context)
+            if node < 0:
+                continue
+            children = self._find_children(len(context), node, word_ids)
+            is_hit = (children >= 0) & ~is_found
+            logprobs[is_hit] = backoff + self._logprobs[len(context)][
+                children[is_hit]].astype(np.float64)
+            is_found |= is_hit
+            backoff += float(self._backoffs[len(context) - 1][node])
+        logprobs[~is_found] = backoff + self._logprobs[0][
+            word_ids[~is_found]].astype(np.float64)
+        return logprobs
+
+    def word_ids(self, words):
+        """Returns word ids of tokens.
+        Args:
+            words (list): tokens. None is regarded as out of vocabulary.
+        Returns:
+            word_ids (np.ndarray): -1 means out of vocabulary
+        """
+        return np.array([self.vocab.get(w, self.unk) if w is not None else -1
+                         for w in words], dtype=np.int64)
+
+    def score_all(self, state, word_ids):
+        """Returns the natural log probabilities of words in a state at once.
+            This is the vectorized version of score().
+        Args:
+            state (tuple): the state returned by start() or score()
+            word_ids (np.ndarray): word ids returned by word_ids()
+        Returns:
+            logprobs (np.ndarray): A tensor of size `[N]`
+        """
+        is_oov = word_ids < 0
+        logprobs = np.full((len(word_ids),), self.oov_logprob * LN_10)
+        logprobs[~is_oov] = self._logprobs_all(state, word_ids[~is_oov]) * LN_10
+        return logprobs
+
+    def _set_cache(self, key, result):
+        if len(self._cache) >= self.max_cache_size:
+            self._cache = {}
+        self._cache[key] = result
+
+    def start(self):
+        """Returns the state at the beginning of a sentence."""
+        if self.bos >= 0 and self.order > 1:
+            return (self.bos,)
+        return ()
+
+    def score(self, state, word):
+        """Returns the natural log probability of a word and the next state.
+            Results are memoized, so each lookup after the first one costs
+            one hash probe.
+        Args:
+            state (tuple): the state returned by start() or score()
+            word (string):
+        Returns:
+            logprob (float):
+            state (tuple):
+        """
+        key = (state, word)
+        result = self._cache.get(key)
+        if result is None:
+            word_id = self.vocab.get(word, self.unk)
+            if word_id < 0:
+                result = (self.oov_logprob * LN_10, ())
+            else:
+                next_state = (state + (word_id,))[-(self.order - 1):] if self.order > 1 else ()
+                result = (self._logprob(state, word_id) * LN_10, next_state)
+            self._set_cache(key, result)
+        return result
+
+    def final(self, state):
+        """Returns the natural log probability of the end of a sentence.
+        Args:
+            state (tuple):
+        Returns:
+            logprob (float):
+        """
+        if self.eos < 0:
+            return 0.
+        key = (state, None)
+        result = self._cache.get(key)
+        if result is None:
+            result = (self._logprob(state, self.eos) * LN_10, ())
+            self._set_cache(key, result)
+        return result[0]
+
+    def clear_cache(self):
+        self._cache = {}
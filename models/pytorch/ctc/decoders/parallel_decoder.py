@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Decode utterances in a mini-batch in parallel with a process pool.
+    Any decoder which takes `(log_probs, x_lens, **kwargs)` and returns
+    one hypothesis per utterance can be wrapped. The log-probabilities are
+    copied to shared memory once per mini-batch, and only its name and the
+    utterance index are sent to workers.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+
+# The decoder in each worker process
+_decoder = None
+
+
+def _init_worker(decoder):
+    global _decoder
+    _decoder = decoder
+
+
+def _decode_utterance(args):
+    """Decode an utterance in a worker process.
+    Args:
+        args (tuple): the name, shape and dtype of the shared memory block,
+            the index of the utterance, its length and keyword arguments
+            to the decoder
+    Returns:
+        b (int): the index of the utterance
+        best_hyp (np.ndarray):
+    """
+    name, shape, dtype, b, x_len, kwargs = args
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        log_probs = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        best_hyp = np.array(_decoder(
+            log_probs[b:b + 1], np.array([x_len]), **kwargs)[0])
+        # NOTE: views of the buffer must be released before closing
+        del log_probs
+    finally:
+        shm.close()
+    return b, best_hyp
+
+
+class ParallelDecoder(object):
+    """Decode utterances with a persistent pool of worker processes.
+    Args:
+        decoder (object): the decoder to run in each worker
+        num_workers (int, optional): the number of worker processes.
+            None means the number of CPUs.
+        start_method (string, optional): spawn or fork or forkserver.
+            spawn is safe after CUDA is initialized in the main process.
+    """
+
+    def __init__(self, decoder, num_workers=None, start_method='spawn'):
+        self.decoder = decoder
+        self.num_workers = num_workers or mp.cpu_count()
+        self.start_method = start_method
+        self._pool = None
+
+    def _get_pool(self):
+        # NOTE: the pool is started lazily and kept until close()
+        if self._pool is None:
+            ctx = mp.get_context(self.start_method)
+            self._pool = ctx.Pool(self.num_workers,
+                                  initializer=_init_worker,
+                                  initargs=(self.decoder,))
+        return self._pool
+
+    def close(self):
+        """Terminate the worker processes."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def set_lm(self, *args, **kwargs):
+        """Set the language model of the decoder. Workers are restarted
+            with the new decoder at the next call."""
+        self.decoder.set_lm(*args, **kwargs)
+        self.close()
+
+    def __call__(self, log_probs, x_lens, **kwargs):
+        """
+        Args:
+            log_probs (np.ndarray): A tensor of size `[B, T, num_classes]`
+            x_lens (np.ndarray): A tensor of size `[B]`
+            kwargs: keyword arguments to the decoder (e.g. beam_width)
+        Returns:
+            best_hyps (np.ndarray): Best path hypothesis.
+                A tensor of size `[B, labels_max_seq_len]`
+        """
+        batch_size = log_probs.shape[0]
+        if batch_size == 1 or self.num_workers <= 1:
+            return self.decoder(log_probs, x_lens, **kwargs)
+
+        log_probs = np.ascontiguousarray(log_probs)
+        shm = shared_memory.SharedMemory(create=True, size=log_probs.nbytes)
+        try:
+            np.ndarray(log_probs.shape, dtype=log_probs.dtype,
+                       buffer=shm.buf)[:] = log_probs
+
+            # NOTE: start from the longest utterances to balance the load
+            tasks = [(shm.name, log_probs.shape, log_probs.dtype.str,
+                      int(b), int(x_lens[b]), kwargs)
+                     for b in np.argsort(-np.asarray(x_lens), kind='stable')]
+            best_hyps = [None] * batch_size
+            for b, best_hyp in self._get_pool().imap_unordered(
+                    _decode_utterance, tasks):
+                best_hyps[b] = best_hyp
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return np.array(best_hyps)
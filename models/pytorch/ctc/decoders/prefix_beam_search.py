@@ -0,0 +1,374 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Beam search (prefix search) decoder in vectorized numpy implementation.
+    Prefixes are stored in a trie and represented by integer ids, and all
+    candidates in a frame are scored with array operations.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+LOG_0 = -float("inf")
+LOG_1 = 0
+
+
+class PrefixTrie(object):
+    """Trie of label sequences. The root (id 0) is the empty sequence."""
+
+    def __init__(self):
+        self.parent = [-1]
+        self.label = [-1]
+        self._children = {}
+
+    def child(self, node, label):
+        """Returns the id of the sequence extended by a label.
+        Args:
+            node (int): the id of a prefix
+            label (int):
+        Returns:
+            node (int):
+        """
+        key = (node, label)
+        child = self._children.get(key)
+        if child is None:
+            child = len(self.parent)
+            self._children[key] = child
+            self.parent.append(node)
+            self.label.append(label)
+        return child
+
+    def sequence(self, node):
+        """Returns the label sequence of a prefix.
+        Args:
+            node (int):
+        Returns:
+            labels (list):
+        """
+        labels = []
+        while node > 0:
+            labels.append(self.label[node])
+            node = self.parent[node]
+        return labels[::-1]
+
+
+class PrefixBeamSearchDecoder(object):
+    """Beam search decoder. With the default settings, the hypotheses are
+        the same as those of beam_search_decoder.BeamSearchDecoder.
+    Args:
+        blank_index (int): the index of the blank label
+        space_index (int, optional): the index of the space label
+        cutoff_top_n (int, optional): only the top-n classes in each frame are
+            considered. 0 means all classes.
+        cutoff_prob (float, optional): only classes whose cumulative
+            probability in each frame is within cutoff_prob are considered
+        blank_threshold (float, optional): frames where the blank
+            probability is larger than this do not extend prefixes.
+            None means all frames are searched.
+        lm (NgramLM, optional): the language model for shallow fusion
+        vocab (list, optional): the token of each class index, which is
+            given to the language model. Tokens are characters (words are
+            divided by space_index) if space_index >= 0, otherwise words.
+    """
+
+    def __init__(self, blank_index, space_index=-1, cutoff_top_n=0,
+                 cutoff_prob=1.0, blank_threshold=None, lm=None, vocab=None):
+        self._blank = blank_index
+        self._space = space_index
+        self.cutoff_top_n = cutoff_top_n
+        self.cutoff_prob = cutoff_prob
+        self.blank_threshold = blank_threshold
+        self.set_lm(lm, vocab)
+
+    def set_lm(self, lm, vocab, space_index=None):
+        """Set the language model for shallow fusion.
+        Args:
+            lm (NgramLM): None means no language model
+            vocab (list): the token of each class index
+            space_index (int, optional): the index of the space label
+        """
+        if lm is not None and vocab is None:
+            raise ValueError('Set vocab to use the language model.')
+        self.lm = lm
+        self.vocab = vocab
+        if space_index is not None:
+            self._space = space_index
+
+    def __call__(self, log_probs, x_lens, beam_width=1,
+                 alpha=0., beta=0.):
+        """Performs inference for the given output probabilities.
+        Args:
+            log_probs (np.ndarray): The output log-scale probabilities
+                (e.g. post-softmax) for each time step.
+                A tensor of size `[B, T, num_classes]`
+            x_lens (np.ndarray): A tensor of size `[B]`
+            beam_width (int): the size of beam
+            alpha (float): language model weight
+            beta (float): insertion bonus per word
+        Returns:
+            best_hyps (np.ndarray): Best path hypothesis.
+                A tensor of size `[B, labels_max_seq_len]`
+        """
+        best_hyps = []
+        for b in range(log_probs.shape[0]):
+            if self.lm is None:
+                best_hyp = self._decode_utterance(
+                    log_probs[b, :x_lens[b]], beam_width)
+            else:
+                best_hyp = self._decode_utterance(
+                    log_probs[b, :x_lens[b]], beam_width,
+                    _LMScorer(self.lm, self.vocab, self._space, alpha, beta))
+            best_hyps.append(best_hyp)
+        return np.array(best_hyps)
+
+    def _prune_classes(self, log_probs_t):
+        """Returns the non-blank classes to extend prefixes with.
+        Args:
+            log_probs_t (np.ndarray): A tensor of size `[num_classes]`
+        Returns:
+            classes (np.ndarray): A tensor of size `[C]`
+        """
+        num_classes = len(log_probs_t)
+        if self.cutoff_top_n > 0 or self.cutoff_prob < 1.0:
+            classes = np.argsort(-log_probs_t, kind='stable')
+            if self.cutoff_top_n > 0:
+                classes = classes[:self.cutoff_top_n]
+            if self.cutoff_prob < 1.0:
+                cumsum = np.cumsum(np.exp(log_probs_t[classes]))
+                # NOTE: keep the class which exceeds cutoff_prob
+                classes = classes[:np.searchsorted(cumsum, self.cutoff_prob) + 1]
+        else:
+            classes = np.arange(num_classes)
+        return classes[classes != self._blank]
+
+    def _decode_utterance(self, log_probs, beam_width, lm_scorer=None):
+        """Prefix search for one utterance.
+        Args:
+            log_probs (np.ndarray): A tensor of size `[T, num_classes]`
+            beam_width (int): the size of beam
+            lm_scorer (_LMScorer, optional):
+        Returns:
+            best_hyp (np.ndarray): A tensor of size `[L]`
+        """
+        trie = PrefixTrie()
+        if self.blank_threshold is not None:
+            log_blank_threshold = np.log(self.blank_threshold)
+
+        # The beam is represented by arrays of
+        # prefix ids, the last labels, p_blank and p_no_blank
+        ids = np.array([0])
+        last = np.array([-1])
+        p_b = np.array([LOG_1], dtype=np.float64)
+        p_nb = np.array([LOG_0], dtype=np.float64)
+        # the weighted LM score and insertion bonus of each prefix
+        lm_score = np.zeros((1,), dtype=np.float64)
+        if lm_scorer is not None:
+            lm_scorer.start(0)
+
+        for t in range(len(log_probs)):
+            log_probs_t = log_probs[t].astype(np.float64)
+            p_blank = log_probs_t[self._blank]
+            p_total = np.logaddexp(p_b, p_nb)
+
+            # Keep prefixes
+            # 1. a blank is emitted
+            stay_p_b = p_total + p_blank
+            # 2. the last label is repeated (merging case)
+            stay_p_nb = np.where(last >= 0,
+                                 p_nb + log_probs_t[np.maximum(last, 0)],
+                                 LOG_0)
+
+            # Skip frames dominated by the blank
+            if self.blank_threshold is not None and p_blank > log_blank_threshold:
+                p_b, p_nb = stay_p_b, stay_p_nb
+                continue
+
+            # Extend prefixes by non-blank classes
+            classes = self._prune_classes(log_probs_t)
+            # NOTE: if the class is the same as the last label, the prefix
+            # must end in the blank
+            ext_p_nb = np.where(classes[None, :] == last[:, None],
+                                p_b[:, None], p_total[:, None]) + log_probs_t[classes][None, :]
+            # NOTE: ext_p_nb: `[K, C]`
+
+            # Merge extensions which are already in the beam
+            row = dict((prefix_id, i) for i, prefix_id in enumerate(ids))
+            col = dict((c, j) for j, c in enumerate(classes))
+            merge_dst, merge_row, merge_col = [], [], []
+            for i, prefix_id in enumerate(ids):
+                parent_row = row.get(trie.parent[prefix_id], -1)
+                if parent_row >= 0 and last[i] in col:
+                    merge_dst.append(i)
+                    merge_row.append(parent_row)
+                    merge_col.append(col[last[i]])
+            if len(merge_dst) > 0:
+                stay_p_nb[merge_dst] = np.logaddexp(
+                    stay_p_nb[merge_dst], ext_p_nb[merge_row, merge_col])
+                ext_p_nb[merge_row, merge_col] = LOG_0
+
+            # Pick up the top-k candidates
+            if lm_scorer is not None:
+                ext_lm_score = lm_score[:, None] + \
+                    lm_scorer.extension_scores(ids, classes)
+                # NOTE: merged extensions have been set to LOG_0
+                scores = np.concatenate([np.logaddexp(stay_p_b, stay_p_nb) + lm_score,
+                                         (ext_p_nb + ext_lm_score).reshape(-1)])
+            else:
+                scores = np.concatenate([np.logaddexp(stay_p_b, stay_p_nb),
+                                         ext_p_nb.reshape(-1)])
+            # NOTE: merged extensions must not enter the beam again, or the
+            # same prefix appears twice when the beam is not filled
+            topk = np.where(scores > LOG_0)[0]
+            if len(topk) > beam_width:
+                topk = topk[np.argpartition(-scores[topk],
+                                            beam_width - 1)[:beam_width]]
+            topk = topk[np.argsort(-scores[topk], kind='stable')]
+
+            num_stay = len(ids)
+            new_ids, new_last = [], []
+            new_p_b, new_p_nb, new_lm_score = [], [], []
+            for k in topk:
+                if k < num_stay:
+                    new_ids.append(ids[k])
+                    new_last.append(last[k])
+                    new_p_b.append(stay_p_b[k])
+                    new_p_nb.append(stay_p_nb[k])
+                    new_lm_score.append(lm_score[k])
+                else:
+                    i, j = divmod(k - num_stay, len(classes))
+                    child = trie.child(ids[i], classes[j])
+                    new_ids.append(child)
+                    new_last.append(classes[j])
+                    new_p_b.append(LOG_0)
+                    new_p_nb.append(ext_p_nb[i, j])
+                    if lm_scorer is not None:
+                        lm_scorer.extend(ids[i], classes[j], child)
+                        new_lm_score.append(ext_lm_score[i, j])
+                    else:
+                        new_lm_score.append(0.)
+            ids = np.array(new_ids)
+            last = np.array(new_last)
+            p_b = np.array(new_p_b, dtype=np.float64)
+            p_nb = np.array(new_p_nb, dtype=np.float64)
+            lm_score = np.array(new_lm_score, dtype=np.float64)
+
+        scores = np.logaddexp(p_b, p_nb)
+        if lm_scorer is not None:
+            scores += lm_score + lm_scorer.final_scores(ids)
+        best = np.argmax(scores)
+        return np.array(trie.sequence(ids[best]))
+
+
+class _LMScorer(object):
+    """Scores of the language model for prefixes of one utterance. The LM
+        state of each prefix is kept by the prefix id, so that extending a
+        prefix costs one lookup of the (memoized) language model.
+    Args:
+        lm (NgramLM):
+        vocab (list): the token of each class index
+        space_index (int): the index of the space label. If negative, each
+            token is a word.
+        alpha (float): language model weight
+        beta (float): insertion bonus per word
+    """
+
+    def __init__(self, lm, vocab, space_index, alpha, beta):
+        self.lm = lm
+        self.vocab = vocab
+        self.space_index = space_index
+        self.alpha = alpha
+        self.beta = beta
+
+        # prefix id -> LM state at the last word boundary
+        self._state = {}
+        # prefix id -> characters after the last word boundary
+        self._word = {}
+
+        if space_index < 0:
+            # NOTE: LM states are shared by many prefixes, so that scores of
+            # all classes are computed at once for each state
+            self._word_ids = lm.word_ids(vocab)
+            # LM state -> scores of all classes
+            self._class_scores = {}
+
+    def start(self, prefix_id):
+        self._state[prefix_id] = self.lm.start()
+        self._word[prefix_id] = ''
+
+    def _word_score(self, state, word):
+        logprob, state = self.lm.score(state, word)
+        return self.alpha * logprob + self.beta, state
+
+    def extension_scores(self, ids, classes):
+        """Returns scores added by extending prefixes.
+        Args:
+            ids (np.ndarray): prefix ids. A tensor of size `[K]`
+            classes (np.ndarray): A tensor of size `[C]`
+        Returns:
+            scores (np.ndarray): A tensor of size `[K, C]`
+        """
+        scores = np.zeros((len(ids), len(classes)), dtype=np.float64)
+        if self.space_index >= 0:
+            # NOTE: a word is scored when it is closed by the space
+            space_col = np.where(classes == self.space_index)[0]
+            if len(space_col) == 0:
+                return scores
+            for i, prefix_id in enumerate(ids):
+                word = self._word[prefix_id]
+                if len(word) > 0:
+                    scores[i, space_col[0]] = self._word_score(
+                        self._state[prefix_id], word)[0]
+        else:
+            for i, prefix_id in enumerate(ids):
+                scores[i] = self._all_class_scores(
+                    self._state[prefix_id])[classes]
+        return scores
+
+    def _all_class_scores(self, state):
+        scores = self._class_scores.get(state)
+        if scores is None:
+            scores = self.alpha * \
+                self.lm.score_all(state, self._word_ids) + self.beta
+            self._class_scores[state] = scores
+        return scores
+
+    def extend(self, prefix_id, c, child_id):
+        """Set the LM state of a new prefix.
+        Args:
+            prefix_id (int): the parent prefix
+            c (int): the label added to the parent
+            child_id (int): the new prefix
+        """
+        if child_id in self._state:
+            return
+        state = self._state[prefix_id]
+        word = self._word[prefix_id]
+        if self.space_index < 0:
+            state = self._word_score(state, self.vocab[c])[1]
+        elif c == self.space_index:
+            if len(word) > 0:
+                state = self._word_score(state, word)[1]
+            word = ''
+        else:
+            word += self.vocab[c]
+        self._state[child_id] = state
+        self._word[child_id] = word
+
+    def final_scores(self, ids):
+        """Returns scores of the last word and the end of sentence.
+        Args:
+            ids (np.ndarray): prefix ids. A tensor of size `[K]`
+        Returns:
+            scores (np.ndarray): A tensor of size `[K]`
+        """
+        scores = np.zeros((len(ids),), dtype=np.float64)
+        for i, prefix_id in enumerate(ids):
+            state = self._state[prefix_id]
+            word = self._word[prefix_id]
+            if len(word) > 0:
+                scores[i], state = self._word_score(state, word)
+            scores[i] += self.alpha * self.lm.final(state)
+        return scores
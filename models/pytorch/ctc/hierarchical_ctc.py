@@ -8,11 +8,13 @@ from __future__ import division
 from __future__ import print_function
 
 import torch
+import torch.nn.functional as F
 
 from models.pytorch.ctc.ctc import CTC, _concatenate_labels
 from models.pytorch.linear import LinearND
 from models.pytorch.encoders.load_encoder import load
 from models.pytorch.ctc.ctc import my_warpctc
+from models.pytorch.ctc.decoders.prefix_beam_search import PrefixBeamSearchDecoder
 from models.pytorch.criterion import cross_entropy_label_smoothing
 
 
@@ -135,6 +137,8 @@ class HierarchicalCTC(CTC):
 
         # Setting for CTC
         self.num_classes_sub = num_classes_sub + 1  # Add the blank class
+        # NOTE: the sub task is decoded without the n-gram language model
+        self._decode_beam_sub_np = PrefixBeamSearchDecoder(blank_index=0)
 
         # Setting for MTL
         self.main_loss_weight = main_loss_weight
@@ -280,7 +284,7 @@ class HierarchicalCTC(CTC):
             loss_sub (torch.FloatTensor or float): A tensor of size `[]`
         """
         if is_eval:
-            with torch.no_grad():
+            with torch.no_grad(), self.autocast():
                 loss, loss_main, loss_sub = self._forward(
                     xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
 
@@ -294,8 +298,9 @@ class HierarchicalCTC(CTC):
             if self.weight_noise_injection:
                 self.inject_weight_noise(mean=0, std=self.weight_noise_std)
 
-            loss, loss_main, loss_sub = self._forward(
-                xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
+            with self.autocast():
+                loss, loss_main, loss_sub = self._forward(
+                    xs, ys, x_lens, y_lens, ys_sub, y_lens_sub)
 
         return loss, loss_main, loss_sub
 
@@ -316,6 +321,10 @@ class HierarchicalCTC(CTC):
         logits_main, x_lens, logits_sub, x_lens_sub, perm_idx = self._encode(
             xs, x_lens, is_multi_task=True)
 
+        # NOTE: CTC loss is always computed in float32
+        logits_main = logits_main.float()
+        logits_sub = logits_sub.float()
+
         # Output smoothing
         if self.logits_temperature != 1:
             logits_main /= self.logits_temperature
@@ -367,3 +376,49 @@ class HierarchicalCTC(CTC):
         loss = loss_main + loss_sub
 
         return loss, loss_main, loss_sub
+
+    def decode_multi_task(self, xs, x_lens, beam_width=1, max_decode_len=None,
+                          beam_width_sub=1, max_decode_len_sub=None,
+                          return_probs=False):
+        """Decode the main and sub tasks with a single pass of the encoder.
+        Args:
+            xs (np.ndarray): A tensor of size `[B, T_in, input_size]`
+            x_lens (np.ndarray): A tensor of size `[B]`
+            beam_width (int, optional): the size of beam in the main task
+            max_decode_len: not used (to make compatible with attention)
+            beam_width_sub (int, optional): the size of beam in the sub task,
+                which is decoded without the n-gram language model
+            max_decode_len_sub: not used (to make compatible with attention)
+            return_probs (bool, optional): if True, return CTC posteriors
+                of both tasks instead of None
+        Returns:
+            best_hyps (np.ndarray): A tensor of size `[B]`
+            probs (np.ndarray): A tensor of size `[B, T, num_classes]`
+            best_hyps_sub (np.ndarray): A tensor of size `[B]`
+            probs_sub (np.ndarray): A tensor of size `[B, T_sub, num_classes_sub]`
+            perm_idx (np.ndarray): A tensor of size `[B]`
+        """
+        self.eval()
+        with torch.no_grad():
+            # Wrap by Tensor
+            xs = self.np2tensor(xs, dtype=torch.float)
+            x_lens = self.np2tensor(x_lens, dtype=torch.int)
+
+            # Encode acoustic features only once for both tasks
+            logits, x_lens, logits_sub, x_lens_sub, perm_idx = self._encode(
+                xs, x_lens, is_multi_task=True)
+
+        best_hyps = self._decode_logits(logits, x_lens, beam_width)
+        best_hyps_sub = self._decode_logits(
+            logits_sub, x_lens_sub, beam_width_sub, task_index=1)
+
+        if return_probs:
+            probs = self.tensor2np(F.softmax(logits, dim=-1))
+            probs_sub = self.tensor2np(F.softmax(logits_sub, dim=-1))
+        else:
+            probs, probs_sub = None, None
+
+        # Permutate indices to the original order
+        perm_idx = self.tensor2np(perm_idx)
+
+        return best_hyps, probs, best_hyps_sub, probs_sub, perm_idx
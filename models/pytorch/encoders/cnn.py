@@ -13,6 +13,7 @@ import numpy as np
 import torch
 import torch.nn as nn
 from torch.autograd import Variable
+from torch.utils.checkpoint import checkpoint
 
 from models.pytorch.encoders.cnn_utils import ConvOutSize, Maxout
 
@@ -30,6 +31,10 @@ class CNNEncoder(nn.Module):
         dropout_hidden (float): the probability to drop nodes in hidden-hidden connection
         activation (string, optional): relu or prelu or hard_tanh or maxout
         batch_norm (bool, optional): if True, apply batch normalization
+        use_checkpoint (bool, optional): if True, recompute activations in
+            the backward pass to save memory. This is ignored if batch_norm
+            is True, because running statistics of batch normalization would
+            be updated twice.
     """
 
     def __init__(self,
@@ -42,11 +47,14 @@ class CNNEncoder(nn.Module):
                  dropout_input,
                  dropout_hidden,
                  activation='relu',
-                 batch_norm=False):
+                 batch_norm=False,
+                 use_checkpoint=False):
 
         super(CNNEncoder, self).__init__()
 
         self.input_channel = input_channel
+        self.use_checkpoint = use_checkpoint
+        self.batch_norm = batch_norm
         assert input_size % input_channel == 0
         self.input_freq = input_size // input_channel
 
@@ -148,7 +156,10 @@ class CNNEncoder(nn.Module):
             xs = xs.unsqueeze(1)
             # NOTE: xs: `[B, in_ch (1), freq, max_time]`
 
-        xs = self.layers(xs)
+        if self.use_checkpoint and not self.batch_norm and self.training and torch.is_grad_enabled():
+            xs = checkpoint(self.layers, xs, use_reentrant=False)
+        else:
+            xs = self.layers(xs)
         # NOTE: xs: `[B, out_ch, new_freq, new_time]`
 
         # Collapse feature dimension
@@ -14,6 +14,7 @@ import torch.nn as nn
 from torch.autograd import Variable
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+from torch.utils.checkpoint import checkpoint
 
 from models.pytorch.linear import LinearND
 from models.pytorch.encoders.cnn import CNNEncoder
@@ -54,6 +55,12 @@ class RNNEncoder(nn.Module):
         num_layers_sub (int): the number of layers in the sub task
         nin (int, optional): if larger than 0, insert 1*1 conv (filter size: nin)
             and ReLU activation between each LSTM layer
+        checkpoint_layers (list, optional): indices of RNN layers whose
+            activations are recomputed in the backward pass to save memory.
+            In the fast implementation, all layers are recomputed if any
+            layer is given. None means no layer.
+        checkpoint_conv (bool, optional): if True, recompute activations of
+            CNN layers before RNN layers in the backward pass
     """
 
     def __init__(self,
@@ -83,7 +90,9 @@ class RNNEncoder(nn.Module):
                  residual=False,
                  dense_residual=False,
                  num_layers_sub=0,
-                 nin=0):
+                 nin=0,
+                 checkpoint_layers=None,
+                 checkpoint_conv=False):
 
         super(RNNEncoder, self).__init__()
 
@@ -107,6 +116,9 @@ class RNNEncoder(nn.Module):
         self.merge_bidirectional = merge_bidirectional
         self.pack_sequence = pack_sequence
 
+        # Setting for activation checkpointing
+        self.checkpoint_layers = list(checkpoint_layers or [])
+
         # Setting for hierarchical encoder
         self.num_layers_sub = num_layers_sub
 
@@ -153,6 +165,7 @@ class RNNEncoder(nn.Module):
                                    dropout_hidden=dropout_hidden,
                                    activation=activation,
                                    batch_norm=batch_norm)
+            self.conv.use_checkpoint = checkpoint_conv
             input_size = self.conv.output_size
         else:
             input_size = input_size * splice * num_stack
@@ -336,23 +349,14 @@ class RNNEncoder(nn.Module):
                                num_layers=self.num_layers,
                                use_cuda=use_cuda)
 
-            # Pack encoder inputs
-            if self.pack_sequence:
-                if not isinstance(xs, torch.nn.utils.rnn.PackedSequence):
-                    xs = pack_padded_sequence(
-                        xs, x_lens, batch_first=self.batch_first)
-
             # Path through RNN
-            xs, _ = getattr(self, self.rnn_type)(xs, hx=h_0)
-
-            # Unpack encoder outputs
-            if self.pack_sequence:
-                xs, unpacked_seq_len = pad_packed_sequence(
-                    xs, batch_first=self.batch_first, padding_value=0)
-                # assert x_lens == unpacked_seq_len
-
-            # Dropout for hidden-output connection
-            xs = self.dropout_last(xs)
+            if self._is_checkpointed(0, self.num_layers):
+                xs = checkpoint(self._run_rnn, xs, x_lens, h_0,
+                                self.rnn_type, 'dropout_last',
+                                use_reentrant=False)
+            else:
+                xs = self._run_rnn(xs, x_lens, h_0,
+                                   self.rnn_type, 'dropout_last')
 
         else:
             # Initialize hidden states (and memory cells) per mini-batch
@@ -369,24 +373,16 @@ class RNNEncoder(nn.Module):
                 if use_cuda:
                     torch.cuda.empty_cache()
 
-                # Pack l-th encoder xs
-                if self.pack_sequence:
-                    if not isinstance(xs, torch.nn.utils.rnn.PackedSequence):
-                        xs = pack_padded_sequence(
-                            xs, x_lens, batch_first=self.batch_first)
-
-                # Path through RNN
-                xs, _ = getattr(self, self.rnn_type + '_l' +
-                                str(l))(xs, hx=h_0)
-
-                # Unpack l-th encoder outputs
-                if self.pack_sequence:
-                    xs, unpacked_seq_len = pad_packed_sequence(
-                        xs, batch_first=self.batch_first, padding_value=0)
-                    # assert x_lens == unpacked_seq_len
-
-                # Dropout for hidden-hidden or hidden-output connection
-                xs = getattr(self, 'dropout_l' + str(l))(xs)
+                # Path through l-th RNN layer
+                if self._is_checkpointed(l, l + 1):
+                    xs = checkpoint(self._run_rnn, xs, x_lens, h_0,
+                                    self.rnn_type + '_l' + str(l),
+                                    'dropout_l' + str(l),
+                                    use_reentrant=False)
+                else:
+                    xs = self._run_rnn(xs, x_lens, h_0,
+                                       self.rnn_type + '_l' + str(l),
+                                       'dropout_l' + str(l))
 
                 # Pick up outputs in the sub task before the projection layer
                 if self.num_layers_sub >= 1 and l == self.num_layers_sub - 1:
@@ -482,6 +478,44 @@ class RNNEncoder(nn.Module):
         else:
             return xs, x_lens, perm_idx
 
+    def _is_checkpointed(self, start, end):
+        """Returns True if any layer in [start, end) is recomputed in the
+            backward pass."""
+        if not (self.training and torch.is_grad_enabled()):
+            return False
+        return any(start <= l < end for l in self.checkpoint_layers)
+
+    def _run_rnn(self, xs, x_lens, h_0, rnn_name, dropout_name):
+        """Path through RNN layer(s) and the following dropout.
+            Sequences are packed and unpacked inside, so that only padded
+            tensors cross the boundary of checkpointing.
+        Args:
+            xs (torch.FloatTensor): A tensor of size `[B, T, input_size]`
+                (or `[T, B, input_size]` if batch_first is False)
+            x_lens (list): the lengths in descending order
+            h_0 (torch.FloatTensor or tuple):
+            rnn_name (string): the name of the RNN module
+            dropout_name (string): the name of the dropout module
+        Returns:
+            xs (torch.FloatTensor):
+        """
+        # Pack encoder inputs
+        if self.pack_sequence:
+            xs = pack_padded_sequence(
+                xs, x_lens, batch_first=self.batch_first)
+
+        # Path through RNN
+        xs, _ = getattr(self, rnn_name)(xs, hx=h_0)
+
+        # Unpack encoder outputs
+        if self.pack_sequence:
+            xs, unpacked_seq_len = pad_packed_sequence(
+                xs, batch_first=self.batch_first, padding_value=0)
+            # assert x_lens == unpacked_seq_len
+
+        # Dropout for hidden-hidden or hidden-output connection
+        return getattr(self, dropout_name)(xs)
+
 
 def to2d(xs, size):
     return xs.contiguous().view(
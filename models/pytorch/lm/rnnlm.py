@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""RNN language model (pytorch)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from models.pytorch.base import ModelBase
+from models.pytorch.linear import LinearND, Embedding
+
+
+class RNNLM(ModelBase):
+    """RNN language model.
+    Args:
+        num_classes (int): the number of classes of target labels
+            (excluding the <SOS> and <EOS> classes)
+        embedding_dim (int): the dimension of the embedding in target spaces
+        rnn_type (string): lstm or gru
+        bidirectional (bool): if True, train a backward LM as well.
+            Only the forward LM is used in decoding.
+        num_units (int): the number of units in each layer
+        num_layers (int): the number of layers
+        dropout_embedding (float): the probability to drop nodes of the embedding
+        dropout_hidden (float): the probability to drop nodes between layers
+        dropout_output (float): the probability to drop nodes before the
+            softmax layer
+        parameter_init_distribution (string, optional): uniform or normal or
+            orthogonal or constant distribution
+        parameter_init (float, optional): Range of uniform distribution to
+            initialize weight parameters
+        recurrent_weight_orthogonal (bool, optional): if True, recurrent
+            weights are orthogonalized
+        init_forget_gate_bias_with_one (bool, optional): if True, initialize
+            the forget gate bias with 1
+        tie_weights (bool, optional): if True, share the embedding and the
+            softmax layer. num_units must be equal to embedding_dim.
+        weight_noise_std (float, optional): the standard deviation of
+            Gaussian noise injected to all parameters
+    """
+
+    def __init__(self,
+                 num_classes,
+                 embedding_dim,
+                 rnn_type,
+                 bidirectional,
+                 num_units,
+                 num_layers,
+                 dropout_embedding,
+                 dropout_hidden,
+                 dropout_output,
+                 parameter_init_distribution='uniform',
+                 parameter_init=0.1,
+                 recurrent_weight_orthogonal=False,
+                 init_forget_gate_bias_with_one=True,
+                 tie_weights=False,
+                 weight_noise_std=0):
+
+        super(ModelBase, self).__init__()
+        self.model_type = 'rnnlm'
+
+        self.embedding_dim = embedding_dim
+        self.rnn_type = rnn_type
+        self.bidirectional = bidirectional
+        self.num_units = num_units
+        self.num_layers = num_layers
+        self.tie_weights = tie_weights
+
+        # Setting for the softmax layer
+        self.num_classes = num_classes + 1  # Add <EOS> class
+        self.sos = num_classes
+        self.eos = num_classes
+        # NOTE: the same indices as the attention-based decoder
+
+        # Setting for regularization
+        self.weight_noise_injection = False
+        self.weight_noise_std = float(weight_noise_std)
+
+        self.embed = Embedding(num_classes=self.num_classes,
+                               embedding_dim=embedding_dim,
+                               dropout=dropout_embedding)
+
+        for dir in ['fwd', 'bwd'] if bidirectional else ['fwd']:
+            if rnn_type == 'lstm':
+                rnn = nn.LSTM(embedding_dim, num_units, num_layers,
+                              batch_first=True, dropout=dropout_hidden)
+            elif rnn_type == 'gru':
+                rnn = nn.GRU(embedding_dim, num_units, num_layers,
+                             batch_first=True, dropout=dropout_hidden)
+            else:
+                raise ValueError('rnn_type must be "lstm" or "gru".')
+            setattr(self, rnn_type + '_' + dir, rnn)
+
+            setattr(self, 'fc_' + dir, LinearND(
+                num_units, self.num_classes, dropout=dropout_output))
+
+            # Tie weights
+            if tie_weights:
+                if num_units != embedding_dim:
+                    raise ValueError(
+                        'num_units must be equal to embedding_dim to tie weights.')
+                getattr(self, 'fc_' + dir).fc.weight = self.embed.embed.weight
+
+        ##################################################
+        # Initialize parameters
+        ##################################################
+        self.init_weights(parameter_init,
+                          distribution=parameter_init_distribution,
+                          ignore_keys=['bias'])
+
+        # Initialize all biases with 0
+        self.init_weights(0, distribution='constant', keys=['bias'])
+
+        # Recurrent weights are orthogonalized
+        if recurrent_weight_orthogonal:
+            self.init_weights(parameter_init,
+                              distribution='orthogonal',
+                              keys=[rnn_type, 'weight'],
+                              ignore_keys=['bias'])
+
+        # Initialize bias in forget gate with 1
+        if init_forget_gate_bias_with_one:
+            self.init_forget_gate_bias_with_one()
+
+    def forward(self, ys, y_lens, is_eval=False):
+        """Forward computation.
+        Args:
+            ys (np.ndarray): A tensor of size `[B, T_out]`, which should be padded with -1.
+            y_lens (np.ndarray): A tensor of size `[B]`
+            is_eval (bool): if True, the history will not be saved.
+                This should be used in inference model for memory efficiency.
+        Returns:
+            loss (torch.FloatTensor or float): the cross entropy per token
+        """
+        if is_eval:
+            self.eval()
+            with torch.no_grad(), self.autocast():
+                loss = self._forward(ys, y_lens).item()
+        else:
+            self.train()
+
+            # Gaussian noise injection
+            if self.weight_noise_injection:
+                self.inject_weight_noise(mean=0, std=self.weight_noise_std)
+
+            with self.autocast():
+                loss = self._forward(ys, y_lens)
+
+        return loss
+
+    def _forward(self, ys, y_lens):
+        # Wrap by Tensor
+        ys = self.np2tensor(ys, dtype=torch.long)
+        y_lens = self.np2tensor(y_lens, dtype=torch.long)
+
+        loss = self.compute_xe_loss(ys, y_lens, dir='fwd')
+
+        if self.bidirectional:
+            # Reverse the order of each sequence
+            pos = torch.arange(ys.size(1), device=ys.device).unsqueeze(0)
+            indices = (y_lens.unsqueeze(1) - 1 - pos).clamp(min=0)
+            ys_bwd = ys.gather(1, indices).masked_fill(
+                pos >= y_lens.unsqueeze(1), -1)
+            loss = (loss + self.compute_xe_loss(ys_bwd, y_lens, dir='bwd')) / 2
+
+        return loss
+
+    def compute_xe_loss(self, ys, y_lens, dir):
+        """Compute XE loss.
+        Args:
+            ys (torch.LongTensor): A tensor of size `[B, T_out]`
+            y_lens (torch.LongTensor): A tensor of size `[B]`
+            dir (str): fwd or bwd
+        Returns:
+            loss (torch.FloatTensor): A tensor of size `[]`
+        """
+        batch_size = ys.size(0)
+
+        # NOTE: ys_in is padded with <EOS> in order to convert to one-hot
+        # vector, and added <SOS> before the first token
+        # ys_out is padded with -1, and added <EOS> after the last token
+        pos = torch.arange(ys.size(1) + 1, device=ys.device).unsqueeze(0)
+        ys_out = torch.cat([ys, ys.new_full((batch_size, 1), -1)], dim=1)
+        ys_out = ys_out.masked_fill(pos > y_lens.unsqueeze(1), -1)
+        ys_out = ys_out.masked_fill(pos == y_lens.unsqueeze(1), self.eos)
+        ys_in = torch.cat([ys.new_full((batch_size, 1), self.sos),
+                           ys_out[:, :-1]], dim=1)
+        ys_in = ys_in.masked_fill(ys_in < 0, self.eos)
+
+        rnn_out, _ = getattr(self, self.rnn_type + '_' + dir)(self.embed(ys_in))
+        logits = getattr(self, 'fc_' + dir)(rnn_out)
+
+        # NOTE: XE loss is always computed in float32
+        logits = logits.float()
+
+        loss = F.cross_entropy(
+            input=logits.view((-1, logits.size(2))),
+            target=ys_out.view(-1),
+            ignore_index=-1, reduction='sum') / (y_lens + 1).sum()
+        # NOTE: add <EOS>
+
+        return loss
+
+    def predict(self, y, state=None):
+        """Predict the next token (forward LM).
+        Args:
+            y (torch.LongTensor): the previous tokens of size `[B, 1]`
+            state (torch.FloatTensor or tuple, optional): the previous state.
+                None means the beginning of sentences.
+        Returns:
+            log_probs (torch.FloatTensor): A tensor of size `[B, num_classes]`
+            state (torch.FloatTensor or tuple):
+        """
+        rnn_out, state = getattr(self, self.rnn_type + '_fwd')(
+            self.embed(y), state)
+        logits = getattr(self, 'fc_fwd')(rnn_out)
+        return F.log_softmax(logits.squeeze(1).float(), dim=-1), state
+
+    def reorder_state(self, state, indices):
+        """Reorder states along the batch dimension.
+        Args:
+            state (torch.FloatTensor or tuple):
+            indices (torch.LongTensor): A tensor of size `[B]`
+        Returns:
+            state (torch.FloatTensor or tuple):
+        """
+        if self.rnn_type == 'lstm':
+            return (state[0].index_select(1, indices),
+                    state[1].index_select(1, indices))
+        else:
+            return state.index_select(1, indices)
@@ -295,10 +295,30 @@ class TestAttention(unittest.TestCase):
                     xs, x_lens,
                     beam_width=1,
                     max_decode_len=60)
-                # TODO: fix beam search
+                best_hyps_beam, aw_beam, _ = model.decode(
+                    xs, x_lens,
+                    beam_width=5,
+                    max_decode_len=60,
+                    return_aw=True)
+                self.assertEqual(len(aw_beam[0]), len(best_hyps_beam[0]))
+                _, aw_beam, _ = model.decode(
+                    xs, x_lens,
+                    beam_width=5,
+                    max_decode_len=60)
+                self.assertIsNone(aw_beam)
+
+                # Pruning in beam search
+                model.set_beam_pruning(score_threshold=5, max_active=3,
+                                       end_detection=True)
+                model.decode(xs, x_lens, beam_width=5, max_decode_len=60)
+                self.assertEqual(len(model.beam_search_stats), len(xs))
+                for stats in model.beam_search_stats:
+                    self.assertLessEqual(stats['steps'], 60)
+                model.set_beam_pruning()
 
                 str_ref = map_fn(ys[0])
                 str_hyp = map_fn(best_hyps[0][:-1])
+                str_hyp_beam = map_fn(best_hyps_beam[0][:-1])
 
                 # Compute accuracy
                 try:
@@ -322,6 +342,7 @@ class TestAttention(unittest.TestCase):
                 # Visualize
                 print('Ref: %s' % str_ref)
                 print('Hyp: %s' % str_hyp)
+                print('Hyp (beam): %s' % str_hyp_beam)
 
                 # Decode by the CTC decoder
                 if model.ctc_loss_weight >= 0.1:
@@ -330,6 +351,15 @@ class TestAttention(unittest.TestCase):
                     str_pred_ctc = map_fn(best_hyps_ctc[0])
                     print('Hyp (CTC): %s' % str_pred_ctc)
 
+                    # Joint CTC/attention decoding
+                    best_hyps_joint, _, _ = model.decode(
+                        xs, x_lens,
+                        beam_width=5,
+                        max_decode_len=60,
+                        ctc_weight=0.3)
+                    str_hyp_joint = map_fn(best_hyps_joint[0][:-1])
+                    print('Hyp (joint): %s' % str_hyp_joint)
+
                 if ler < 0.1:
                     print('Modle is Converged.')
                     break
@@ -341,6 +371,70 @@ class TestAttention(unittest.TestCase):
                     epoch=step,
                     value=ler)
 
+        self.check_beam_search(model, xs, x_lens)
+        self.check_beam_pruning(model, xs, x_lens)
+
+    def check_beam_search(self, model, xs, x_lens, max_decode_len=60):
+        """Beam search of width 1 must be the same as greedy decoding, and
+            batched beam search must be the same as decoding each utterance
+            on its own."""
+        eos = model.eos_0
+        dir = 'fwd' if model.fwd_weight_0 >= model.bwd_weight_0 else 'bwd'
+
+        def _trim(hyp):
+            hyp = list(hyp)
+            return hyp[:hyp.index(eos) + 1] if eos in hyp else hyp
+
+        # Beam width 1 vs. greedy decoding
+        model.eval()
+        with torch.no_grad():
+            enc_out, enc_lens, _ = model._encode(
+                model.np2tensor(xs, dtype=torch.float),
+                model.np2tensor(x_lens, dtype=torch.int))
+            best_hyps_greedy, _ = model._decode_infer_greedy(
+                enc_out, enc_lens, max_decode_len, task=0, dir=dir)
+            best_hyps_beam, _ = model._decode_infer_beam(
+                enc_out, enc_lens, 1, max_decode_len,
+                length_penalty=0, coverage_penalty=0, task=0, dir=dir)
+        for b in range(len(xs)):
+            self.assertEqual(_trim(best_hyps_beam[b]),
+                             _trim(best_hyps_greedy[b]))
+
+        # Batched vs. utterance-by-utterance decoding
+        best_hyps, _, perm_idx = model.decode(
+            xs, x_lens, beam_width=5, max_decode_len=max_decode_len,
+            return_aw=False)
+        for i, b in enumerate(perm_idx):
+            # NOTE: keep the padded length of the mini-batch
+            best_hyps_b, _, _ = model.decode(
+                xs[b:b + 1], x_lens[b:b + 1], beam_width=5,
+                max_decode_len=max_decode_len, return_aw=False)
+            self.assertEqual(list(best_hyps_b[0]), list(best_hyps[i]))
+
+    def check_beam_pruning(self, model, xs, x_lens, beam_width=5,
+                           max_decode_len=60):
+        """Pruning which cannot remove any hypothesis must not change the
+            results of beam search."""
+        model.set_beam_pruning()
+        best_hyps, _, _ = model.decode(
+            xs, x_lens, beam_width=beam_width,
+            max_decode_len=max_decode_len, return_aw=False)
+
+        # NOTE: end detection is exact without the length penalty
+        for kwargs in [{'score_threshold': 1e10},
+                       {'max_active': beam_width},
+                       {'end_detection': True}]:
+            model.set_beam_pruning(**kwargs)
+            best_hyps_pruned, _, _ = model.decode(
+                xs, x_lens, beam_width=beam_width,
+                max_decode_len=max_decode_len, return_aw=False)
+            for b in range(len(xs)):
+                self.assertEqual(list(best_hyps_pruned[b]), list(best_hyps[b]))
+            for stats in model.beam_search_stats:
+                if 'score_threshold' in kwargs or 'max_active' in kwargs:
+                    self.assertEqual(stats['pruned'], 0)
+        model.set_beam_pruning()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -26,14 +26,26 @@ class TestAttentionLayer(unittest.TestCase):
         self.check(attention_type='content')
         self.check(attention_type='location')
         self.check(attention_type='dot_product')
+
+        # Multi-head attention
+        self.check(attention_type='content', num_heads=4)
+        self.check(attention_type='location', num_heads=4)
+        self.check(attention_type='dot_product', num_heads=4)
+
+        # Windowed attention
+        self.check(attention_type='content', window_size=50)
+        self.check(attention_type='location', window_size=50)
+        self.check(attention_type='location', num_heads=4, window_size=50)
         # self.check(attention_type='rnn_attention')
         # self.check(attention_type='coverage')
 
     @measure_time
-    def check(self, attention_type):
+    def check(self, attention_type, num_heads=1, window_size=0):
 
         print('==================================================')
         print('  attention_type: %s' % attention_type)
+        print('  num_heads: %d' % num_heads)
+        print('  window_size: %d' % window_size)
         print('==================================================')
 
         batch_size = 4
@@ -50,12 +62,13 @@ class TestAttentionLayer(unittest.TestCase):
             sigmoid_smoothing=False,
             out_channels=10,
             kernel_size=101,
-            num_heads=1)
+            num_heads=num_heads,
+            window_size=window_size)
 
         enc_out = torch.randn((batch_size, max_time, encoder_num_units))
         x_lens = torch.ones(batch_size) * max_time
         dec_state_step = torch.randn((batch_size, 1, decoder_num_units))
-        att_weights_step = torch.randn((batch_size, max_time, 1))
+        att_weights_step = torch.randn((batch_size, max_time, num_heads))
 
         context_vec, att_weights_step = attend(enc_out,
                                                x_lens,
@@ -63,7 +76,58 @@ class TestAttentionLayer(unittest.TestCase):
                                                att_weights_step)
 
         assert context_vec.size() == (batch_size, 1, encoder_num_units)
-        assert att_weights_step.size() == (batch_size, max_time, 1)
+        assert att_weights_step.size() == (batch_size, max_time, num_heads)
+        if window_size > 0:
+            # Only frames in the window are attended
+            self.assertTrue(
+                ((att_weights_step > 0).sum(dim=1) <= window_size).all())
+
+        # The cached projection must give the same results
+        # NOTE: both calls take the same attention weights of the previous step
+        x_lens = torch.IntTensor([max_time, max_time - 10, max_time - 50, 1])
+        aw_in = att_weights_step
+        context_vec, att_weights_step = attend(
+            enc_out, x_lens, dec_state_step, aw_in)
+        attend.reset(enc_out, x_lens)
+        context_vec_cached, att_weights_step_cached = attend(
+            enc_out, x_lens, dec_state_step, aw_in)
+        attend.clear()
+        self.assertTrue(torch.allclose(context_vec, context_vec_cached))
+        self.assertTrue(torch.allclose(
+            att_weights_step, att_weights_step_cached))
+
+        # Load parameters saved with per-head layers
+        state_dict = {}
+        for name, param in attend.state_dict().items():
+            if name == 'W_mha.fc.weight' or name == 'W_mha.fc.bias':
+                state_dict[name] = param
+                continue
+            for h, param_head in enumerate(param.chunk(num_heads, dim=0)):
+                if name == 'V':
+                    state_dict['V_head%d.fc.weight' % h] = param_head
+                elif name == 'W_conv':
+                    state_dict['W_conv_head%d.fc.weight' %
+                               h] = param_head.squeeze(0)
+                elif name == 'conv.weight':
+                    state_dict['conv_head%d.weight' % h] = param_head
+                else:
+                    module, key = name.split('.', 1)
+                    state_dict['%s_head%d.%s' % (module, h, key)] = param_head
+        attend_old = AttentionMechanism(
+            encoder_num_units=decoder_num_units,
+            decoder_num_units=decoder_num_units,
+            attention_type=attention_type,
+            attention_dim=128,
+            sharpening_factor=2,
+            sigmoid_smoothing=False,
+            out_channels=10,
+            kernel_size=101,
+            num_heads=num_heads,
+            window_size=window_size)
+        attend_old.load_state_dict(state_dict)
+        context_vec_old, _ = attend_old(
+            enc_out, x_lens, dec_state_step, aw_in)
+        self.assertTrue(torch.allclose(context_vec, context_vec_old))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test CTC prefix scores for joint CTC/attention decoding (pytorch)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import unittest
+import numpy as np
+from itertools import groupby, product
+
+import torch
+
+sys.path.append('../../../../')
+from models.pytorch.ctc.ctc_prefix_scorer import CTCPrefixScorer
+
+BLANK = 0
+NUM_LABELS = 2
+EOS = NUM_LABELS  # the last token of the attention-based decoder
+
+
+def _brute_force(probs):
+    """Sum the probabilities of all CTC paths for each label sequence.
+    Args:
+        probs (np.ndarray): A tensor of size `[T, num_classes_ctc]`
+    Returns:
+        seq_probs (dict): the label sequence (tokens of the attention-based
+            decoder) and its probability
+    """
+    seq_probs = {}
+    for path in product(range(probs.shape[1]), repeat=probs.shape[0]):
+        seq = tuple(c - 1 for c, _ in groupby(path) if c != BLANK)
+        seq_probs[seq] = seq_probs.get(seq, 0.) + np.prod(
+            [probs[t, c] for t, c in enumerate(path)])
+    return seq_probs
+
+
+def _prefix_prob(seq_probs, prefix, c):
+    """The probability of the prefix extended by c. <EOS> completes it."""
+    if c == EOS:
+        return seq_probs.get(tuple(prefix), 0.)
+    prefix = tuple(prefix) + (c,)
+    return sum(p for seq, p in seq_probs.items()
+               if seq[:len(prefix)] == prefix)
+
+
+class TestCTCPrefixScorer(unittest.TestCase):
+
+    def test(self):
+        print("CTC prefix scorer Working check.")
+
+        # repeated tokens
+        self.check(x_lens=[5, 5], hyps=[[0, 0, 1], [1, 1, 1]])
+        # padded frames
+        self.check(x_lens=[5, 3], hyps=[[0, 1, 0], [1, 0, 0]])
+        self.check(x_lens=[2, 4, 1], hyps=[[1, 1], [0, 0], [0, 1]])
+
+    def check(self, x_lens, hyps):
+        batch_size = len(x_lens)
+        max_time = max(x_lens)
+        num_classes_ctc = NUM_LABELS + 1
+
+        np.random.seed(1)
+        logits = np.random.randn(batch_size, max_time, num_classes_ctc)
+        probs = np.exp(logits) / np.exp(logits).sum(axis=-1, keepdims=True)
+        # NOTE: padded frames must be ignored whatever their values are
+        for b, x_len in enumerate(x_lens):
+            probs[b, x_len:] = 0.5
+        seq_probs = [_brute_force(probs[b, :x_len])
+                     for b, x_len in enumerate(x_lens)]
+
+        scorer = CTCPrefixScorer(
+            torch.from_numpy(np.log(probs)).float(),
+            torch.IntTensor(x_lens), blank=BLANK, eos=EOS)
+        state = scorer.initial_state()
+        candidates = torch.arange(NUM_LABELS + 1).unsqueeze(
+            0).expand(batch_size, -1)
+
+        for i in range(len(hyps[0])):
+            log_psi, r_new = scorer.score(state, candidates)
+            for b in range(batch_size):
+                for j, c in enumerate(candidates[b].tolist()):
+                    prob = _prefix_prob(seq_probs[b], hyps[b][:i], c)
+                    if prob == 0:
+                        # the prefix is longer than the utterance
+                        self.assertLess(log_psi[b, j].item(), -1e5)
+                    else:
+                        self.assertAlmostEqual(
+                            log_psi[b, j].item(), np.log(prob), places=4)
+
+            tokens = torch.LongTensor([hyp[i] for hyp in hyps])
+            state = scorer.select(state, log_psi, r_new,
+                                  parent=torch.arange(batch_size),
+                                  candidate_index=tokens, tokens=tokens)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -239,6 +239,17 @@ class TestHierarchicalAttention(unittest.TestCase):
                     task_index=1)
                 # TODO: fix beam search
 
+                # Decode both tasks with a single pass of the encoder
+                best_hyps_mt, _, best_hyps_sub_mt, _, _ = model.decode_multi_task(
+                    xs, x_lens,
+                    beam_width=1,
+                    max_decode_len=30,
+                    beam_width_sub=1,
+                    max_decode_len_sub=60)
+                self.assertEqual(list(best_hyps_mt[0]), list(best_hyps[0]))
+                self.assertEqual(list(best_hyps_sub_mt[0]),
+                                 list(best_hyps_sub[0]))
+
                 str_hyp = idx2word(best_hyps[0][:-1])
                 str_ref = idx2word(ys[0])
                 str_hyp_sub = idx2char(best_hyps_sub[0][:-1])
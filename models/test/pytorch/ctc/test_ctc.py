@@ -61,6 +61,10 @@ class TestCTC(unittest.TestCase):
         self.check(encoder_type='lstm', bidirectional=True,
                    label_type='word')
 
+        # Mixed precision training
+        self.check(encoder_type='lstm', bidirectional=True,
+                   mixed_precision=True)
+
         # RNNs
         self.check(encoder_type='lstm', bidirectional=True)
         self.check(encoder_type='lstm', bidirectional=False)
@@ -72,7 +76,7 @@ class TestCTC(unittest.TestCase):
               subsample=False,  projection=False,
               conv=False, batch_norm=False, activation='relu',
               encoder_residual=False, encoder_dense_residual=False,
-              label_smoothing=False):
+              label_smoothing=False, mixed_precision=False):
 
         print('==================================================')
         print('  label_type: %s' % label_type)
@@ -86,6 +90,7 @@ class TestCTC(unittest.TestCase):
         print('  encoder_residual: %s' % str(encoder_residual))
         print('  encoder_dense_residual: %s' % str(encoder_dense_residual))
         print('  label_smoothing: %s' % str(label_smoothing))
+        print('  mixed_precision: %s' % str(mixed_precision))
         print('==================================================')
 
         if conv or encoder_type == 'cnn':
@@ -181,6 +186,8 @@ class TestCTC(unittest.TestCase):
 
         # GPU setting
         model.set_cuda(deterministic=False, benchmark=True)
+        if mixed_precision:
+            model.set_mixed_precision()
 
         # Train model
         max_step = 300
@@ -190,9 +197,16 @@ class TestCTC(unittest.TestCase):
             # Step for parameter update
             model.optimizer.zero_grad()
             loss = model(xs, ys, x_lens, y_lens)
-            loss.backward()
-            torch.nn.utils.clip_grad_norm_(model.parameters(), 5)
-            model.optimizer.step()
+            if mixed_precision:
+                model.scaler.scale(loss).backward()
+                model.scaler.unscale_(model.optimizer)
+                torch.nn.utils.clip_grad_norm_(model.parameters(), 5)
+                model.scaler.step(model.optimizer)
+                model.scaler.update()
+            else:
+                loss.backward()
+                torch.nn.utils.clip_grad_norm_(model.parameters(), 5)
+                model.optimizer.step()
 
             # Inject Gaussian noise to all parameters
             if loss.item() < 50:
@@ -0,0 +1,220 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test CTC decoders (numpy)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+from itertools import groupby
+
+sys.path.append('../../../../')
+from models.pytorch.ctc.decoders.beam_search_decoder import BeamSearchDecoder
+from models.pytorch.ctc.decoders.greedy_decoder import GreedyDecoder
+from models.pytorch.ctc.decoders.prefix_beam_search import PrefixBeamSearchDecoder
+from models.pytorch.ctc.decoders.ngram_lm import NgramLM
+from models.pytorch.ctc.decoders.parallel_decoder import ParallelDecoder
+from utils.measure_time_func import measure_time
+
+ARPA = """\\data\\
+ngram 1=5
+ngram 2=3
+
+\\1-grams:
+-99\t<s>\t-0.3
+-0.5\t</s>
+-0.7\ta\t-0.2
+-0.9\tb\t-0.1
+-1.5\t<unk>
+
+\\2-grams:
+-0.2\t<s> a
+-0.3\ta b
+-0.1\tb </s>
+
+\\end\\
+"""
+
+
+class TestCTCDecoders(unittest.TestCase):
+
+    def test(self):
+        print("CTC decoders Working check.")
+
+        self.check(beam_width=1)
+        self.check(beam_width=5)
+        self.check(beam_width=20)
+
+        # The beam is wider than the candidates
+        self.check(beam_width=10, num_classes=3)
+        self.check(beam_width=20, num_classes=4)
+
+        # Pruning
+        self.check(beam_width=20, cutoff_top_n=10, exact=False)
+        self.check(beam_width=20, cutoff_prob=0.99, exact=False)
+        self.check(beam_width=20, blank_threshold=0.999, exact=False)
+
+    @measure_time
+    def check(self, beam_width, cutoff_top_n=0, cutoff_prob=1.0,
+              blank_threshold=None, exact=True, num_classes=30):
+
+        print('==================================================')
+        print('  beam_width: %d' % beam_width)
+        print('  num_classes: %d' % num_classes)
+        print('  cutoff_top_n: %d' % cutoff_top_n)
+        print('  cutoff_prob: %.3f' % cutoff_prob)
+        print('  blank_threshold: %s' % str(blank_threshold))
+        print('==================================================')
+
+        np.random.seed(1623)
+        batch_size, max_time = 4, 50
+        logits = np.random.randn(batch_size, max_time, num_classes) * 3
+        logits[:, :, 0] += 2  # blank
+        log_probs = logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+        x_lens = np.array([max_time, max_time - 5, max_time - 20, 1])
+
+        decode_ref = BeamSearchDecoder(blank_index=0)
+        decode = PrefixBeamSearchDecoder(blank_index=0,
+                                         cutoff_top_n=cutoff_top_n,
+                                         cutoff_prob=cutoff_prob,
+                                         blank_threshold=blank_threshold)
+
+        best_hyps_ref = decode_ref(log_probs, x_lens, beam_width=beam_width)
+        best_hyps = decode(log_probs, x_lens, beam_width=beam_width)
+
+        for b in range(batch_size):
+            print('ref: %s' % str(list(best_hyps_ref[b])))
+            print('hyp: %s' % str(list(best_hyps[b])))
+            if exact:
+                self.assertEqual(list(best_hyps_ref[b]), list(best_hyps[b]))
+            self.assertTrue(all(c != 0 for c in best_hyps[b]))
+
+    def test_parallel(self):
+        print("Parallel decoder Working check.")
+
+        np.random.seed(1623)
+        batch_size, max_time, num_classes = 8, 50, 30
+        logits = np.random.randn(batch_size, max_time, num_classes) * 3
+        log_probs = logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+        x_lens = np.random.randint(1, max_time + 1, size=batch_size)
+
+        decode = PrefixBeamSearchDecoder(blank_index=0)
+        decode_parallel = ParallelDecoder(decode, num_workers=2)
+        try:
+            best_hyps_ref = decode(log_probs, x_lens, beam_width=5)
+            best_hyps = decode_parallel(log_probs, x_lens, beam_width=5)
+        finally:
+            decode_parallel.close()
+
+        # Results are in the original order
+        for b in range(batch_size):
+            self.assertEqual(list(best_hyps_ref[b]), list(best_hyps[b]))
+
+    def test_greedy(self):
+        print("Greedy decoder Working check.")
+
+        np.random.seed(1623)
+        batch_size, max_time, num_classes = 4, 50, 5
+        logits = np.random.randn(batch_size, max_time, num_classes)
+        x_lens = np.array([max_time, max_time - 5, max_time - 20, 1])
+
+        decode = GreedyDecoder(blank_index=0)
+        labels, y_lens, frames = decode.decode_flat(
+            logits, x_lens, return_frames=True)
+        best_hyps = decode(logits, x_lens)
+        self.assertEqual(len(labels), y_lens.sum())
+        self.assertEqual(len(frames), y_lens.sum())
+
+        offset = 0
+        for b in range(batch_size):
+            # Reference: collapse repeats, then remove blanks
+            best_path = np.argmax(logits[b, :x_lens[b]], axis=-1)
+            best_hyp_ref = [c for c, _ in groupby(best_path) if c != 0]
+            self.assertEqual(best_hyp_ref, list(best_hyps[b]))
+            self.assertEqual(
+                best_hyp_ref, list(labels[offset:offset + y_lens[b]]))
+
+            # The label is emitted at the frame where it starts
+            for c, t in zip(labels[offset:offset + y_lens[b]],
+                            frames[offset:offset + y_lens[b]]):
+                self.assertEqual(best_path[t], c)
+                self.assertTrue(t == 0 or best_path[t - 1] != c)
+            offset += y_lens[b]
+
+        # The best path is also accepted
+        best_hyps_path = decode(np.argmax(logits, axis=-1), x_lens)
+        for b in range(batch_size):
+            self.assertEqual(list(best_hyps[b]), list(best_hyps_path[b]))
+
+    def test_ngram_lm(self):
+        print("N-gram LM Working check.")
+
+        with tempfile.NamedTemporaryFile('w', suffix='.arpa', delete=False) as f:
+            f.write(ARPA)
+        try:
+            lm = NgramLM(f.name)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(lm.order, 2)
+
+        # Seen bigram
+        logprob, state = lm.score(lm.start(), 'a')
+        self.assertAlmostEqual(logprob, -0.2 * np.log(10), places=5)
+        # Back-off: bw(a) + p(a)
+        logprob, _ = lm.score(state, 'a')
+        self.assertAlmostEqual(logprob, (-0.2 - 0.7) * np.log(10), places=5)
+        # Unknown word
+        logprob, _ = lm.score(state, 'c')
+        self.assertAlmostEqual(logprob, (-0.2 - 1.5) * np.log(10), places=5)
+
+        # Scores of all words at once are the same as those of each word
+        words = ['a', 'b', 'c', '<unk>', None]
+        for state in [lm.start(), lm.score(lm.start(), 'a')[1], ()]:
+            logprobs = lm.score_all(state, lm.word_ids(words))
+            for w, logprob in zip(words[:-1], logprobs):
+                self.assertAlmostEqual(logprob, lm.score(state, w)[0], places=5)
+
+        # The cache is bounded
+        lm.clear_cache()
+        lm.max_cache_size = 2
+        for w in words[:-1]:
+            lm.score(lm.start(), w)
+        self.assertTrue(len(lm._cache) <= 2)
+        lm.max_cache_size = 1000000
+
+        # Shallow fusion (character-level)
+        np.random.seed(1623)
+        logits = np.random.randn(2, 30, 4)
+        log_probs = logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))
+        decode = PrefixBeamSearchDecoder(
+            blank_index=0, space_index=3, lm=lm, vocab=[None, 'a', 'b', ' '])
+        best_hyps = decode(log_probs, np.array([30, 20]), beam_width=5,
+                           alpha=0.5, beta=1.0)
+        self.assertEqual(len(best_hyps), 2)
+
+        # The acoustic model prefers "b", but the LM prefers "a"
+        log_probs_ab = np.log(np.array([[[0.1, 0.4, 0.45, 0.05]]]))
+        self.assertEqual(list(decode(log_probs_ab, np.array([1]),
+                                     beam_width=5, alpha=0.)[0]), [2])
+        self.assertEqual(list(decode(log_probs_ab, np.array([1]),
+                                     beam_width=5, alpha=1.)[0]), [1])
+
+        # Shallow fusion (word-level)
+        decode.set_lm(lm, [None, 'a', 'b', '<unk>'], space_index=-1)
+        best_hyps = decode(log_probs, np.array([30, 20]), beam_width=5,
+                           alpha=0.5, beta=1.0)
+        self.assertEqual(len(best_hyps), 2)
+        self.assertEqual(list(decode(log_probs_ab, np.array([1]),
+                                     beam_width=5, alpha=0.)[0]), [2])
+        self.assertEqual(list(decode(log_probs_ab, np.array([1]),
+                                     beam_width=5, alpha=1.)[0]), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -193,6 +193,16 @@ class TestCTC(unittest.TestCase):
                 best_hyps_sub, _, _ = model.decode(
                     xs, x_lens, beam_width=2, task_index=1)
 
+                # Decode both tasks with a single pass of the encoder
+                best_hyps_mt, probs, best_hyps_sub_mt, probs_sub, _ = model.decode_multi_task(
+                    xs, x_lens, beam_width=2, beam_width_sub=2,
+                    return_probs=True)
+                self.assertEqual(list(best_hyps_mt[0]), list(best_hyps[0]))
+                self.assertEqual(list(best_hyps_sub_mt[0]),
+                                 list(best_hyps_sub[0]))
+                self.assertEqual(len(probs), len(xs))
+                self.assertEqual(len(probs_sub), len(xs))
+
                 str_ref = idx2word(ys[0, :y_lens[0]])
                 str_hyp = idx2word(best_hyps[0])
                 str_ref_sub = idx2char(ys_sub[0, :y_lens_sub[0]])
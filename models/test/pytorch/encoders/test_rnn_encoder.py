@@ -24,6 +24,14 @@ class TestRNNEncoders(unittest.TestCase):
     def test(self):
         print("RNN Encoders Working check.")
 
+        # Activation checkpointing
+        self.check(encoder_type='lstm', bidirectional=True,
+                   checkpoint=True)
+        self.check(encoder_type='lstm', bidirectional=True,
+                   residual=True, checkpoint=True)
+        self.check(encoder_type='lstm', bidirectional=True,
+                   conv=True, checkpoint=True)
+
         # Projection layer
         self.check(encoder_type='lstm', bidirectional=False,
                    projection=True)
@@ -85,7 +93,8 @@ class TestRNNEncoders(unittest.TestCase):
     @measure_time
     def check(self, encoder_type, bidirectional=False, batch_first=True,
               conv=False, merge_bidirectional=False,
-              projection=False, residual=False, dense_residual=False):
+              projection=False, residual=False, dense_residual=False,
+              checkpoint=False):
 
         print('==================================================')
         print('  encoder_type: %s' % encoder_type)
@@ -96,6 +105,7 @@ class TestRNNEncoders(unittest.TestCase):
         print('  projection: %s' % str(projection))
         print('  residual: %s' % str(residual))
         print('  dense_residual: %s' % str(dense_residual))
+        print('  checkpoint: %s' % str(checkpoint))
         print('==================================================')
 
         if conv:
@@ -154,7 +164,9 @@ class TestRNNEncoders(unittest.TestCase):
             residual=residual,
             dense_residual=dense_residual,
             # nin=32
-            nin=0
+            nin=0,
+            checkpoint_layers=[0, 2, 4] if checkpoint else [],
+            checkpoint_conv=checkpoint
         )
 
         max_time = xs.size(1)
@@ -175,6 +187,12 @@ class TestRNNEncoders(unittest.TestCase):
                 (max_time, batch_size, encoder.num_units * num_directions),
                 outputs.size())
 
+        if checkpoint:
+            # Gradients must reach all layers through recomputation
+            outputs.sum().backward()
+            for name, param in encoder.named_parameters():
+                self.assertIsNotNone(param.grad, name)
+
 
 if __name__ == '__main__':
     unittest.main()
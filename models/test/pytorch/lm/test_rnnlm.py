@@ -56,8 +56,7 @@ class TestRNNLM(unittest.TestCase):
         print('==================================================')
 
         # Load batch data
-        _, ys, _, y_lens = generate_data(model_type='lm',
-                                         label_type=label_type,
+        _, ys, _, y_lens = generate_data(label_type=label_type,
                                          batch_size=2)
 
         if label_type == 'char':
@@ -73,14 +72,14 @@ class TestRNNLM(unittest.TestCase):
             embedding_dim=128,
             rnn_type=rnn_type,
             bidirectional=bidirectional,
-            num_units=1024,
+            num_units=128 if tie_weights else 1024,
             num_layers=1,
             dropout_embedding=0.1,
             dropout_hidden=0.1,
             dropout_output=0.1,
             parameter_init_distribution='uniform',
             parameter_init=0.1,
-            tie_weights=False)
+            tie_weights=tie_weights)
 
         # Count total parameters
         for name in sorted(list(model.num_params_dict.keys())):
@@ -117,11 +116,11 @@ class TestRNNLM(unittest.TestCase):
             model.optimizer.zero_grad()
             loss = model(ys, y_lens)
             loss.backward()
-            nn.utils.clip_grad_norm(model.parameters(), 5)
+            nn.utils.clip_grad_norm_(model.parameters(), 5)
             model.optimizer.step()
 
             # Inject Gaussian noise to all parameters
-            if loss.data[0] < 50:
+            if loss.item() < 50:
                 model.weight_noise_injection = True
 
             if (step + 1) % 10 == 0:
@@ -172,6 +171,19 @@ class TestRNNLM(unittest.TestCase):
                     epoch=step,
                     value=ppl)
 
+        # Step-wise prediction for shallow fusion
+        model.eval()
+        with torch.no_grad():
+            y = torch.full((2, 1), model.sos, dtype=torch.long,
+                           device=model.device)
+            log_probs, state = model.predict(y)
+            self.assertEqual(log_probs.size(), (2, model.num_classes))
+            state = model.reorder_state(
+                state, torch.tensor([1, 1], device=model.device))
+            log_probs, _ = model.predict(log_probs.argmax(-1, keepdim=True),
+                                         state)
+            self.assertEqual(log_probs.size(), (2, model.num_classes))
+
 
 if __name__ == "__main__":
     unittest.main()
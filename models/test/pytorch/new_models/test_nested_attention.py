@@ -205,6 +205,15 @@ class TestCharseqAttention(unittest.TestCase):
                     xs, x_lens, beam_width=1,
                     max_decode_len=30,
                     max_decode_len_sub=60)
+                best_hyps_beam, aw_beam, best_hyps_sub_beam, aw_sub_beam, _ = model.decode(
+                    xs, x_lens, beam_width=2,
+                    beam_width_sub=2,
+                    max_decode_len=30,
+                    max_decode_len_sub=60)
+                self.assertEqual(len(best_hyps_beam), len(xs))
+                self.assertEqual(len(aw_beam[0]), len(best_hyps_beam[0]))
+                self.assertEqual(len(aw_sub_beam[0]),
+                                 len(best_hyps_sub_beam[0]))
 
                 str_hyp = idx2word(best_hyps[0][:-1])
                 str_ref = idx2word(ys[0])
@@ -260,6 +269,56 @@ class TestCharseqAttention(unittest.TestCase):
                     epoch=step,
                     value=wer)
 
+        if not second_pass:
+            self.check_dec_out_sub(model, xs, ys, x_lens, y_lens,
+                                   ys_sub, y_lens_sub)
+
+    def check_dec_out_sub(self, model, xs, ys, x_lens, y_lens,
+                          ys_sub, y_lens_sub):
+        """Decoder outputs of the character model which the word model
+            attends to must be the same in training and in teacher-forced
+            inference."""
+        captured = {}
+        decode_train = model._decode_train
+        reset = model.attend_dec_sub.reset
+
+        def _decode_train(enc_out, x_lens, ys_in,
+                          enc_out_sub, x_lens_sub, ys_in_sub, y_lens_sub):
+            captured['inputs'] = (enc_out_sub, x_lens_sub,
+                                  ys_in_sub, y_lens_sub)
+            return decode_train(enc_out, x_lens, ys_in,
+                                enc_out_sub, x_lens_sub, ys_in_sub, y_lens_sub)
+
+        def _reset(dec_out_sub, y_lens_sub):
+            captured['dec_out_sub'] = (dec_out_sub, y_lens_sub)
+            return reset(dec_out_sub, y_lens_sub)
+
+        # NOTE: disable scheduled sampling
+        ss_prob = model._ss_prob
+        model._ss_prob = 0
+        model._decode_train = _decode_train
+        model.attend_dec_sub.reset = _reset
+        try:
+            model(xs, ys, x_lens, y_lens, ys_sub, y_lens_sub, is_eval=True)
+        finally:
+            del model._decode_train
+            del model.attend_dec_sub.reset
+            model._ss_prob = ss_prob
+
+        enc_out_sub, x_lens_sub, ys_in_sub, y_lens_sub = captured['inputs']
+        dec_out_train, y_lens_train = captured['dec_out_sub']
+        with torch.no_grad():
+            best_hyps_sub, _, dec_out_sub = model._decode_forced_sub(
+                enc_out_sub, x_lens_sub, ys_in_sub, y_lens_sub,
+                dir='bwd' if model.backward_1 else 'fwd')
+            dec_out_sub = model._select_dec_out_sub(dec_out_sub, best_hyps_sub)
+
+        for b in range(len(dec_out_sub)):
+            y_len = int(y_lens_train[b])
+            self.assertEqual(dec_out_sub[b].size(0), y_len)
+            self.assertTrue(torch.allclose(
+                dec_out_sub[b], dec_out_train[b, :y_len], atol=1e-5))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -28,6 +28,15 @@ class Base(object):
         # for multiprocessing
         self._epoch = 0
 
+        # for data-parallel training
+        self.rank = 0
+        self.world_size = 1
+
+        # NOTE: mini-batches are sampled with a random generator of their
+        # own, so that the global random used elsewhere (e.g. scheduled
+        # sampling) does not change which utterances are drawn
+        self._random = random.Random()
+
         # Setting for multiprocessing
         self.preloading_process = None
         self.queue = Queue()
@@ -186,20 +195,64 @@ class Base(object):
         else:
             # Randomly sample uttrances
             if len(self.rest) > batch_size:
-                data_indices = random.sample(list(self.rest), batch_size)
+                # NOTE: sorted so that the population does not depend on
+                # the order of the set
+                data_indices = self._random.sample(
+                    sorted(self.rest), batch_size)
                 self.rest -= set(data_indices)
             else:
                 # Last mini-batch
-                data_indices = list(self.rest)
+                data_indices = sorted(self.rest)
                 self._reset()
                 is_new_epoch = True
                 self._epoch += 1
 
                 # Shuffle selected mini-batch
-                random.shuffle(data_indices)
+                self._random.shuffle(data_indices)
+
+        # Take the shard of this process
+        if self.world_size > 1:
+            data_indices = self._shard(data_indices)
 
         return data_indices, is_new_epoch
 
+    def set_rank(self, rank, world_size, shard_dataset=False, seed=1623):
+        """Set the rank for data-parallel training.
+        Args:
+            rank (int): the rank of this process
+            world_size (int): the number of processes
+            shard_dataset (bool, optional): if True, utterances are divided
+                among processes in advance (for evaluation). Otherwise, each
+                mini-batch is divided (for training), which keeps the global
+                mini-batch the same as in a single process.
+            seed (int, optional): the random seed for sampling mini-batches,
+                which must be the same in all processes
+        """
+        if shard_dataset:
+            self.df = self.df.iloc[rank::world_size]
+            self._reset()
+        else:
+            self.rank = rank
+            self.world_size = world_size
+            # NOTE: all processes sample the same global mini-batches and
+            # take their own shards
+            self._random.seed(seed)
+
+    def _shard(self, data_indices):
+        """Divide a mini-batch among processes.
+        Args:
+            data_indices (list):
+        Returns:
+            data_indices (list):
+        """
+        data_indices_shard = data_indices[self.rank::self.world_size]
+        if len(data_indices_shard) == 0:
+            # NOTE: every process needs at least one utterance to keep
+            # gradient synchronization in step
+            data_indices_shard = [
+                data_indices[self.rank % len(data_indices)]]
+        return data_indices_shard
+
     def select_batch_size(self, batch_size, min_frame_num_batch):
         raise NotImplementedError
 
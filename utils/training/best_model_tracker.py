@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Keep track of the best model during training."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+from os.path import isfile
+import logging
+logger = logging.getLogger('training')
+
+import torch
+
+
+class BestModelTracker(object):
+    """Keep the parameters of the best model without copying the whole
+        model on the device. In pytorch, only a CPU snapshot of the
+        state_dict (or the path to the saved checkpoint) is kept, and it is
+        loaded into a model when needed.
+    Args:
+        backend (string, optional): pytorch or chainer. In chainer, the model
+            is copied as before.
+        dtype (torch.dtype, optional): the dtype of floating point tensors in
+            the snapshot. torch.float16 halves host memory.
+        keep_in_memory (bool, optional): if False, only the path to the
+            checkpoint is kept when it is given
+    """
+
+    def __init__(self, backend='pytorch', dtype=None, keep_in_memory=True):
+        self.backend = backend
+        self.dtype = dtype
+        self.keep_in_memory = keep_in_memory
+
+        self.state_dict = None
+        self.model_path = None
+        self.model = None
+
+    @property
+    def is_empty(self):
+        return self.state_dict is None and self.model_path is None and self.model is None
+
+    def update(self, model, model_path=None):
+        """Take a snapshot of the current model.
+        Args:
+            model (torch.nn.Module or chainer.Chain):
+            model_path (string, optional): path to the checkpoint of the
+                current model (file)
+        """
+        if self.backend == 'chainer':
+            self.model = copy.deepcopy(model)
+            return
+
+        if model_path is not None and not self.keep_in_memory:
+            self.state_dict = None
+            self.model_path = model_path
+            return
+
+        state_dict = {}
+        for k, v in model.state_dict().items():
+            v = v.detach()
+            if self.dtype is not None and v.is_floating_point():
+                v = v.to('cpu', dtype=self.dtype, copy=True)
+            else:
+                v = v.to('cpu', copy=True)
+            state_dict[k] = v
+        self.state_dict = state_dict
+        self.model_path = None
+
+    def restore(self, model):
+        """Load the parameters of the best model into a model.
+        Args:
+            model (torch.nn.Module or chainer.Chain):
+        Returns:
+            model (torch.nn.Module or chainer.Chain): the best model
+        """
+        if self.is_empty:
+            logger.warning('The best model is not found, use the current model.')
+            return model
+
+        if self.backend == 'chainer':
+            return self.model
+
+        if self.state_dict is not None:
+            state_dict = self.state_dict
+        elif not isfile(self.model_path):
+            # NOTE: the checkpoint has been removed by the retention policy
+            logger.warning('The best checkpoint is not found: %s, use the current model.' %
+                           self.model_path)
+            return model
+        else:
+            state_dict = torch.load(
+                self.model_path,
+                map_location=lambda storage, loc: storage)['state_dict']
+        # NOTE: tensors are cast to the dtype and device of the model
+        model.load_state_dict(state_dict)
+        return model
@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Background checkpoint writer with a retention policy."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, basename, dirname, isfile
+import threading
+import time
+import logging
+logger = logging.getLogger('training')
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import torch
+
+
+def save_atomic(checkpoint, model_path):
+    """Save a checkpoint to a temporary file and rename it, so that a
+        checkpoint file is never left half-written (pytorch).
+    Args:
+        checkpoint (dict):
+        model_path (string): path to the checkpoint (file)
+    """
+    tmp_path = join(dirname(model_path), '.tmp.' + basename(model_path))
+    torch.save(checkpoint, tmp_path)
+    os.rename(tmp_path, model_path)
+
+
+def _to_cpu(obj):
+    """Copy all tensors in nested dicts and lists to the CPU."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    elif isinstance(obj, dict):
+        return type(obj)((k, _to_cpu(v)) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+class Checkpointer(object):
+    """Save checkpoints without stalling training. The state is copied to
+        the CPU in the training loop and written by a background thread.
+        Checkpoints which are neither in the last N nor in the best K are
+        removed.
+    Args:
+        save_path (string): path to save checkpoints (directory)
+        backend (string, optional): pytorch or chainer. Checkpoints are
+            saved synchronously in chainer.
+        keep_last (int, optional): the number of latest checkpoints to keep
+            for each of epoch and step-based checkpoints. 0 means the number
+            is not limited by recency.
+        keep_best (int, optional): the number of best checkpoints to keep.
+            0 means the number is not limited by the metric. If only this is
+            set, the latest checkpoint of each kind is also kept for resuming
+            training.
+            All checkpoints are kept if both are 0.
+        lower_better (bool, optional): if True, the lower the metric is,
+            the better the checkpoint is
+        interval (float, optional): the interval of step-based checkpoints
+            in seconds. 0 means step-based checkpoints are not saved.
+        rank (int, optional): the rank of this process in data-parallel
+            training. Checkpoints are saved only by rank 0.
+    """
+
+    def __init__(self, save_path, backend='pytorch', keep_last=0, keep_best=0,
+                 lower_better=True, interval=0, rank=0):
+        self.save_path = save_path
+        self.rank = rank
+        self.backend = backend
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.lower_better = lower_better
+        self.interval = interval
+
+        # list of tuples of (path, metric)
+        self._saved = []
+        # metrics given after saving
+        self._metrics = {}
+        self._last_time = time.time()
+        self._error = None
+
+        if backend == 'pytorch':
+            # NOTE: at most one checkpoint is waiting to be written in order
+            # to bound host memory
+            self._queue = queue.Queue(maxsize=1)
+            self._thread = threading.Thread(target=self._write_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def save(self, model, epoch, step, lr, metric_dev_best, metric=None):
+        """Save a checkpoint per epoch.
+        Args:
+            model (torch.nn.Module or chainer.Chain):
+            epoch (int): the currnet epoch
+            step (int): the current step
+            lr (float):
+            metric_dev_best (float):
+            metric (float, optional): the metric of this checkpoint, which is
+                used to keep the best checkpoints
+        """
+        model_path = join(self.save_path, 'model.epoch-' + str(epoch))
+        self._save(model, model_path, epoch, step, lr, metric_dev_best, metric)
+
+    def save_step(self, model, epoch, step, lr, metric_dev_best):
+        """Save a checkpoint if the interval has passed since the last one
+            (pytorch only).
+        Args:
+            model (torch.nn.Module):
+            epoch (int): the currnet epoch
+            step (int): the current step
+            lr (float):
+            metric_dev_best (float):
+        """
+        if self.interval <= 0 or self.backend != 'pytorch':
+            return
+        if time.time() - self._last_time < self.interval:
+            return
+        model_path = join(self.save_path, 'model.step-' + str(step))
+        self._save(model, model_path, epoch, step, lr, metric_dev_best, None)
+
+    def _save(self, model, model_path, epoch, step, lr, metric_dev_best, metric):
+        if self.rank != 0:
+            return
+        self._raise_error()
+        self._last_time = time.time()
+
+        if self.backend == 'pytorch':
+            checkpoint = _to_cpu(model.get_checkpoint(
+                epoch, step, lr, metric_dev_best))
+            # NOTE: this blocks if the previous checkpoint is being written
+            self._queue.put((checkpoint, model_path, metric))
+        elif self.backend == 'chainer':
+            model.save_checkpoint(self.save_path, epoch, step, lr,
+                                  metric_dev_best)
+            self._saved.append((model_path + '.npz', metric))
+            self._remove_old_checkpoints()
+
+    def update_metric(self, epoch, metric):
+        """Set the metric of a checkpoint saved without it (e.g. evaluated
+            by another process).
+        Args:
+            epoch (int):
+            metric (float):
+        """
+        model_path = join(self.save_path, 'model.epoch-' + str(epoch))
+        if self.backend == 'chainer':
+            model_path += '.npz'
+        self._metrics[model_path] = metric
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    break
+                checkpoint, model_path, metric = item
+                save_atomic(checkpoint, model_path)
+                logger.info("=> Saved checkpoint (epoch:%d, step:%d): %s" %
+                            (checkpoint['epoch'], checkpoint['step'], model_path))
+                self._saved.append((model_path, metric))
+                self._remove_old_checkpoints()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _remove_old_checkpoints(self):
+        if self.keep_last <= 0 and self.keep_best <= 0:
+            return
+        # NOTE: the recency is counted for each kind of checkpoints, so that
+        # frequent step-based checkpoints do not evict epoch checkpoints.
+        # The latest epoch checkpoint is always kept to resume training.
+        keep = set()
+        for prefix in ['model.epoch-', 'model.step-']:
+            paths = [path for path, _ in self._saved
+                     if basename(path).startswith(prefix)]
+            keep |= set(paths[-max(self.keep_last, 1):])
+        with_metric = [(path, metric if metric is not None else self._metrics.get(path))
+                       for path, metric in self._saved]
+        with_metric = [(path, metric) for path, metric in with_metric
+                       if metric is not None]
+        with_metric = sorted(with_metric, key=lambda x: x[1],
+                             reverse=not self.lower_better)
+        keep |= set(path for path, _ in with_metric[:self.keep_best])
+
+        saved = []
+        for path, metric in self._saved:
+            if path in keep:
+                saved.append((path, metric))
+            elif isfile(path):
+                os.remove(path)
+        self._saved = saved
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait(self):
+        """Block until all pending checkpoints are written."""
+        if self.backend == 'pytorch':
+            self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Write all pending checkpoints and stop the background thread."""
+        if self.backend == 'pytorch':
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
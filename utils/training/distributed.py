@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Utilities for multi-process data-parallel training (pytorch).
+    Processes are launched by torchrun (or torch.distributed.launch), which
+    sets RANK, WORLD_SIZE, LOCAL_RANK, MASTER_ADDR and MASTER_PORT.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend='gloo'):
+    """Initialize the process group if launched with several processes.
+        Mini-batches are sampled identically in all processes by the random
+        generator of each dataset (see Base.set_rank).
+    Args:
+        backend (string, optional): gloo or nccl. gloo works on CPUs as well.
+    Returns:
+        rank (int): the rank of this process
+        world_size (int): the number of processes
+    """
+    if 'WORLD_SIZE' not in os.environ or int(os.environ['WORLD_SIZE']) <= 1:
+        return 0, 1
+
+    rank = int(os.environ['RANK'])
+    world_size = int(os.environ['WORLD_SIZE'])
+    if torch.cuda.is_available():
+        # NOTE: one GPU per process
+        torch.cuda.set_device(int(os.environ['LOCAL_RANK']))
+    dist.init_process_group(backend=backend, init_method='env://',
+                            rank=rank, world_size=world_size)
+
+    return rank, world_size
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def broadcast_model(model, src=0):
+    """Copy parameters and buffers of a process to all processes, so that
+        all processes start from the same model.
+    Args:
+        model (torch.nn.Module):
+        src (int, optional): the rank of the sender
+    """
+    if not is_distributed():
+        return
+    for p in model.parameters():
+        dist.broadcast(p.data, src=src)
+    for b in model.buffers():
+        dist.broadcast(b, src=src)
+
+
+def all_reduce_mean(value):
+    """Average a value over all processes.
+    Args:
+        value (float):
+    Returns:
+        value (float):
+    """
+    if not is_distributed():
+        return value
+    tensor = torch.tensor([float(value)], dtype=torch.float64)
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.item() / dist.get_world_size()
+
+
+def all_reduce_sum(values):
+    """Sum values over all processes.
+    Args:
+        values (list): list of float values
+    Returns:
+        values (list): list of float values
+    """
+    if not is_distributed():
+        return values
+    tensor = torch.tensor([float(v) for v in values], dtype=torch.float64)
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.tolist()
+
+
+def all_reduce_max(value):
+    """Take the maximum of a value over all processes.
+    Args:
+        value (int):
+    Returns:
+        value (int):
+    """
+    if not is_distributed():
+        return value
+    tensor = torch.tensor([int(value)], dtype=torch.int64)
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    dist.all_reduce(tensor, op=dist.ReduceOp.MAX)
+    return int(tensor.item())
+
+
+def all_reduce_grads(model):
+    """Average gradients over all processes with a single collective call.
+        Gradients are flattened into one buffer, where missing gradients
+        (parameters unused in this process) are filled with zeros, so that
+        all processes issue the same collective call however many backward
+        passes they ran.
+    Args:
+        model (torch.nn.Module):
+    """
+    if not is_distributed():
+        return
+    params = [p for p in model.parameters() if p.requires_grad]
+    if len(params) == 0:
+        return
+    # NOTE: the last elements count the processes which have each gradient
+    buffer = torch.cat(
+        [p.grad.data.view(-1) if p.grad is not None else
+         p.data.new_zeros(p.numel()) for p in params] +
+        [params[0].data.new_tensor([float(p.grad is not None) for p in params])])
+    dist.all_reduce(buffer, op=dist.ReduceOp.SUM)
+    buffer /= dist.get_world_size()
+
+    has_grad = buffer[-len(params):].tolist()
+    offset = 0
+    for p, has_grad_p in zip(params, has_grad):
+        grad = buffer[offset:offset + p.numel()].view_as(p.data)
+        offset += p.numel()
+        if has_grad_p == 0:
+            # NOTE: the parameter is not used in any process
+            continue
+        if p.grad is None:
+            p.grad = grad.clone()
+        else:
+            p.grad.data.copy_(grad)
+
+
+def broadcast_object(obj, src=0):
+    """Send a picklable object from a process to all processes.
+    Args:
+        obj (object): the object to send (only used in src)
+        src (int, optional): the rank of the sender
+    Returns:
+        obj (object):
+    """
+    if not is_distributed():
+        return obj
+    objs = [obj]
+    dist.broadcast_object_list(objs, src=src)
+    return objs[0]
@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Evaluate checkpoints out of the training process.
+    The worker watches the checkpoint directory, evaluates each new
+    checkpoint and appends the result to a file, which is read by the
+    training loop without blocking.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+from os.path import join, basename, isfile
+from glob import glob
+import json
+import time
+import logging
+logger = logging.getLogger('training')
+
+RESULT_FILE_NAME = 'eval_results.txt'
+
+
+def append_result(save_path, result):
+    """Append an evaluation result.
+    Args:
+        save_path (string): path to the saved models (directory)
+        result (dict):
+    """
+    with open(join(save_path, RESULT_FILE_NAME), 'a') as f:
+        # NOTE: one result per line, so that a half-written line is ignored
+        f.write(json.dumps(result, sort_keys=True) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_results(save_path):
+    """Load all evaluation results.
+    Args:
+        save_path (string): path to the saved models (directory)
+    Returns:
+        results (list): list of dicts
+    """
+    result_path = join(save_path, RESULT_FILE_NAME)
+    if not isfile(result_path):
+        return []
+    results = []
+    with open(result_path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            results.append(json.loads(line))
+    return results
+
+
+def watch_checkpoints(save_path, evaluate, poll_interval=60):
+    """Evaluate new checkpoints until training is finished.
+    Args:
+        save_path (string): path to the saved models (directory)
+        evaluate (function): takes an epoch and returns a dict of metrics
+        poll_interval (float, optional): the interval to look for new
+            checkpoints in seconds
+    """
+    done = set(result['epoch'] for result in load_results(save_path))
+    while True:
+        # NOTE: check the end of training before listing checkpoints so that
+        # the last checkpoint is not missed
+        is_complete = isfile(join(save_path, 'COMPLETE'))
+
+        epochs = sorted([int(basename(x).split('-')[-1])
+                         for x in glob(join(save_path, 'model.epoch-*'))])
+        epochs = [epoch for epoch in epochs if epoch not in done]
+        for epoch in epochs:
+            try:
+                result = evaluate(epoch)
+            except (IOError, OSError, ValueError):
+                # NOTE: the checkpoint has been removed by the retention policy
+                logger.warning('Skip checkpoint (epoch:%d)' % epoch)
+                done.add(epoch)
+                continue
+            result['epoch'] = epoch
+            append_result(save_path, result)
+            done.add(epoch)
+
+        if is_complete:
+            break
+        if len(epochs) == 0:
+            time.sleep(poll_interval)
+
+
+def stop_worker(process, save_path, timeout=600, grace_period=10):
+    """Stop the evaluation worker at the end of training. If training has
+        finished correctly, the worker evaluates the remaining checkpoints
+        and exits by itself. Otherwise (early stopping without the COMPLETE
+        file, an exception or an interruption), it is terminated.
+    Args:
+        process (subprocess.Popen): the worker
+        save_path (string): path to the saved models (directory)
+        timeout (float, optional): the time to wait for the worker to finish
+            the remaining checkpoints in seconds. None means no limit, which
+            blocks as long as the worker is stuck in a long evaluation.
+        grace_period (float, optional): the time to wait for the worker to
+            exit after it is terminated in seconds
+    """
+    if process.poll() is not None:
+        return
+    if isfile(join(save_path, 'COMPLETE')):
+        logger.info('Wait for the evaluation worker (PID: %d)' % process.pid)
+        if _wait(process, timeout):
+            return
+    logger.warning('Terminate the evaluation worker (PID: %d)' % process.pid)
+    process.terminate()
+    if not _wait(process, grace_period):
+        process.kill()
+        process.wait()
+
+
+def _wait(process, timeout):
+    start_time = time.time()
+    while process.poll() is None:
+        if timeout is not None and time.time() - start_time > timeout:
+            return False
+        time.sleep(1)
+    return True
+
+
+class EvalResultReader(object):
+    """Read results of the evaluation worker without blocking.
+    Args:
+        save_path (string): path to the saved models (directory)
+    """
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self._num_read = len(load_results(save_path))
+
+    def poll(self):
+        """Returns results which have not been read yet.
+        Returns:
+            results (list): list of dicts
+        """
+        results = load_results(self.save_path)[self._num_read:]
+        self._num_read += len(results)
+        return results
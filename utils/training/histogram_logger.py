@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Asynchronous logging of histograms of parameters and gradients (pytorch)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import logging
+import re
+import threading
+import time
+logger = logging.getLogger('training')
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class HistogramLogger(object):
+    """Log histograms of parameters and gradients to tensorboard.
+        Tensors are copied to the CPU in the training loop, and histograms
+        are computed and written in a background thread. Parameters are
+        visited in turn, a subset at a time.
+    Args:
+        tf_writer (SummaryWriter):
+        max_num_params (int, optional): the maximum number of parameters
+            to snapshot per call
+        min_interval (float, optional): the minimum interval between calls
+            in seconds
+        time_budget (float, optional): the maximum time to spend on
+            snapshotting tensors per call in seconds
+        patterns (list, optional): regular expressions of parameter names
+            to log. By default, all parameters are logged.
+        queue_size (int, optional): the maximum number of pending snapshots.
+            Snapshots are dropped when the queue is full.
+    """
+
+    def __init__(self, tf_writer, max_num_params=10, min_interval=60,
+                 time_budget=0.1, patterns=None, queue_size=2):
+        self.tf_writer = tf_writer
+        self.max_num_params = max_num_params
+        self.min_interval = min_interval
+        self.time_budget = time_budget
+        if patterns is None:
+            self.patterns = None
+        else:
+            self.patterns = [re.compile(p) for p in patterns]
+        self._last_time = None
+        self._offset = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _select(self, model):
+        named_params = [(name, param) for name, param in model.named_parameters()
+                        if self.patterns is None or any(p.search(name) for p in self.patterns)]
+        if len(named_params) == 0:
+            return []
+        # Round-robin over parameters
+        self._offset %= len(named_params)
+        named_params = named_params[self._offset:] + \
+            named_params[:self._offset]
+        return named_params[:self.max_num_params]
+
+    def log(self, model, step):
+        """Snapshot parameters and gradients, and enqueue them.
+        Args:
+            model (torch.nn.Module):
+            step (int):
+        """
+        now = time.time()
+        if self._last_time is not None and now - self._last_time < self.min_interval:
+            return
+        self._last_time = now
+
+        snapshots = []
+        for name, param in self._select(model):
+            if time.time() - now > self.time_budget:
+                break
+            name = name.replace('.', '/')
+            snapshots.append(
+                (name, param.detach().to('cpu', copy=True)))
+            if param.grad is not None:
+                snapshots.append(
+                    (name + '/grad', param.grad.detach().to('cpu', copy=True)))
+            self._offset += 1
+
+        try:
+            self._queue.put_nowait((step, snapshots))
+        except queue.Full:
+            logger.debug('Histogram logging is behind, drop step %d' % step)
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            step, snapshots = item
+            for name, tensor in snapshots:
+                self.tf_writer.add_histogram(
+                    name, tensor.float().numpy(), step)
+
+    def close(self):
+        """Write all pending histograms and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
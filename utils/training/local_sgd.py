@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Local SGD (periodic model averaging) for data-parallel training over a
+    slow interconnect (pytorch). Each process updates its own copy of the
+    model on its own data shard, and parameters are averaged over processes
+    every K steps, optionally with block momentum (BMUF).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+
+import torch
+import torch.distributed as dist
+
+from utils.training.distributed import is_distributed, broadcast_model
+
+
+class ModelAverager(object):
+    """Average parameters over processes periodically.
+    Args:
+        model (torch.nn.Module):
+        period (int, optional): the number of local steps between averaging
+        block_momentum (float, optional): the momentum of the global update.
+            0 means plain model averaging.
+        block_lr (float, optional): the learning rate of the global update
+        nesterov (bool, optional): if True, use Nesterov-style block momentum
+        patterns (list, optional): regular expressions of parameter names to
+            average. The other parameters stay local. None means all
+            parameters.
+    """
+
+    def __init__(self, model, period=1, block_momentum=0., block_lr=1.,
+                 nesterov=True, patterns=None):
+        self.period = period
+        self.block_momentum = block_momentum
+        self.block_lr = block_lr
+        self.nesterov = nesterov
+
+        if patterns is not None:
+            patterns = [re.compile(p) for p in patterns]
+        self.params = [p for name, p in model.named_parameters()
+                       if patterns is None or any(pattern.search(name) for pattern in patterns)]
+        self.num_steps = 0
+
+        # NOTE: all processes start from the same parameters
+        broadcast_model(model)
+
+        if block_momentum > 0:
+            # the global model and the momentum of the global update
+            self._global = [p.data.clone() for p in self.params]
+            self._delta = [torch.zeros_like(p.data) for p in self.params]
+
+    def step(self):
+        """Call after every local update. Parameters are averaged every
+            `period` steps.
+        Returns:
+            is_averaged (bool):
+        """
+        self.num_steps += 1
+        if self.num_steps % self.period != 0:
+            return False
+        self.average()
+        return True
+
+    def average(self):
+        """Average parameters over processes now."""
+        if not is_distributed() or len(self.params) == 0:
+            return
+        world_size = dist.get_world_size()
+
+        # NOTE: flatten parameters so that only one all-reduce is issued
+        with torch.no_grad():
+            flat = torch.cat([p.data.view(-1) for p in self.params])
+            dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+            flat /= world_size
+
+            offset = 0
+            for i, p in enumerate(self.params):
+                numel = p.numel()
+                p_avg = flat[offset:offset + numel].view_as(p)
+                offset += numel
+
+                if self.block_momentum > 0:
+                    # the global update (BMUF)
+                    self._delta[i].mul_(self.block_momentum).add_(
+                        self.block_lr * (p_avg - self._global[i]))
+                    self._global[i].add_(self._delta[i])
+                    if self.nesterov:
+                        p.data.copy_(self._global[i] +
+                                     self.block_momentum * self._delta[i])
+                    else:
+                        p.data.copy_(self._global[i])
+                else:
+                    p.data.copy_(p_avg)
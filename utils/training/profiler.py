@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Per-phase step profiler for training (pytorch only)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import defaultdict
+from contextlib import contextmanager
+import functools
+import logging
+import time
+logger = logging.getLogger('training')
+
+import torch
+
+# Methods of models to be timed, and the names of their phases
+MODEL_PHASES = [('np2tensor', 'h2d'),
+                ('_encode', 'encoder'),
+                ('_decode_train', 'decoder'),
+                ('compute_ctc_loss', 'ctc_loss')]
+
+
+class StepProfiler(object):
+    """Measure time spent in each phase of training steps.
+    Args:
+        use_cuda (bool): if True, synchronize the GPU at phase boundaries
+            so that asynchronous kernels are charged to the right phase
+        num_stack (int): the number of frames to stack
+    """
+
+    def __init__(self, use_cuda, num_stack=1):
+        self.use_cuda = use_cuda
+        self.num_stack = num_stack
+        self.recording = False
+        self._reset()
+
+    def _reset(self):
+        self.phase_time = defaultdict(float)
+        self.num_steps = 0
+        self.num_utt = 0
+        self.num_frames = 0
+        self.num_padded_frames = 0
+        self.step_time = 0.
+        if self.use_cuda:
+            torch.cuda.reset_peak_memory_stats()
+
+    def _synchronize(self):
+        if self.use_cuda:
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase. Nested phases are counted in both phases.
+        Args:
+            name (string): the name of the phase
+        """
+        if not self.recording:
+            yield
+            return
+        self._synchronize()
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._synchronize()
+            self.phase_time[name] += time.time() - start
+
+    @contextmanager
+    def step(self, batch):
+        """Record a training step.
+        Args:
+            batch (dict):
+        """
+        self._synchronize()
+        start = time.time()
+        self.recording = True
+        try:
+            yield
+        finally:
+            self.recording = False
+            self._synchronize()
+            self.step_time += time.time() - start
+            self.num_steps += 1
+            self.num_utt += len(batch['xs'])
+            self.num_frames += sum(batch['x_lens']) * self.num_stack
+            self.num_padded_frames += len(batch['xs']) * \
+                max(batch['x_lens']) * self.num_stack
+
+    def _wrap(self, func, name, always=False):
+        profiler = self
+
+        @functools.wraps(func)
+        def _timed(*args, **kwargs):
+            if always and not profiler.recording:
+                # NOTE: data loading is outside of training steps
+                profiler.recording = True
+                try:
+                    with profiler.phase(name):
+                        return func(*args, **kwargs)
+                finally:
+                    profiler.recording = False
+            with profiler.phase(name):
+                return func(*args, **kwargs)
+        return _timed
+
+    def instrument_model(self, model):
+        """Time the encoder, decoder, CTC loss and host-to-device copies.
+            Methods are replaced in the class so that copies of the model
+            (e.g. the best model) work as well. They are timed only inside
+            training steps.
+        Args:
+            model (torch.nn.Module):
+        """
+        cls = type(model)
+        for method_name, phase_name in MODEL_PHASES:
+            if not hasattr(cls, method_name):
+                continue
+            func = getattr(cls, method_name)
+            if getattr(func, '_profiled', False):
+                continue
+            func_timed = self._wrap(func, phase_name)
+            func_timed._profiled = True
+            setattr(cls, method_name, func_timed)
+
+    def instrument_dataset(self, dataset):
+        """Time data loading of the training set.
+        Args:
+            dataset (Dataset):
+        """
+        dataset.next = self._wrap(dataset.next, 'data', always=True)
+
+    def report(self, step, tf_writer=None):
+        """Log statistics since the last report and reset them.
+        Args:
+            step (int):
+            tf_writer (SummaryWriter, optional):
+        """
+        if self.num_steps == 0:
+            return
+
+        scalars = {}
+        for name, t in sorted(self.phase_time.items()):
+            scalars[name + '_ms'] = t / self.num_steps * 1000
+        scalars['step_ms'] = self.step_time / self.num_steps * 1000
+        scalars['frames_per_sec'] = self.num_frames / self.step_time
+        scalars['utt_per_sec'] = self.num_utt / self.step_time
+        scalars['padding_ratio'] = 1 - \
+            self.num_frames / self.num_padded_frames
+        if self.use_cuda:
+            scalars['peak_memory_mb'] = torch.cuda.max_memory_allocated() / \
+                (1024 ** 2)
+
+        logger.info('  profile: ' + ' / '.join(
+            ['%s:%.3f' % (k, v) for k, v in sorted(scalars.items())]))
+        if tf_writer is not None:
+            for k, v in scalars.items():
+                tf_writer.add_scalar('profile/' + k, v, step)
+
+        self._reset()
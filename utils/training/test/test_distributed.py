@@ -0,0 +1,181 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test data-parallel training with two processes (gloo)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import random
+import pickle
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.append(os.path.abspath('../../../'))
+from utils.dataset.base import Base
+from utils.training.distributed import all_reduce_grads
+
+WORLD_SIZE = 2
+NUM_UTT = 22
+BATCH_SIZE = 4
+SORT_STOP_EPOCH = 2
+NUM_EPOCHS = 4
+
+
+class _Dataset(Base):
+    """A dataset whose mini-batches are the data indices themselves."""
+
+    def __init__(self, vocab_file_path):
+        super(_Dataset, self).__init__(vocab_file_path=vocab_file_path)
+        self.batch_size = BATCH_SIZE
+        self.num_enque = None
+        self.max_epoch = None
+        self.sort_utt = True
+        self.shuffle = False
+        self.sort_stop_epoch = SORT_STOP_EPOCH
+
+        self.df = pd.DataFrame({'frame_num': range(100, 100 + NUM_UTT)})
+        self._reset()
+
+    def select_batch_size(self, batch_size, min_frame_num_batch):
+        return batch_size
+
+    def make_batch(self, data_indices):
+        return list(data_indices)
+
+
+def _sample_epochs(dataset):
+    """Returns mini-batches of NUM_EPOCHS epochs."""
+    batches = []
+    for _ in range(NUM_EPOCHS):
+        is_new_epoch = False
+        while not is_new_epoch:
+            batch, is_new_epoch = dataset.next()
+            batches.append(batch)
+    return batches
+
+
+def _init_process_group(rank, save_path):
+    dist.init_process_group(
+        backend='gloo',
+        init_method='file://' + os.path.join(save_path, 'init'),
+        rank=rank, world_size=WORLD_SIZE)
+
+
+def _gather_to_file(rank, obj, path):
+    objs = [None] * WORLD_SIZE
+    dist.all_gather_object(objs, obj)
+    if rank == 0:
+        with open(path, 'wb') as f:
+            pickle.dump(objs, f)
+
+
+def _run_sharding(rank, save_path):
+    _init_process_group(rank, save_path)
+
+    # NOTE: the global random is consumed differently in each process
+    random.seed(rank)
+    dataset = _Dataset(os.path.join(save_path, 'vocab.txt'))
+    dataset.set_rank(rank, WORLD_SIZE)
+    batches = []
+    for _ in range(NUM_EPOCHS):
+        is_new_epoch = False
+        while not is_new_epoch:
+            for _ in range(rank + 1):
+                random.random()
+            batch, is_new_epoch = dataset.next()
+            batches.append(batch)
+
+    _gather_to_file(rank, batches, os.path.join(save_path, 'shards.pkl'))
+    dist.destroy_process_group()
+
+
+def _build_model():
+    torch.manual_seed(1623)
+    return nn.Sequential(nn.Linear(3, 4), nn.Tanh(), nn.Linear(4, 2))
+
+
+def _compute_loss(model, xs, ys):
+    return ((model(xs) - ys) ** 2).sum(dim=1).mean()
+
+
+def _global_batch():
+    generator = torch.Generator().manual_seed(1)
+    xs = torch.randn(8, 3, generator=generator)
+    ys = torch.randn(8, 2, generator=generator)
+    return xs, ys
+
+
+def _run_all_reduce_grads(rank, save_path):
+    _init_process_group(rank, save_path)
+
+    model = _build_model()
+    xs, ys = _global_batch()
+    loss = _compute_loss(model, xs[rank::WORLD_SIZE], ys[rank::WORLD_SIZE])
+    loss.backward()
+    all_reduce_grads(model)
+
+    _gather_to_file(rank, [p.grad.clone() for p in model.parameters()],
+                    os.path.join(save_path, 'grads.pkl'))
+    dist.destroy_process_group()
+
+
+class TestDistributed(unittest.TestCase):
+
+    def setUp(self):
+        self.save_path = tempfile.mkdtemp()
+        with open(os.path.join(self.save_path, 'vocab.txt'), 'w') as f:
+            f.write('a\nb\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.save_path)
+
+    def _load(self, file_name):
+        with open(os.path.join(self.save_path, file_name), 'rb') as f:
+            return pickle.load(f)
+
+    def test_sharding(self):
+        mp.spawn(_run_sharding, args=(self.save_path,),
+                 nprocs=WORLD_SIZE, join=True)
+        shards = self._load('shards.pkl')
+
+        # the global mini-batches in a single process
+        dataset = _Dataset(os.path.join(self.save_path, 'vocab.txt'))
+        dataset.set_rank(0, 1)
+        batches = _sample_epochs(dataset)
+
+        self.assertEqual(len(shards[0]), len(batches))
+        self.assertEqual(len(shards[1]), len(batches))
+        for batch, shard_0, shard_1 in zip(batches, shards[0], shards[1]):
+            self.assertEqual(len(set(shard_0) & set(shard_1)), 0)
+            self.assertEqual(sorted(shard_0 + shard_1), sorted(batch))
+
+        # NOTE: mini-batches are sampled randomly after sort_stop_epoch
+        self.assertFalse(dataset.sort_utt)
+
+    def test_all_reduce_grads(self):
+        mp.spawn(_run_all_reduce_grads, args=(self.save_path,),
+                 nprocs=WORLD_SIZE, join=True)
+        grads = self._load('grads.pkl')
+
+        model = _build_model()
+        xs, ys = _global_batch()
+        _compute_loss(model, xs, ys).backward()
+
+        for grads_rank in grads:
+            for p, grad in zip(model.parameters(), grads_rank):
+                self.assertTrue(torch.allclose(p.grad, grad, atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test periodic model averaging with two processes (gloo)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import torch
+import torch.nn as nn
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.append(os.path.abspath('../../../'))
+from utils.training.local_sgd import ModelAverager
+
+WORLD_SIZE = 2
+PERIOD = 2
+
+
+def _build_model(rank):
+    # NOTE: initial parameters differ among processes and are made the same
+    # by ModelAverager
+    torch.manual_seed(rank)
+    return nn.Linear(2, 3)
+
+
+def _run(rank, save_path, averager_kwargs):
+    dist.init_process_group(
+        backend='gloo',
+        init_method='file://' + os.path.join(save_path, 'init'),
+        rank=rank, world_size=WORLD_SIZE)
+
+    model = _build_model(rank)
+    averager = ModelAverager(model, period=PERIOD, **averager_kwargs)
+    params_init = [p.data.clone() for p in model.parameters()]
+
+    # local updates: each process moves parameters by (rank + 1) per step
+    is_averaged = []
+    for _ in range(PERIOD):
+        with torch.no_grad():
+            for p in model.parameters():
+                p.add_(rank + 1)
+        is_averaged.append(averager.step())
+
+    objs = [None] * WORLD_SIZE
+    dist.all_gather_object(
+        objs, (params_init, [p.data.clone() for p in model.parameters()],
+               is_averaged))
+    if rank == 0:
+        with open(os.path.join(save_path, 'result.pkl'), 'wb') as f:
+            pickle.dump(objs, f)
+    dist.destroy_process_group()
+
+
+class TestModelAverager(unittest.TestCase):
+
+    def setUp(self):
+        self.save_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.save_path)
+
+    def _run(self, **averager_kwargs):
+        # NOTE: a new directory for the init file of each process group
+        save_path = tempfile.mkdtemp(dir=self.save_path)
+        mp.spawn(_run, args=(save_path, averager_kwargs),
+                 nprocs=WORLD_SIZE, join=True)
+        with open(os.path.join(save_path, 'result.pkl'), 'rb') as f:
+            results = pickle.load(f)
+
+        params_init = results[0][0]
+        for params_init_rank, _, is_averaged in results:
+            # all processes start from the parameters of rank 0
+            for p, p_rank in zip(params_init, params_init_rank):
+                self.assertTrue(torch.equal(p, p_rank))
+            self.assertEqual(is_averaged, [False] * (PERIOD - 1) + [True])
+        return params_init, [params for _, params, _ in results]
+
+    def _check(self, params, params_ref):
+        for p, p_ref in zip(params, params_ref):
+            self.assertTrue(torch.allclose(p, p_ref, atol=1e-6))
+
+    def test_averaging(self):
+        params_init, params = self._run()
+
+        # local updates are 2 and 4 in total, whose average is 3
+        for params_rank in params:
+            self._check(params_rank, [p + 3 for p in params_init])
+
+    def test_bmuf(self):
+        # the global update is block_lr * 3 = 1.5, and the momentum is the
+        # same as the update in the first block
+        params_init, params = self._run(
+            block_momentum=0.5, block_lr=0.5, nesterov=False)
+        for params_rank in params:
+            self._check(params_rank, [p + 1.5 for p in params_init])
+
+        # Nesterov-style block momentum looks ahead by 0.5 * 1.5 = 0.75
+        params_init, params = self._run(
+            block_momentum=0.5, block_lr=0.5, nesterov=True)
+        for params_rank in params:
+            self._check(params_rank, [p + 2.25 for p in params_init])
+
+    def test_patterns(self):
+        params_init, params = self._run(patterns=['weight'])
+        weight_init, bias_init = params_init
+        for rank, (weight, bias) in enumerate(params):
+            self._check([weight], [weight_init + 3])
+            # bias is not averaged
+            self._check([bias], [bias_init + PERIOD * (rank + 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
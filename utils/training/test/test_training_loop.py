@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Test gradient accumulation over micro-batches and OOM recovery (pytorch)."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import copy
+import unittest
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+torch.manual_seed(1623)
+
+sys.path.append(os.path.abspath('../../../'))
+from models.pytorch.base import ModelBase
+from utils.training import training_loop
+from utils.training.training_loop import _split_batch, _split_batch_in_halves, _accumulate_and_update
+
+INPUT_SIZE = 4
+NUM_STACK = 2
+X_LENS = [10, 9, 7, 5, 4, 2]
+
+
+class _Model(ModelBase):
+    """A model whose loss of each utterance does not depend on padding."""
+
+    def __init__(self, max_batch_size=None):
+        nn.Module.__init__(self)
+        self.num_stack = NUM_STACK
+        self.fc = nn.Linear(INPUT_SIZE, 1)
+        self.optimizer = optim.SGD(self.parameters(), lr=0.1)
+        self.num_steps = 0
+
+        # NOTE: GPU memory runs out above this batch size
+        self.max_batch_size = max_batch_size
+        self.batch_sizes = []
+
+    def forward(self, xs, ys, x_lens, y_lens):
+        self.batch_sizes.append(len(xs))
+        if self.max_batch_size is not None and len(xs) > self.max_batch_size:
+            raise RuntimeError('CUDA out of memory. Tried to allocate 2.00 GiB')
+        xs = torch.from_numpy(xs)
+        x_lens = torch.from_numpy(x_lens)
+        mask = (torch.arange(xs.size(1)).unsqueeze(0) <
+                x_lens.unsqueeze(1)).float()
+        logits = self.fc(xs).squeeze(2)
+        # the mean over valid frames, then over utterances
+        loss = ((logits - torch.from_numpy(ys)) ** 2 * mask).sum(dim=1)
+        return (loss / x_lens.float()).mean()
+
+    def advance_step(self):
+        self.num_steps += 1
+
+
+def _generate_batch():
+    np.random.seed(1)
+    x_lens = np.array(X_LENS, dtype=np.int32)
+    xs = np.random.randn(len(X_LENS), max(X_LENS), INPUT_SIZE).astype(np.float32)
+    for i, x_len in enumerate(x_lens):
+        xs[i, x_len:] = 0
+    ys = np.random.randn(len(X_LENS), 1).astype(np.float32)
+    y_lens = np.ones(len(X_LENS), dtype=np.int32)
+    return {'xs': xs, 'x_lens': x_lens, 'ys': ys, 'y_lens': y_lens}
+
+
+def _forward(model):
+    def forward(micro_batch):
+        return [model(micro_batch['xs'], micro_batch['ys'],
+                      micro_batch['x_lens'], micro_batch['y_lens'])]
+    return forward
+
+
+def _grads(model):
+    return [p.grad.clone() for p in model.parameters()]
+
+
+class TestAccumulation(unittest.TestCase):
+
+    def test_split_batch(self):
+        batch = _generate_batch()
+
+        # NOTE: the frame budget is counted before frame stacking
+        for max_frames_per_step in [40, 30, 20, 1]:
+            micro_batches = _split_batch(batch, max_frames_per_step, NUM_STACK)
+            self.assertAlmostEqual(sum(w for _, w in micro_batches), 1.)
+
+            x_lens = []
+            for micro_batch, weight in micro_batches:
+                batch_size = len(micro_batch['xs'])
+                max_frame_num = max(micro_batch['x_lens']) * NUM_STACK
+                # an utterance over the budget is a micro-batch by itself
+                if batch_size > 1:
+                    self.assertLessEqual(max_frame_num * batch_size,
+                                         max_frames_per_step)
+                self.assertAlmostEqual(weight, batch_size / len(X_LENS))
+                # extra padding is removed
+                self.assertEqual(micro_batch['xs'].shape[1],
+                                 max(micro_batch['x_lens']))
+                x_lens += list(micro_batch['x_lens'])
+            self.assertEqual(x_lens, X_LENS)
+
+        micro_batches = _split_batch(batch, 40, NUM_STACK)
+        self.assertEqual([list(micro_batch['x_lens']) for micro_batch, _ in micro_batches],
+                         [[10, 9], [7, 5], [4, 2]])
+
+        # 0 means the mini-batch is not split
+        micro_batches = _split_batch(batch, 0, NUM_STACK)
+        self.assertEqual(len(micro_batches), 1)
+        self.assertIs(micro_batches[0][0], batch)
+        self.assertEqual(micro_batches[0][1], 1.)
+
+    def test_accumulate_and_update(self):
+        batch = _generate_batch()
+        model = _Model()
+        model_ref = copy.deepcopy(model)
+        model_full = copy.deepcopy(model)
+
+        loss_vals = _accumulate_and_update(
+            model, batch, _forward(model), clip_grad_norm=0,
+            max_frames_per_step=40, profiler=None, data_parallel=False)
+        self.assertEqual(model.num_steps, 1)
+
+        # the reference accumulated by hand over the same micro-batches
+        loss_ref = 0.
+        for micro_batch, weight in _split_batch(batch, 40, NUM_STACK):
+            loss = _forward(model_ref)(micro_batch)[0] * weight
+            loss.backward()
+            loss_ref += loss.item()
+        for grad, grad_ref in zip(_grads(model), _grads(model_ref)):
+            self.assertTrue(torch.allclose(grad, grad_ref, atol=1e-6))
+        self.assertAlmostEqual(loss_vals[0], loss_ref, places=5)
+
+        # the same as the gradient of the whole mini-batch
+        loss_full = _forward(model_full)(batch)[0]
+        loss_full.backward()
+        for grad, grad_full in zip(_grads(model), _grads(model_full)):
+            self.assertTrue(torch.allclose(grad, grad_full, atol=1e-6))
+        self.assertAlmostEqual(loss_vals[0], loss_full.item(), places=5)
+
+        # parameters are updated once
+        model_ref.optimizer.step()
+        for p, p_ref in zip(model.parameters(), model_ref.parameters()):
+            self.assertTrue(torch.allclose(p, p_ref, atol=1e-6))
+
+
+class TestOOMRecovery(unittest.TestCase):
+
+    def setUp(self):
+        training_loop.split_stats.clear()
+
+    def tearDown(self):
+        training_loop.split_stats.clear()
+
+    def test_split_batch_in_halves(self):
+        batch = _generate_batch()
+        # [10, 9] and [7]
+        micro_batches = [_split_batch(batch, 40, NUM_STACK)[0],
+                         _split_batch(batch, 1, NUM_STACK)[2]]
+        micro_batches = _split_batch_in_halves(micro_batches)
+
+        # a micro-batch of one utterance is kept as it is
+        self.assertEqual([list(micro_batch['x_lens']) for micro_batch, _ in micro_batches],
+                         [[10], [9], [7]])
+        self.assertEqual([w for _, w in micro_batches],
+                         [1. / 6, 1. / 6, 1. / 6])
+        self.assertEqual(micro_batches[1][0]['xs'].shape[1], 9)
+
+        # odd batch sizes
+        micro_batches = _split_batch_in_halves(
+            _split_batch(batch, 0, NUM_STACK))
+        micro_batches = _split_batch_in_halves(micro_batches)
+        self.assertEqual([list(micro_batch['x_lens']) for micro_batch, _ in micro_batches],
+                         [[10], [9, 7], [5], [4, 2]])
+        self.assertAlmostEqual(sum(w for _, w in micro_batches), 1.)
+
+    def test_split(self):
+        batch = _generate_batch()
+        model = _Model(max_batch_size=2)
+        model_full = copy.deepcopy(model)
+        model_full.max_batch_size = None
+
+        loss_vals = _accumulate_and_update(
+            model, batch, _forward(model), clip_grad_norm=0,
+            max_frames_per_step=0, profiler=None, data_parallel=False)
+
+        # 6 -> 3 + 3 -> 1 + 2 + 1 + 2
+        self.assertEqual(model.batch_sizes, [6, 3, 1, 2, 1, 2])
+        self.assertEqual(model.num_steps, 1)
+
+        loss_full = _forward(model_full)(batch)[0]
+        loss_full.backward()
+        for grad, grad_full in zip(_grads(model), _grads(model_full)):
+            self.assertTrue(torch.allclose(grad, grad_full, atol=1e-6))
+        self.assertAlmostEqual(loss_vals[0], loss_full.item(), places=5)
+
+        # the split is recorded in the bin of the longest utterance
+        self.assertEqual(dict(training_loop.split_stats), {
+            (0, 500): {'num_split': 1, 'num_skip': 0, 'max_num_micro_batches': 4}})
+
+    def test_skip(self):
+        batch = _generate_batch()
+        model = _Model(max_batch_size=0)
+        params_init = [p.data.clone() for p in model.parameters()]
+
+        with self.assertRaises(RuntimeError) as cm:
+            _accumulate_and_update(
+                model, batch, _forward(model), clip_grad_norm=0,
+                max_frames_per_step=0, profiler=None, data_parallel=False)
+        self.assertIn('out of memory', str(cm.exception))
+
+        # halved until every micro-batch has one utterance, then skipped
+        self.assertEqual(model.batch_sizes, [6, 3, 1, 1])
+        self.assertEqual(model.num_steps, 0)
+        for p, p_init in zip(model.parameters(), params_init):
+            self.assertTrue(torch.equal(p.data, p_init))
+            self.assertTrue(p.grad is None or p.grad.abs().sum().item() == 0)
+        self.assertEqual(dict(training_loop.split_stats), {
+            (0, 500): {'num_split': 0, 'num_skip': 1, 'max_num_micro_batches': 0}})
+
+    def test_other_errors(self):
+        def forward(micro_batch):
+            raise RuntimeError('expected a tensor')
+
+        # NOTE: errors other than OOM are not recovered in a single process
+        model = _Model()
+        with self.assertRaises(RuntimeError) as cm:
+            _accumulate_and_update(
+                model, _generate_batch(), forward, clip_grad_norm=0,
+                max_frames_per_step=0, profiler=None, data_parallel=False)
+        self.assertEqual(str(cm.exception), 'expected a tensor')
+        self.assertEqual(len(training_loop.split_stats), 0)
+
+        # in data-parallel training, the mini-batch is skipped instead
+        with self.assertRaises(RuntimeError) as cm:
+            _accumulate_and_update(
+                model, _generate_batch(), forward, clip_grad_norm=0,
+                max_frames_per_step=0, profiler=None, data_parallel=True)
+        self.assertIn('skipped in all processes', str(cm.exception))
+        self.assertEqual(training_loop.split_stats[(0, 500)]['num_skip'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
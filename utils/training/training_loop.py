@@ -7,11 +7,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+from collections import defaultdict
+from contextlib import contextmanager
 import logging
 logger = logging.getLogger('training')
 
 import torch
 
+from utils.training.distributed import all_reduce_max, all_reduce_grads
+
 try:
     import cupy
 except:
@@ -23,14 +27,32 @@ except:
 
 INF = float("inf")
 
+# NOTE: the number of input frames in each bin of split statistics
+SPLIT_STATS_BIN = 500
+
+# Statistics of mini-batches split for OOM recovery
+# key: (min_frame_num, max_frame_num) of the bin
+# value: dict of counters
+split_stats = defaultdict(
+    lambda: {'num_split': 0, 'num_skip': 0, 'max_num_micro_batches': 0})
 
-def train_step(model, batch, clip_grad_norm, backend):
+
+def train_step(model, batch, clip_grad_norm, backend, max_frames_per_step=0,
+               profiler=None, data_parallel=False):
     """
     Args:
         model (torch.nn.Module or chainer.Chain):
         batch (tuple):
         clip_grad_norm (float):
         backend (string): pytorch or chainer
+        max_frames_per_step (int, optional): the maximum number of padded
+            input frames before frame stacking in a micro-batch, as in the
+            logs. If the mini-batch exceeds it, gradients are accumulated
+            over micro-batches and parameters are updated once. 0 means the
+            mini-batch is not split (pytorch only).
+        profiler (StepProfiler, optional): time each phase (pytorch only)
+        data_parallel (bool, optional): if True, gradients are averaged over
+            all processes (pytorch only)
     Returns:
         model (torch.nn.Module or chainer.Chain):
         loss_train_val (float):
@@ -39,17 +61,14 @@ def train_step(model, batch, clip_grad_norm, backend):
     try:
         # Step for parameter update
         if backend == 'pytorch':
-            model.optimizer.zero_grad()
-            loss_train = model(batch['xs'], batch['ys'],
-                               batch['x_lens'], batch['y_lens'])
-            loss_train.backward()
-            if clip_grad_norm > 0:
-                torch.nn.utils.clip_grad_norm_(
-                    model.parameters(), clip_grad_norm)
-            model.optimizer.step()
-            # TODO: Add scheduler
+            def forward(micro_batch):
+                return [model(micro_batch['xs'], micro_batch['ys'],
+                              micro_batch['x_lens'], micro_batch['y_lens'])]
 
-            loss_train_val = loss_train.item()
+            loss_train_val = _train_step_pytorch(
+                model, batch, forward, clip_grad_norm, max_frames_per_step,
+                profiler, data_parallel)[0]
+            # TODO: Add scheduler
 
         elif backend == 'chainer':
             model.optimizer.target.cleargrads()
@@ -61,11 +80,12 @@ def train_step(model, batch, clip_grad_norm, backend):
 
             loss_train_val = loss_train.data
 
-        del loss_train
+            del loss_train
 
     except RuntimeError as e:
         logger.warning('!!!Skip mini-batch!!! (max_frame_num: %d, batch: %d)' %
                        (max(batch['x_lens']) * model.num_stack, len(batch['xs'])))
+        loss_train_val = 0.
         if backend == 'pytorch':
             model.optimizer.zero_grad()
             torch.cuda.empty_cache()
@@ -85,13 +105,21 @@ def train_step(model, batch, clip_grad_norm, backend):
     return model, loss_train_val
 
 
-def train_hierarchical_step(model, batch, clip_grad_norm, backend):
+def train_hierarchical_step(model, batch, clip_grad_norm, backend,
+                            max_frames_per_step=0, profiler=None,
+                            data_parallel=False):
     """
     Args:
         model (torch.nn.Module or chainer.Chain):
         batch (tuple):
         clip_grad_norm (float):
         backend (string): pytorch or chainer
+        max_frames_per_step (int, optional): the maximum number of padded
+            input frames before frame stacking in a micro-batch
+            (pytorch only)
+        profiler (StepProfiler, optional): time each phase (pytorch only)
+        data_parallel (bool, optional): if True, gradients are averaged over
+            all processes (pytorch only)
     Returns:
         model (torch.nn.Module or chainer.Chain):
         loss_train_val (float):
@@ -102,21 +130,15 @@ def train_hierarchical_step(model, batch, clip_grad_norm, backend):
     try:
         # Step for parameter update
         if backend == 'pytorch':
-            model.optimizer.zero_grad()
-            loss_train, loss_main_train, loss_sub_train = model(
-                batch['xs'], batch['ys'],
-                batch['x_lens'], batch['y_lens'],
-                batch['ys_sub'], batch['y_lens_sub'])
-            loss_train.backward()
-            if clip_grad_norm > 0:
-                torch.nn.utils.clip_grad_norm_(
-                    model.parameters(), clip_grad_norm)
-            model.optimizer.step()
-            # TODO: Add scheduler
+            def forward(micro_batch):
+                return model(micro_batch['xs'], micro_batch['ys'],
+                             micro_batch['x_lens'], micro_batch['y_lens'],
+                             micro_batch['ys_sub'], micro_batch['y_lens_sub'])
 
-            loss_train_val = loss_train.item()
-            loss_main_train_val = loss_main_train.item()
-            loss_sub_train_val = loss_sub_train.item()
+            loss_train_val, loss_main_train_val, loss_sub_train_val = _train_step_pytorch(
+                model, batch, forward, clip_grad_norm, max_frames_per_step,
+                profiler, data_parallel)
+            # TODO: Add scheduler
 
         elif backend == 'chainer':
             model.optimizer.target.cleargrads()
@@ -132,11 +154,12 @@ def train_hierarchical_step(model, batch, clip_grad_norm, backend):
             loss_main_train_val = loss_main_train.data
             loss_sub_train_val = loss_sub_train.data
 
-        del loss_train, loss_main_train, loss_sub_train
+            del loss_train, loss_main_train, loss_sub_train
 
     except RuntimeError as e:
         logger.warning('!!!Skip mini-batch!!! (max_frame_num: %d, batch: %d)' %
                        (max(batch['x_lens']) * model.num_stack, len(batch['xs'])))
+        loss_train_val, loss_main_train_val, loss_sub_train_val = 0., 0., 0.
         model.optimizer.zero_grad()
         torch.cuda.empty_cache()
 
@@ -151,3 +174,311 @@ def train_hierarchical_step(model, batch, clip_grad_norm, backend):
         loss_train_val, loss_main_train_val, loss_sub_train_val = 0., 0., 0.
 
     return model, loss_train_val, loss_main_train_val, loss_sub_train_val
+
+
+def train_lm_step(model, batch, clip_grad_norm):
+    """Parameter update of language models (pytorch only).
+    Args:
+        model (torch.nn.Module):
+        batch (tuple):
+        clip_grad_norm (float):
+    Returns:
+        model (torch.nn.Module):
+        loss_train_val (float):
+    """
+    loss_train_val = 0.
+    try:
+        model.optimizer.zero_grad()
+        loss_train = model(batch['ys'], batch['y_lens'])
+        _backward(model, loss_train)
+        _update(model, clip_grad_norm)
+        loss_train_val = loss_train.item()
+        del loss_train
+
+    except RuntimeError as e:
+        if 'out of memory' not in str(e):
+            raise
+        logger.warning('!!!Skip mini-batch!!! (max_label_num: %d, batch: %d)' %
+                       (max(batch['y_lens']), len(batch['ys'])))
+        loss_train_val = 0.
+        model.optimizer.zero_grad()
+        torch.cuda.empty_cache()
+
+    if loss_train_val == INF or loss_train_val == -INF:
+        logger.warning(
+            "WARNING: received an inf loss, setting loss value to 0.")
+        loss_train_val = 0
+
+    return model, loss_train_val
+
+
+def _train_step_pytorch(model, batch, forward, clip_grad_norm,
+                        max_frames_per_step, profiler=None,
+                        data_parallel=False):
+    """Accumulate gradients over micro-batches and update parameters once.
+        If GPU memory runs out, the micro-batches are split in halves and
+        the step is re-run from scratch. In data-parallel training, whether
+        to update, split or skip is agreed among all processes, and
+        gradients are all-reduced once after all backward passes, because
+        the number of micro-batches may differ between processes.
+    Args:
+        model (torch.nn.Module):
+        batch (dict):
+        forward (function): takes a micro-batch, and returns a list of
+            losses, where the first one is used for back-propagation
+        clip_grad_norm (float):
+        max_frames_per_step (int):
+        profiler (StepProfiler, optional):
+        data_parallel (bool, optional):
+    Returns:
+        loss_vals (list): list of float values of losses
+    """
+    # NOTE: the training step of the model (e.g. for scheduled sampling) is
+    # advanced once per parameter update, not per micro-batch or retry
+    with _step(profiler, batch), model.defer_step():
+        return _accumulate_and_update(model, batch, forward, clip_grad_norm,
+                                      max_frames_per_step, profiler,
+                                      data_parallel)
+
+
+# Status of a step agreed among processes in data-parallel training
+STEP_OK = 0
+STEP_SPLIT = 1
+STEP_SKIP = 2
+
+
+def _accumulate_and_update(model, batch, forward, clip_grad_norm,
+                           max_frames_per_step, profiler, data_parallel):
+    micro_batches = _split_batch(batch, max_frames_per_step, model.num_stack)
+    num_micro_batches_init = len(micro_batches)
+    while True:
+        status = STEP_OK
+        try:
+            model.optimizer.zero_grad()
+            loss_vals = None
+            for micro_batch, weight in micro_batches:
+                with _phase(profiler, 'forward'):
+                    losses = forward(micro_batch)
+                # NOTE: losses are averaged over utterances in each micro-batch
+                with _phase(profiler, 'backward'):
+                    _backward(model, losses[0] * weight)
+                loss_vals_micro = [l.item() * weight for l in losses]
+                if loss_vals is None:
+                    loss_vals = loss_vals_micro
+                else:
+                    loss_vals = [a + b for a, b in zip(loss_vals, loss_vals_micro)]
+                del losses
+
+        except RuntimeError as e:
+            if 'out of memory' not in str(e):
+                if not data_parallel:
+                    raise
+                # NOTE: the mini-batch is skipped in all processes
+                logger.warning('Skip mini-batch in all processes: %s' % str(e))
+                status = STEP_SKIP
+            elif all(len(micro_batch['xs']) == 1 for micro_batch, _ in micro_batches):
+                status = STEP_SKIP
+            else:
+                status = STEP_SPLIT
+            # NOTE: partially accumulated gradients are discarded
+            losses = None
+            model.optimizer.zero_grad()
+            torch.cuda.empty_cache()
+
+        if data_parallel:
+            status_all = all_reduce_max(status)
+        else:
+            status_all = status
+
+        if status_all == STEP_OK:
+            if data_parallel:
+                with _phase(profiler, 'all_reduce'):
+                    all_reduce_grads(model)
+            _update(model, clip_grad_norm, profiler)
+            model.advance_step()
+            break
+
+        model.optimizer.zero_grad()
+        if status_all == STEP_SKIP:
+            _record_split_stats(batch, model.num_stack, None)
+            raise RuntimeError('out of memory (skipped in all processes)')
+
+        # NOTE: only processes which ran out of memory split micro-batches,
+        # and the others re-run the same ones
+        if status == STEP_SPLIT:
+            micro_batches = _split_batch_in_halves(micro_batches)
+            logger.warning('OOM: split mini-batch into %d micro-batches (max_frame_num: %d, batch: %d)' %
+                           (len(micro_batches), max(batch['x_lens']) * model.num_stack, len(batch['xs'])))
+
+    if len(micro_batches) > num_micro_batches_init:
+        _record_split_stats(batch, model.num_stack, len(micro_batches))
+
+    return loss_vals
+
+
+@contextmanager
+def _step(profiler, batch):
+    if profiler is None:
+        yield
+    else:
+        with profiler.step(batch):
+            yield
+
+
+@contextmanager
+def _phase(profiler, name):
+    if profiler is None:
+        yield
+    else:
+        with profiler.phase(name):
+            yield
+
+
+def _slice_batch(batch, start, end):
+    """Slice a mini-batch and remove extra padding.
+    Args:
+        batch (dict):
+        start (int):
+        end (int):
+    Returns:
+        micro_batch (dict):
+    """
+    micro_batch = {}
+    for k, v in batch.items():
+        micro_batch[k] = v[start:end]
+    micro_batch['xs'] = micro_batch['xs'][:, :max(micro_batch['x_lens'])]
+    for k in ['ys', 'ys_sub']:
+        if k in batch.keys():
+            y_lens_key = k.replace('ys', 'y_lens')
+            micro_batch[k] = micro_batch[k][
+                :, :max(1, max(micro_batch[y_lens_key]))]
+    return micro_batch
+
+
+def _split_batch(batch, max_frames_per_step, num_stack=1):
+    """Split a mini-batch into micro-batches whose padded size is within the
+        frame budget. Utterances are kept in the original order.
+    Args:
+        batch (dict):
+        max_frames_per_step (int): the frame budget counted before frame
+            stacking. 0 means the mini-batch is not split
+        num_stack (int, optional): the number of frames stacked in x_lens
+    Returns:
+        micro_batches (list): list of tuples of
+            (micro-batch (dict), weight (float)), where weight is the ratio
+            of the number of utterances to the mini-batch size
+    """
+    batch_size = len(batch['xs'])
+    if max_frames_per_step <= 0:
+        return [(batch, 1.)]
+
+    micro_batches = []
+    start = 0
+    while start < batch_size:
+        end = start + 1
+        max_frame_num = batch['x_lens'][start] * num_stack
+        while end < batch_size:
+            max_frame_num_next = max(max_frame_num,
+                                     batch['x_lens'][end] * num_stack)
+            if max_frame_num_next * (end + 1 - start) > max_frames_per_step:
+                break
+            max_frame_num = max_frame_num_next
+            end += 1
+        micro_batches += [(_slice_batch(batch, start, end),
+                           (end - start) / batch_size)]
+        start = end
+
+    return micro_batches
+
+
+def _split_batch_in_halves(micro_batches):
+    """Split each micro-batch into two halves.
+    Args:
+        micro_batches (list): list of tuples of (micro-batch (dict), weight (float))
+    Returns:
+        micro_batches (list): list of tuples of (micro-batch (dict), weight (float))
+    """
+    micro_batches_new = []
+    for micro_batch, weight in micro_batches:
+        batch_size = len(micro_batch['xs'])
+        if batch_size == 1:
+            micro_batches_new += [(micro_batch, weight)]
+            continue
+        half = batch_size // 2
+        micro_batches_new += [
+            (_slice_batch(micro_batch, 0, half), weight * half / batch_size),
+            (_slice_batch(micro_batch, half, batch_size),
+             weight * (batch_size - half) / batch_size)]
+    return micro_batches_new
+
+
+def _record_split_stats(batch, num_stack, num_micro_batches):
+    """Record which length range needed splitting for OOM recovery.
+    Args:
+        batch (dict):
+        num_stack (int):
+        num_micro_batches (int): None means the mini-batch was skipped
+    """
+    max_frame_num = max(batch['x_lens']) * num_stack
+    bin_start = int(max_frame_num // SPLIT_STATS_BIN) * SPLIT_STATS_BIN
+    stats = split_stats[(bin_start, bin_start + SPLIT_STATS_BIN)]
+    if num_micro_batches is None:
+        stats['num_skip'] += 1
+    else:
+        stats['num_split'] += 1
+        stats['max_num_micro_batches'] = max(
+            stats['max_num_micro_batches'], num_micro_batches)
+
+
+def log_split_stats():
+    """Report statistics of mini-batches split for OOM recovery."""
+    if len(split_stats) == 0:
+        return
+    logger.info('===== OOM recovery statistics =====')
+    logger.info('frame range: #split / #skip / max #micro-batches')
+    for (bin_start, bin_end), stats in sorted(split_stats.items()):
+        logger.info('%d-%d: %d / %d / %d' %
+                    (bin_start, bin_end, stats['num_split'], stats['num_skip'],
+                     stats['max_num_micro_batches']))
+
+
+def _backward(model, loss):
+    """Compute gradients (pytorch).
+    Args:
+        model (torch.nn.Module):
+        loss (torch.FloatTensor): A tensor of size `[]`
+    """
+    scaler = getattr(model, 'scaler', None)
+    if scaler is not None and scaler.is_enabled():
+        # NOTE: scale the loss to avoid underflow of float16 gradients
+        scaler.scale(loss).backward()
+    else:
+        loss.backward()
+
+
+def _update(model, clip_grad_norm, profiler=None):
+    """Update parameters with accumulated gradients (pytorch).
+    Args:
+        model (torch.nn.Module):
+        clip_grad_norm (float):
+        profiler (StepProfiler, optional):
+    """
+    scaler = getattr(model, 'scaler', None)
+    if scaler is not None and scaler.is_enabled():
+        with _phase(profiler, 'clip_grad'):
+            if clip_grad_norm > 0:
+                # NOTE: gradients must be unscaled before clipping
+                scaler.unscale_(model.optimizer)
+                torch.nn.utils.clip_grad_norm_(
+                    model.parameters(), clip_grad_norm)
+        with _phase(profiler, 'optimizer'):
+            # NOTE: the update is skipped if inf or nan gradients are found
+            scaler.step(model.optimizer)
+            scaler.update()
+    else:
+        with _phase(profiler, 'clip_grad'):
+            if clip_grad_norm > 0:
+                torch.nn.utils.clip_grad_norm_(
+                    model.parameters(), clip_grad_norm)
+        with _phase(profiler, 'optimizer'):
+            model.optimizer.step()